@@ -0,0 +1,60 @@
+"""
+Compares DataFrame to MongoDB documents conversion used during uploads: previous ``to_json``/``json.loads`` round-trip
+and column-wise ``core.ingestion.dataframe_to_documents``.
+
+Run from project root::
+
+    $ python benchmarks/ingestion.py
+"""
+import json
+import os
+import sys
+import timeit
+
+import numpy
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.ingestion import dataframe_to_documents  # noqa: E402
+
+CHUNK_SIZE = 2048
+
+
+def build_table(rows: int, columns: int) -> pd.DataFrame:
+    """
+    Builds table with string, integer, float (with missing values) and date columns, repeated up to ``columns``
+    """
+    rng = numpy.random.default_rng(0)
+    data = {}
+    for i in range(columns):
+        kind = i % 4
+        if kind == 0:
+            data[f'species_{i}'] = rng.choice(['deer', 'bear', 'wolf', 'bison', 'lynx'], rows)
+        elif kind == 1:
+            data[f'count_{i}'] = rng.integers(0, 1000, rows)
+        elif kind == 2:
+            values = rng.random(rows) * 100
+            values[rng.random(rows) < 0.1] = numpy.nan
+            data[f'height_{i}'] = values
+        else:
+            data[f'observed_{i}'] = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 10 ** 6, rows), 's')
+    return pd.DataFrame(data)
+
+
+def json_round_trip(df: pd.DataFrame) -> list:
+    return json.loads(df.to_json(orient='records', date_format='iso'))
+
+
+def measure(name: str, df: pd.DataFrame, repeat: int = 5):
+    chunks = [df.iloc[i:i + CHUNK_SIZE] for i in range(0, len(df), CHUNK_SIZE)]
+    print(f'{name}: {df.shape[0]} rows x {df.shape[1]} columns, chunks of {CHUNK_SIZE} rows')
+    for label, convert in (('to_json + json.loads', json_round_trip),
+                           ('dataframe_to_documents', dataframe_to_documents)):
+        seconds = min(timeit.repeat(lambda: [convert(chunk) for chunk in chunks], number=1, repeat=repeat))
+        print(f'  {label:<24} {df.shape[0] / seconds:>12,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    measure('Tall table', build_table(200000, 8))
+    measure('Wide table', build_table(20000, 200))
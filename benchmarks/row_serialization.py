@@ -0,0 +1,72 @@
+"""
+Compares serialization of pages of datatable rows returned by retrieve: previous per-row
+``DatatableRowsReadOnlySerializer`` and batch ``DatatableRowsListSerializer``.
+
+Run from project root, with environment of the application (eg.: in ``ce_backend`` container)::
+
+    $ python benchmarks/row_serialization.py
+"""
+import os
+import sys
+import timeit
+
+import django
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'collection_editor.settings')
+django.setup()
+
+from rest_framework import serializers  # noqa: E402
+
+from core.serializers import DatatableRowsReadOnlySerializer  # noqa: E402
+
+COLUMNS = 12
+
+
+class PerRowSerializer(serializers.Serializer):
+    """
+    Previous row serializer, running serializer machinery for every row
+    """
+
+    def to_representation(self, instance):
+        ret = super().to_representation(instance)
+        for key, val in instance.items():
+            ret[key] = str(val) if val else ''
+        return ret
+
+
+def build_rows(rows: int) -> list:
+    """
+    Builds rows with string, integer, float (with missing values) and date columns, like uploaded ones
+    """
+    species = ['deer', 'bear', 'wolf', 'bison', 'lynx']
+    page = []
+    for i in range(rows):
+        row = {'_id': ObjectId()}
+        for j in range(COLUMNS):
+            kind = j % 4
+            if kind == 0:
+                row[f'species_{j}'] = species[(i + j) % len(species)]
+            elif kind == 1:
+                row[f'count_{j}'] = (i * j) % 1000
+            elif kind == 2:
+                row[f'height_{j}'] = None if i % 10 == 0 else i / 7
+            else:
+                row[f'observed_{j}'] = f'2020-01-{i % 28 + 1:02d}T00:00:00.000Z'
+        page.append(row)
+    return page
+
+
+def measure(rows: int, repeat: int = 3):
+    page = build_rows(rows)
+    print(f'Page of {rows} rows x {COLUMNS + 1} fields')
+    for label, serializer_class in (('per row serializer', PerRowSerializer),
+                                    ('batch serializer', DatatableRowsReadOnlySerializer)):
+        seconds = min(timeit.repeat(lambda: serializer_class(page, many=True).data, number=1, repeat=repeat))
+        print(f'  {label:<20} {rows / seconds:>12,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    for page_size in (1000, 10000, 100000):
+        measure(page_size)
@@ -194,6 +194,60 @@ SUPPORTED_MIME_TYPES = {
     'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'excel'
 }
 
+# Datatable uploads
+
+# Number of rows parsed and inserted at once, peak upload memory is proportional to it
+DATATABLE_UPLOAD_CHUNK_SIZE = int(os.environ.get('DATATABLE_UPLOAD_CHUNK_SIZE', 2048))
+DATATABLE_UPLOAD_ENCODING = os.environ.get('DATATABLE_UPLOAD_ENCODING', 'utf-8')
+# Number of threads inserting parsed chunks, 0 inserts chunks in parsing thread
+DATATABLE_UPLOAD_WRITERS = int(os.environ.get('DATATABLE_UPLOAD_WRITERS', 2))
+# Maximal number of parsed chunks waiting for insert
+DATATABLE_UPLOAD_QUEUE_SIZE = int(os.environ.get('DATATABLE_UPLOAD_QUEUE_SIZE', 4))
+# Age in seconds after which collection left by interrupted upload is dropped
+DATATABLE_STAGING_TTL = int(os.environ.get('DATATABLE_STAGING_TTL', 24 * 60 * 60))
+
+# Datatable rows
+
+# Number of rows fetched and encoded at once when rows are streamed
+DATATABLE_STREAM_BATCH_SIZE = int(os.environ.get('DATATABLE_STREAM_BATCH_SIZE', 1000))
+# Maximal number of operations of one batch row write (`rows/batch/` endpoint)
+DATATABLE_BATCH_MAX_OPERATIONS = int(os.environ.get('DATATABLE_BATCH_MAX_OPERATIONS', 10000))
+# Number of history entries of batch row write inserted to database in one query
+DATATABLE_BATCH_HISTORY_SIZE = int(os.environ.get('DATATABLE_BATCH_HISTORY_SIZE', 1000))
+# Compress rows stored in history of row changes
+DATATABLE_HISTORY_COMPRESSION = os.environ.get('DATATABLE_HISTORY_COMPRESSION', 'False').lower() in ('true', '1')
+
+# Datatable row counts
+
+# 'exact' counts all rows matching filters, 'capped' stops counting at DATATABLE_COUNT_CAP
+DATATABLE_COUNT_MODE = os.environ.get('DATATABLE_COUNT_MODE', 'exact')
+DATATABLE_COUNT_CAP = int(os.environ.get('DATATABLE_COUNT_CAP', 10000))
+# Time in seconds counts of filtered rows are cached for
+DATATABLE_COUNT_CACHE_TIMEOUT = int(os.environ.get('DATATABLE_COUNT_CACHE_TIMEOUT', 5 * 60))
+# Maximal number of indexes built automatically (from filtered and sorted columns) per datatable
+DATATABLE_INDEX_BUDGET = int(os.environ.get('DATATABLE_INDEX_BUDGET', 5))
+# Minimal (decaying) number of uses of columns combination to build an index for it
+DATATABLE_INDEX_MIN_HITS = int(os.environ.get('DATATABLE_INDEX_MIN_HITS', 20))
+# Interval in seconds between syncs of automatic indexes in worker, 0 disables them
+DATATABLE_INDEX_SYNC_INTERVAL = int(os.environ.get('DATATABLE_INDEX_SYNC_INTERVAL', 60 * 60))
+# Mongo DB collection usage of filtered and sorted columns is recorded to
+DATATABLE_INDEX_USAGE_COLLECTION = os.environ.get('DATATABLE_INDEX_USAGE_COLLECTION', '_index_usage')
+
+# Background jobs
+
+# Number of processes running jobs of one worker (`manage.py run_worker`)
+JOB_WORKER_PROCESSES = int(os.environ.get('JOB_WORKER_PROCESSES', 2))
+# Interval in seconds between checks for new jobs
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+# Time in seconds without progress after which running job is considered interrupted
+JOB_STALE_TIMEOUT = int(os.environ.get('JOB_STALE_TIMEOUT', 60 * 60))
+# Maximal number of Dataverse exports running at once, in all workers
+EXPORT_JOB_CONCURRENCY = int(os.environ.get('EXPORT_JOB_CONCURRENCY', 2))
+# Number of attempts of export failed because Dataverse couldn't be reached or was overloaded
+EXPORT_JOB_MAX_ATTEMPTS = int(os.environ.get('EXPORT_JOB_MAX_ATTEMPTS', 3))
+# Delay in seconds before first retry of export, doubled after every attempt
+EXPORT_JOB_RETRY_DELAY = int(os.environ.get('EXPORT_JOB_RETRY_DELAY', 60))
+
 # Mongo DB
 
 MONGO_DATABASE = os.environ.get('MONGO_DATABASE')
@@ -204,14 +258,32 @@ MONGO_PORT = int(os.environ.get('MONGO_PORT', 27017))
 MONGO_USER = os.environ.get('MONGO_USER')
 MONGO_PASSWORD = os.environ.get('MONGO_PASSWORD')
 
+# Mongo DB connection pool, shared by all datatables of a process
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 20000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 30000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ['MONGO_SOCKET_TIMEOUT_MS']) if os.environ.get('MONGO_SOCKET_TIMEOUT_MS') else None
+# Coma separated wire compressors, eg.: 'zstd,snappy,zlib'
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')
+# Connect to Mongo DB when WSGI application is loaded (in every gunicorn worker)
+MONGO_WARM_UP = os.environ.get('MONGO_WARM_UP', 'True').lower() in ('true', '1')
+
 # Dataverse
 
 DATAVERSE_URL = os.environ.get('DATAVERSE_URL', '')
 DATAVERSE_ACCESS_TOKEN = os.environ.get('DATAVERSE_ACCESS_TOKEN')
+# Seconds of waiting for connection and for response of Dataverse
+DATAVERSE_TIMEOUT = float(os.environ.get('DATAVERSE_TIMEOUT', 60))
+# Seconds available status of Dataverse and existing datasets are cached for, 0 disables cache
+DATAVERSE_CACHE_TTL = int(os.environ.get('DATAVERSE_CACHE_TTL', 5 * 60))
+# Maximal number of kept alive connections to Dataverse of a process
+DATAVERSE_POOL_SIZE = int(os.environ.get('DATAVERSE_POOL_SIZE', 10))
 
 # Media
 
-TMP_MEDIA_PATH = os.path.join(BASE_DIR, 'media', 'tmp')
+# Uploaded files waiting for ingestion, has to be shared by application and worker
+INGESTION_MEDIA_PATH = os.environ.get('INGESTION_MEDIA_PATH', os.path.join(BASE_DIR, 'media', 'uploads'))
 
 # Tests
 
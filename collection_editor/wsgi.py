@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'collection_editor.settings')
 
 application = get_wsgi_application()
+
+# Module is imported by each gunicorn worker after fork, so every worker opens its own pool before first request
+from django.conf import settings  # noqa: E402
+from core.mongo import mongo_clients  # noqa: E402
+
+if settings.MONGO_WARM_UP:
+    mongo_clients.warm_up()
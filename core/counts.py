@@ -0,0 +1,89 @@
+import hashlib
+from typing import NamedTuple
+
+from bson import json_util
+from django.conf import settings
+from django.core.cache import cache
+
+from core.models import Datatable
+
+
+class RowCount(NamedTuple):
+    """
+    Number of rows matching a query
+    """
+    #: Number of rows, lower bound if count isn't exact
+    value: int
+    #: False if counting stopped at a limit and there are more rows
+    exact: bool = True
+
+    def __str__(self):
+        return str(self.value) if self.exact else f'{self.value}+'
+
+
+class RowCounter:
+    """
+    Counts datatable rows matching a query, using the cheapest strategy that fits it:
+
+      - rows of whole datatable are counted from collection metadata, without a scan (in any mode)
+      - filtered rows are counted once per datatable revision, count is cached per normalized query, so paging through
+        results doesn't count them again. Row changes bump datatable revision, which invalidates cached counts
+      - in ``capped`` mode counting stops after ``cap`` rows and answers eg.: ``10000+``
+
+    Cache is Django default cache, configure shared one (eg.: Memcached) to share counts between processes.
+    """
+    #: Count all matching rows
+    EXACT = 'exact'
+    #: Count rows up to a cap
+    CAPPED = 'capped'
+    modes = [EXACT, CAPPED]
+    cache_key_prefix = 'datatable_count'
+
+    def __init__(self, datatable: Datatable, query: dict = None, mode: str = None, cap: int = None,
+                 timeout: int = None):
+        """
+        :param datatable: datatable rows are counted in
+        :param query: MongoDB query rows are filtered with
+        :param mode: one of ``modes``, ``settings.DATATABLE_COUNT_MODE`` by default or if mode is unknown
+        :param cap: number of rows counting stops at in capped mode, ``settings.DATATABLE_COUNT_CAP`` by default
+        :param timeout: time in seconds counts are cached for, ``settings.DATATABLE_COUNT_CACHE_TIMEOUT`` by default
+        """
+        self.datatable = datatable
+        self.query = query or {}
+        self.mode = mode if mode in self.modes else settings.DATATABLE_COUNT_MODE
+        self.cap = cap or settings.DATATABLE_COUNT_CAP
+        self.timeout = settings.DATATABLE_COUNT_CACHE_TIMEOUT if timeout is None else timeout
+
+    def count(self, minimal_cap: int = 0) -> RowCount:
+        """
+        Counts rows matching query
+
+        :param minimal_cap: lower bound of cap, so capped count can tell if there are rows after the one at that
+                            position (eg.: next page)
+        :return: number of rows
+        """
+        if not self.query:
+            return RowCount(self.datatable.client.count_rows())
+
+        limit = max(self.cap, minimal_cap) if self.mode == self.CAPPED else None
+        key = self.get_cache_key(limit)
+        count = cache.get(key)
+        if count is None:
+            # one row over the limit tells if there are more rows
+            count = self.datatable.client.count_rows(self.query, limit=limit + 1 if limit else None)
+            cache.set(key, count, self.timeout)
+
+        if limit and count > limit:
+            return RowCount(limit, exact=False)
+        return RowCount(count)
+
+    def get_cache_key(self, limit: int = None) -> str:
+        """
+        Builds cache key of a count, unique for datatable revision, query and counting limit
+
+        :param limit: maximal number of counted rows
+        :return: cache key
+        """
+        normalized_query = json_util.dumps(self.query, sort_keys=True)
+        query_hash = hashlib.sha1(normalized_query.encode('utf-8')).hexdigest()
+        return f'{self.cache_key_prefix}:{self.datatable.pk}:{self.datatable.revision}:{limit or ""}:{query_hash}'
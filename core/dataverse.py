@@ -0,0 +1,287 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Iterator, Optional, Tuple
+from uuid import uuid4
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from core.exceptions import DataverseError
+from core.registry import ClientRegistry
+
+
+class TTLCache:
+    """
+    Thread-safe cache of values expiring ``ttl`` seconds after they were set. Least recently set values are evicted
+    when cache is full. Hits and misses are counted, see ``metrics``.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 1024):
+        """
+        :param ttl: time in seconds values are kept for, 0 disables cache
+        :param max_size: maximal number of kept values
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._values: Dict[Hashable, Tuple[float, object]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        """
+        Gets value that hasn't expired yet
+
+        :param key: key of value
+        :return: value, ``None`` if there's none
+        """
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if entry is not None:
+                del self._values[key]
+            return None
+
+    def set(self, key: Hashable, value):
+        """
+        Sets value, evicting least recently set value if cache is full
+
+        :param key: key of value
+        :param value: value, can't be ``None``
+        """
+        if not self.ttl:
+            return
+        with self._lock:
+            self._values.pop(key, None)
+            self._values[key] = (time.monotonic() + self.ttl, value)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        """
+        Removes value
+
+        :param key: key of value
+        """
+        with self._lock:
+            self._values.pop(key, None)
+
+    @property
+    def metrics(self) -> dict:
+        """
+        Number of hits, misses and kept values, and ratio of hits to all lookups
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._values)}
+
+
+class DataverseClient:
+    """
+    Client of Dataverse native API, sending requests with ``requests.Session``, which keeps pool of connections
+    alive. Files are uploaded with streamed (chunked) multipart body, so their content doesn't have to be stored on
+    disk or held in memory.
+
+    Available status of Dataverse and existing datasets are cached for ``cache_ttl`` seconds, so client should be
+    shared, see ``DataverseClientRegistry``.
+
+    **Example usage**
+
+    .. sourcecode:: python
+
+        client = dataverse_clients.get_client()
+        if client.get_status() == 'OK' and client.get_dataset('doi:10.5072/FK2/ABCDEF'):
+            client.add_file('doi:10.5072/FK2/ABCDEF', 'deer.csv', iter_csv(cursor, columns))
+    """
+
+    def __init__(self, base_url: str, api_token: str = None, api_version: str = 'v1',
+                 session: requests.Session = None, timeout: float = None, cache_ttl: float = None,
+                 pool_size: int = None):
+        """
+        :param base_url: URL of Dataverse, eg.: ``https://dataverse.example.org``
+        :param api_token: API token of Dataverse user, sent as ``X-Dataverse-key`` header
+        :param api_version: version of native API
+        :param session: session requests are sent with, new one by default
+        :param timeout: timeout of connecting and of waiting for response in seconds,
+                ``settings.DATAVERSE_TIMEOUT`` by default
+        :param cache_ttl: time in seconds status and datasets are cached for, ``settings.DATAVERSE_CACHE_TTL`` by
+                default
+        :param pool_size: maximal number of kept alive connections of new session, ``settings.DATAVERSE_POOL_SIZE``
+                by default
+        """
+        self.api_url = f'{base_url.rstrip("/")}/api/{api_version}'
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=settings.DATAVERSE_POOL_SIZE if pool_size is None else pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        if api_token:
+            self.session.headers['X-Dataverse-key'] = api_token
+        self.timeout = timeout if timeout is not None else settings.DATAVERSE_TIMEOUT
+
+        cache_ttl = settings.DATAVERSE_CACHE_TTL if cache_ttl is None else cache_ttl
+        self.status_cache = TTLCache(cache_ttl, max_size=1)
+        self.dataset_cache = TTLCache(cache_ttl)
+
+    def get_status(self) -> str:
+        """
+        Checks if Dataverse is available, available status is cached
+
+        :return: ``OK`` if Dataverse responds, ``ERROR`` otherwise
+        """
+        status = self.status_cache.get('status')
+        if status is not None:
+            return status
+        try:
+            response = self.session.get(f'{self.api_url}/info/server', timeout=self.timeout)
+            status = response.json()['status'] if response.ok else 'ERROR'
+        except (requests.RequestException, ValueError, KeyError):
+            return 'ERROR'
+        if status == 'OK':
+            self.status_cache.set('status', status)
+        return status
+
+    def get_dataset(self, pid: str) -> Optional[dict]:
+        """
+        Gets metadata of dataset, existing datasets are cached
+
+        :param pid: persistent identifier of dataset, eg.: ``doi:10.5072/FK2/ABCDEF``
+        :return: dataset metadata, ``None`` if there's no such dataset
+        :raises requests.ConnectionError: when Dataverse can't be connected to
+        :raises DataverseError: when Dataverse rejects request for other reason than missing dataset
+        """
+        dataset = self.dataset_cache.get(pid)
+        if dataset is not None:
+            return dataset
+        response = self.session.get(f'{self.api_url}/datasets/:persistentId/', params={'persistentId': pid},
+                                    timeout=self.timeout)
+        if response.status_code == 404:
+            return None
+        if not response.ok:
+            raise DataverseError(get_error_message(response), response.status_code)
+        dataset = response.json().get('data')
+        if dataset:
+            self.dataset_cache.set(pid, dataset)
+        return dataset
+
+    def add_file(self, pid: str, filename: str, content: Iterable[bytes], content_type: str = 'text/csv',
+                 metadata: dict = None) -> requests.Response:
+        """
+        Uploads file to dataset. File content is sent as it's produced, with chunked transfer encoding.
+
+        :param pid: persistent identifier of dataset
+        :param filename: name of uploaded file
+        :param content: chunks of file content
+        :param content_type: content type of file
+        :param metadata: file metadata, eg.: ``{'description': 'Deer observations'}``
+        :return: response of Dataverse
+        """
+        boundary = uuid4().hex
+        response = self.session.post(
+            f'{self.api_url}/datasets/:persistentId/add', params={'persistentId': pid},
+            data=iter_multipart(boundary, filename, content, content_type, metadata),
+            headers={'Content-Type': f'multipart/form-data; boundary={boundary}'}, timeout=self.timeout)
+        if response.status_code == 404:
+            # dataset was removed since it was cached
+            self.dataset_cache.delete(pid)
+        return response
+
+    def close(self):
+        """
+        Closes connections of session
+        """
+        self.session.close()
+
+
+class DataverseClientRegistry(ClientRegistry):
+    """
+    Process-wide registry of Dataverse clients, so connections and caches are shared by every export in a process.
+    """
+
+    @staticmethod
+    def get_client_options() -> dict:
+        """
+        Builds DataverseClient keyword arguments from settings
+
+        :return: DataverseClient options
+        """
+        return {
+            'base_url': settings.DATAVERSE_URL,
+            'api_token': settings.DATAVERSE_ACCESS_TOKEN,
+            'timeout': settings.DATAVERSE_TIMEOUT,
+            'cache_ttl': settings.DATAVERSE_CACHE_TTL,
+            'pool_size': settings.DATAVERSE_POOL_SIZE,
+        }
+
+    def create_client(self, options: dict) -> DataverseClient:
+        """
+        Creates Dataverse client
+
+        :param options: DataverseClient options
+        :return: new DataverseClient
+        """
+        return DataverseClient(**options)
+
+    def get_metrics(self) -> dict:
+        """
+        Gets metrics of caches of clients of this process
+
+        :return: process id, number of clients and summed metrics of ``status`` and ``dataset`` caches
+        """
+        self._reset_after_fork()
+        metrics = {'pid': self._pid, 'clients': len(self._clients)}
+        for name in ('status', 'dataset'):
+            caches = [getattr(client, f'{name}_cache') for client in list(self._clients.values())]
+            hits = sum(cache.hits for cache in caches)
+            lookups = hits + sum(cache.misses for cache in caches)
+            metrics[name] = {'hits': hits, 'misses': lookups - hits, 'hit_rate': hits / lookups if lookups else 0.0,
+                             'size': sum(cache.metrics['size'] for cache in caches)}
+        return metrics
+
+
+def get_error_message(response: requests.Response) -> str:
+    """
+    Gets error message of Dataverse response
+
+    :param response: Dataverse response
+    :return: message of JSON error response, response text otherwise
+    """
+    try:
+        return response.json()['message']
+    except (ValueError, KeyError, TypeError):
+        return response.text
+
+
+def iter_multipart(boundary: str, filename: str, content: Iterable[bytes], content_type: str,
+                   metadata: dict = None) -> Iterator[bytes]:
+    """
+    Encodes ``multipart/form-data`` body of Dataverse file upload: ``jsonData`` field with file metadata and
+    ``file`` field with file content, passed through as it comes
+
+    :param boundary: boundary of body parts
+    :param filename: name of uploaded file
+    :param content: chunks of file content
+    :param content_type: content type of file
+    :param metadata: file metadata
+    :return: iterator of chunks of body
+    """
+    if metadata:
+        yield (f'--{boundary}\r\nContent-Disposition: form-data; name="jsonData"\r\n\r\n'
+               f'{json.dumps(metadata)}\r\n').encode('utf-8')
+    yield (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+           f'Content-Type: {content_type}\r\n\r\n').encode('utf-8')
+    for chunk in content:
+        if chunk:
+            yield chunk
+    yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+
+#: Registry used by Dataverse exports
+dataverse_clients = DataverseClientRegistry()
@@ -10,3 +10,42 @@ class WrongFileType(Exception):
     Exception returned when uploaded file is of unsupported type
     """
     pass
+
+
+class CorruptedFile(Exception):
+    """
+    Exception returned when uploaded file can't be parsed
+    """
+    pass
+
+
+class JobInterrupted(Exception):
+    """
+    Exception returned when background job stopped reporting progress, as its worker was killed
+    """
+    pass
+
+
+class QueryParseError(ValueError):
+    """
+    Exception returned when filtering query can't be parsed
+    """
+    pass
+
+
+class DataverseError(Exception):
+    """
+    Exception returned when Dataverse rejects request
+    """
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        #: HTTP status of Dataverse response
+        self.status_code = status_code
+
+    @property
+    def retryable(self) -> bool:
+        """
+        Whether request may succeed if repeated (Dataverse is overloaded or failed)
+        """
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
@@ -1,13 +1,16 @@
-import re
 from abc import ABC
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Optional
 
 import pymongo
 from pymongo.cursor import Cursor
+from rest_framework.exceptions import ValidationError
 from rest_framework.request import Request
 from rest_framework.settings import api_settings
 
+from core.exceptions import QueryParseError
 from core.models.datatable import DatatableMongoClient
+from core.query_parser import compile_query
+from core.schema import cast_value
 
 
 class MongoFilter(ABC):
@@ -15,8 +18,13 @@ class MongoFilter(ABC):
     Abstract base class for filters operating on MongoDB cursor
     """
 
-    def __init__(self, columns):
+    def __init__(self, columns, schema: Dict[str, dict] = None):
+        """
+        :param columns: datatable columns
+        :param schema: datatable schema, used to cast filtered values to types of columns
+        """
         self.columns = columns
+        self.schema = schema or {}
 
     def get_valid_fields(self) -> Dict[str, type]:
         """
@@ -38,7 +46,7 @@ class MongoFilter(ABC):
 
     def validate_fields(self, field_dict: dict) -> Dict[str, object]:
         """
-        Removes invalid fields form given dict and casts numeric value to float (to be searchable in Mongo)
+        Removes invalid fields form given dict and casts values to types of columns (to be searchable in Mongo)
 
         :param field_dict: fields to be validated
         :return: validated fields
@@ -48,7 +56,7 @@ class MongoFilter(ABC):
         validated_fields = {}
         for key, val in field_dict.items():
             if key in valid_field_names:
-                validated_fields[key] = float(val) if val.isnumeric() else val
+                validated_fields[key] = cast_value(val, self.schema.get(key))
         return validated_fields
 
 
@@ -90,12 +98,50 @@ class RowOrdering(MongoFilter):
         return cursor.sort(ordering)
 
 
+class RowProjection(MongoFilter):
+    """
+    Filter selecting columns of returned rows, so only requested columns are fetched from MongoDB
+    """
+    fields_param = 'fields'
+
+    def get_fields(self, request: Request) -> Optional[List[str]]:
+        """
+        Extracts selected columns from request query params, invalid columns are skipped
+
+        :param request: request with fields param
+        :return: list of selected columns in requested order, None if no valid columns were requested
+        """
+        params = request.query_params.get(self.fields_param)
+        if params:
+            valid_fields = self.get_valid_fields()
+            fields = []
+            for field in [param.strip() for param in params.split(',')]:
+                if field in valid_fields and field not in fields:
+                    fields.append(field)
+            if fields:
+                return fields
+
+        # No fields were requested, or all the requested fields were invalid
+        return None
+
+    def get_projection(self, request: Request) -> Optional[Dict[str, bool]]:
+        """
+        Builds MongoDB projection of selected columns, row ``_id`` is always included
+
+        :param request: request with fields param
+        :return: MongoDB projection, None if whole rows should be returned
+        """
+        fields = self.get_fields(request)
+        if fields is None:
+            return None
+        return {'_id': True, **{field: True for field in fields}}
+
+
 class RowFiltering(MongoFilter):
     """
     Filter allowing both simple and logical filtering MongoDB cursor
     """
     logical_param = 'logical_query'
-    supported_logical_operation = ['or', 'and']
 
     def get_filtering(self, request) -> Dict[str, object]:
         """
@@ -114,78 +160,40 @@ class RowFiltering(MongoFilter):
 
     def get_logical_query(self, request) -> dict:
         """
-        Extracts logical query from request
+        Extracts logical query from request, see ``QueryParser`` for its syntax
 
+        :exception ValidationError: raises when logical query can't be parsed
         :param request: Request to extract logical query from
         :return: Dict representing MongoDB compliant query
         """
 
         logical_param: str = request.query_params.get(self.logical_param)
         if logical_param:
-            return self.__build_logical_queries(logical_param)
+            try:
+                return compile_query(logical_param, self.get_valid_fields() or [], self.schema)
+            except QueryParseError as e:
+                raise ValidationError({self.logical_param: str(e)})
 
-    def __build_logical_queries(self, query_param: str) -> dict:
+    def get_query(self, request: Request) -> dict:
         """
-        Builds logical query dict form query param string.
+        Builds MongoDB query from request. Logical query takes precedence over simple filtering params.
 
-        :param query_param: should look like: 'operation(field=value, field=value, operation(field=value, ...))'
-        :return: logical query as a dict that has MongoDB query structure
-        """
-
-        # check if query_params is a logical query
-        logical_query = self.__find_logical_queries(query_param)
-        if not logical_query:
-            # if it's not a query there should be coma separated parameters
-            return self.__get_logical_query_params(query_param)
-
-        for operator, params in logical_query.items():
-            logical_query[operator] = []
-            # strip params from brackets '()' and regex split on comas ',' not in brackets '()'
-            for param in re.split(r',(?=[^)]*(?:\(|$))', params[1:-1]):
-                logical_params = self.__build_logical_queries(param.strip())
-                if logical_params:
-                    logical_query[operator].append(logical_params)
-        return {operator: query for operator, query in logical_query.items() if query}
-
-    def __find_logical_queries(self, string: str) -> dict:
-        """
-        Finds logical query in given string. As regex is greedy it finds only the outer operation, and treat
-        rest of a string as parameters.
-
-        :param string: string to be check for logical query eg.: ``or(species=deer, and(species=bear, color=black))``
-        :return: dict where key in an logical operator preceded by $ and value is parameters of the operation
-        """
-        operations = '|'.join(self.supported_logical_operation)
-        results = re.findall(r'(' + operations + r')(\(.*\))', string)
-        return {f'${result[0]}': result[1] for result in results}
-
-    def __get_logical_query_params(self, string: str) -> dict:
+        :param request: Request to extract filtering params from
+        :return: MongoDB compliant query, empty if request has no valid filtering params
         """
-        Finds parameters that are in 'Field=Value' format
+        logical_filtering = self.get_logical_query(request)
+        if logical_filtering:
+            return logical_filtering
 
-        :param string: string to be check for parameters
-        :return: validated dict of fields
-        """
-        # matches pairs of strings connected with '='
-        results = re.findall(r'(.*?)=(.*)', string)
-        result = {result[0]: result[1] for result in results}
-        return self.validate_fields(result)
+        return self.get_filtering(request) or {}
 
-    def filter_cursor(self, request: Request, client: DatatableMongoClient) -> Cursor:
+    def filter_cursor(self, request: Request, client: DatatableMongoClient, projection: dict = None) -> Cursor:
         """
         Creates filtered cursor based on request filtering params
 
         :param request: Request to extract logical query from
         :param client: MongoDB client to be used for cursor creation
+        :param projection: MongoDB projection of returned columns, whole rows by default
         :return: filtered cursor
         """
-
-        logical_filtering = self.get_logical_query(request)
-        if logical_filtering:
-            return client.get_rows(logical_filtering)
-
-        filtering = self.get_filtering(request)
-        if filtering:
-            return client.get_rows(filtering)
-
-        return client.get_rows()
+        return client.get_rows(self.get_query(request), projection)
@@ -0,0 +1,237 @@
+import hashlib
+import logging
+from typing import List, Tuple, FrozenSet
+
+import pymongo
+from django.conf import settings
+from django.db import connection
+from pymongo import IndexModel
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+from pymongo.write_concern import WriteConcern
+
+from core.models import Datatable
+
+logger = logging.getLogger(__name__)
+
+#: Query operators matching a range of values, fields they are used on go after sorted fields in index
+RANGE_OPERATORS = {'$gt', '$gte', '$lt', '$lte', '$ne', '$in', '$nin', '$regex', '$exists', '$type'}
+#: Maximal number of ``$or`` branches index keys are recorded for
+MAX_QUERY_BRANCHES = 8
+#: Maximal number of fields in automatic index
+MAX_INDEX_FIELDS = 4
+
+
+def get_index_keys(query: dict, ordering: List[Tuple[str, int]]) -> List[List[Tuple[str, int]]]:
+    """
+    Builds keys of indexes that would serve query with given ordering, following Equality-Sort-Range rule: fields
+    compared for equality go first, sorted fields next and fields compared with ranges last. Every branch of ``$or``
+    gets its own index.
+
+    :param query: MongoDB query, as built by ``RowFiltering``
+    :param ordering: rows ordering, as built by ``RowOrdering``
+    :return: list of index keys, each as list of tuples `(field, direction)`
+    """
+    sort = [(field, direction) for field, direction in ordering if field != '_id']
+    index_keys = []
+    for equality, ranges in _get_query_branches(query or {}):
+        keys = [(field, pymongo.ASCENDING) for field in sorted(equality)]
+        keys += [(field, direction) for field, direction in sort if field not in equality]
+        sorted_fields = {field for field, _ in keys}
+        keys += [(field, pymongo.ASCENDING) for field in sorted(ranges) if field not in sorted_fields]
+        if keys and keys[:MAX_INDEX_FIELDS] not in index_keys:
+            index_keys.append(keys[:MAX_INDEX_FIELDS])
+    return index_keys
+
+
+def _get_query_branches(query: dict) -> List[Tuple[FrozenSet[str], FrozenSet[str]]]:
+    """
+    Splits query on ``$or`` into branches that can be served by a single index
+
+    :param query: MongoDB query
+    :return: list of branches, each as a tuple of fields compared for equality and fields compared with ranges
+    """
+    branches = [(frozenset(), frozenset())]
+    for key, value in query.items():
+        if key == '$and':
+            alternatives = [_get_query_branches(condition) for condition in value]
+        elif key == '$or':
+            alternatives = [[branch for condition in value for branch in _get_query_branches(condition)]]
+        elif key.startswith('$'):
+            continue
+        elif isinstance(value, dict) and any(operator in RANGE_OPERATORS for operator in value):
+            alternatives = [[(frozenset(), frozenset([key]))]]
+        else:
+            alternatives = [[(frozenset([key]), frozenset())]]
+
+        for alternative in alternatives:
+            branches = [(equality | other_equality, ranges | other_ranges)
+                        for equality, ranges in branches
+                        for other_equality, other_ranges in alternative][:MAX_QUERY_BRANCHES]
+    return branches
+
+
+class IndexManager:
+    """
+    Manages indexes of datatable collection based on how rows are filtered and sorted.
+
+    Every retrieve records keys of an index that would serve its query (see ``get_index_keys``) to
+    ``settings.DATATABLE_INDEX_USAGE_COLLECTION``, as a fire and forget increment. ``sync`` builds indexes for keys
+    used at least ``settings.DATATABLE_INDEX_MIN_HITS`` times, most used first, up to
+    ``settings.DATATABLE_INDEX_BUDGET`` indexes per datatable, and drops automatic indexes that are no longer used.
+    Usage decays with every sync, so indexes follow current traffic.
+
+    Automatic indexes are named with ``auto_`` prefix, other indexes are never dropped.
+    """
+    #: Prefix of names of indexes built by manager
+    name_prefix = 'auto_'
+    #: Factor usage counts are multiplied by after every sync
+    usage_decay = 0.5
+
+    def __init__(self, datatable: Datatable):
+        """
+        :param datatable: datatable indexes are managed of
+        """
+        self.datatable = datatable
+        self.client = datatable.client
+
+    @property
+    def usage_collection(self) -> Collection:
+        """
+        Collection of recorded index usage, shared by all datatables
+        """
+        return self.client.database[settings.DATATABLE_INDEX_USAGE_COLLECTION]
+
+    def record_usage(self, query: dict, ordering: List[Tuple[str, int]]):
+        """
+        Records query and ordering used to retrieve rows. Write isn't acknowledged, so it doesn't slow down request.
+
+        :param query: MongoDB query rows were filtered with
+        :param ordering: rows ordering
+        """
+        usage_collection = self.usage_collection.with_options(write_concern=WriteConcern(w=0))
+        for keys in get_index_keys(query, ordering):
+            usage_collection.update_one(
+                {'_id': f'{self.client.collection_name}/{self.get_index_name(keys)}'},
+                {'$setOnInsert': {'collection': self.client.collection_name, 'keys': keys},
+                 '$inc': {'hits': 1},
+                 '$currentDate': {'last_used': True}},
+                upsert=True
+            )
+
+    def get_usage(self) -> List[dict]:
+        """
+        Returns recorded usage of index keys, most used first
+
+        :return: list of dicts with index ``keys``, number of ``hits`` and ``last_used`` time
+        """
+        return [{'keys': [tuple(key) for key in usage['keys']], 'hits': usage['hits'], 'last_used': usage['last_used']}
+                for usage in self.usage_collection.find({'collection': self.client.collection_name})
+                .sort('hits', pymongo.DESCENDING)]
+
+    def get_index_stats(self) -> List[dict]:
+        """
+        Returns indexes of datatable collection with number of operations that used them (from ``$indexStats``)
+
+        :return: list of dicts with index ``name``, ``keys``, ``auto`` flag, ``ops`` count and ``since`` time counting
+                 started
+        """
+        accesses = {stats['name']: stats['accesses']
+                    for stats in self.client.collection.aggregate([{'$indexStats': {}}])}
+        return [{'name': name,
+                 'keys': index['key'],
+                 'auto': name.startswith(self.name_prefix),
+                 'ops': accesses.get(name, {}).get('ops', 0),
+                 'since': accesses.get(name, {}).get('since')}
+                for name, index in self.client.collection.index_information().items()]
+
+    def get_wanted_keys(self, budget: int = None, min_hits: int = None) -> List[List[Tuple[str, int]]]:
+        """
+        Selects keys of automatic indexes worth building: most used ones that aren't served by other indexes
+
+        :param budget: maximal number of automatic indexes, ``settings.DATATABLE_INDEX_BUDGET`` by default
+        :param min_hits: minimal usage of index keys, ``settings.DATATABLE_INDEX_MIN_HITS`` by default
+        :return: list of index keys
+        """
+        budget = settings.DATATABLE_INDEX_BUDGET if budget is None else budget
+        min_hits = settings.DATATABLE_INDEX_MIN_HITS if min_hits is None else min_hits
+
+        manual_keys = [index['key'] for name, index in self.client.collection.index_information().items()
+                       if not name.startswith(self.name_prefix)]
+        wanted_keys = []
+        for usage in self.get_usage():
+            if len(wanted_keys) >= budget or usage['hits'] < min_hits:
+                break
+            keys = usage['keys']
+            if all(field in self.datatable.columns for field, _ in keys) and \
+                    not any(self.__is_prefix(keys, index_keys) for index_keys in manual_keys + wanted_keys):
+                wanted_keys.append(keys)
+        return wanted_keys
+
+    def sync(self, budget: int = None, min_hits: int = None) -> Tuple[List[str], List[str]]:
+        """
+        Builds wanted automatic indexes and drops unwanted ones, then decays recorded usage
+
+        :param budget: maximal number of automatic indexes, ``settings.DATATABLE_INDEX_BUDGET`` by default
+        :param min_hits: minimal usage of index keys, ``settings.DATATABLE_INDEX_MIN_HITS`` by default
+        :return: tuple of lists of names of created and dropped indexes
+        """
+        wanted = {self.get_index_name(keys): keys for keys in self.get_wanted_keys(budget, min_hits)}
+        existing = [name for name in self.client.collection.index_information() if name.startswith(self.name_prefix)]
+
+        dropped = [name for name in existing if name not in wanted]
+        for name in dropped:
+            self.client.collection.drop_index(name)
+
+        created = [name for name in wanted if name not in existing]
+        if created:
+            self.client.collection.create_indexes([IndexModel(wanted[name], name=name, background=True)
+                                                   for name in created])
+
+        self.usage_collection.update_many({'collection': self.client.collection_name},
+                                          {'$mul': {'hits': self.usage_decay}})
+        self.usage_collection.delete_many({'collection': self.client.collection_name, 'hits': {'$lt': 1}})
+        return created, dropped
+
+    @classmethod
+    def get_index_name(cls, keys: List[Tuple[str, int]]) -> str:
+        """
+        Builds name of automatic index. Column names can be long, so name is a hash of keys.
+
+        :param keys: index keys
+        :return: index name
+        """
+        signature = ','.join(f'{field}:{direction}' for field, direction in keys)
+        return f'{cls.name_prefix}{hashlib.sha1(signature.encode("utf-8")).hexdigest()[:16]}'
+
+    @staticmethod
+    def __is_prefix(keys: List[Tuple[str, int]], index_keys: List[Tuple[str, int]]) -> bool:
+        """
+        Checks if index with ``index_keys`` serves ``keys``, which is true if they are its prefix, in the same or
+        reversed directions
+
+        :param keys: wanted index keys
+        :param index_keys: keys of existing index
+        :return: True if existing index serves wanted keys
+        """
+        prefix = [tuple(key) for key in index_keys[:len(keys)]]
+        reversed_keys = [(field, -direction) for field, direction in keys]
+        return prefix == keys or prefix == reversed_keys
+
+
+def sync_all_indexes():
+    """
+    Syncs automatic indexes of all datatables. Errors of single datatable are logged and don't stop sync of others.
+    """
+    try:
+        for datatable in Datatable.objects.all():
+            try:
+                created, dropped = IndexManager(datatable).sync()
+            except PyMongoError:
+                logger.exception('Index sync of %s failed', datatable.collection_name)
+                continue
+            if created or dropped:
+                logger.info('Indexes of %s created: %s, dropped: %s', datatable.collection_name, created, dropped)
+    finally:
+        # sync runs in its own thread in worker
+        connection.close()
@@ -0,0 +1,373 @@
+from __future__ import annotations
+
+import io
+import queue
+import threading
+import zipfile
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from typing import Iterator, List, TextIO, Sequence
+
+import numpy
+import openpyxl
+import pandas as pd
+from bson import ObjectId
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from pymongo.collection import Collection
+
+
+@contextmanager
+def open_text_stream(file: UploadedFile, encoding: str = None) -> Iterator[TextIO]:
+    """
+    Opens uploaded file as text stream decoded incrementally, so neither raw nor decoded content is held in memory.
+    Works for both in-memory uploads and uploads spooled to disk (``TemporaryUploadedFile``).
+
+    Underlying file is rewound before reading and left open afterwards.
+
+    :param file: uploaded file
+    :param encoding: file encoding, ``settings.DATATABLE_UPLOAD_ENCODING`` by default
+    :return: text stream reading from uploaded file
+    """
+    file.file.seek(0)
+    text_stream = io.TextIOWrapper(file.file, encoding=encoding or settings.DATATABLE_UPLOAD_ENCODING, newline='')
+    try:
+        yield text_stream
+    finally:
+        # detach, so closing wrapper doesn't close uploaded file
+        text_stream.detach()
+
+
+def read_first_line(file: UploadedFile) -> str:
+    """
+    Reads first line of uploaded file, decoded the same way as by ``open_text_stream``. Underlying file is rewound
+    afterwards.
+
+    :param file: uploaded file
+    :return: first line of file, empty if file is empty
+    :raise UnicodeDecodeError: when line can't be decoded with ``settings.DATATABLE_UPLOAD_ENCODING``
+    """
+    try:
+        with open_text_stream(file) as text_stream:
+            return text_stream.readline()
+    finally:
+        file.file.seek(0)
+
+
+def iter_csv_chunks(file: UploadedFile, delimiter: str, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+    """
+    Parses uploaded CSV file chunk by chunk. Peak memory is bounded by chunk size, not by file size.
+
+    :param file: uploaded CSV file
+    :param delimiter: CSV delimiter
+    :param chunk_size: number of rows in a chunk, ``settings.DATATABLE_UPLOAD_CHUNK_SIZE`` by default
+    :return: iterator of parsed chunks
+    """
+    with open_text_stream(file) as text_stream:
+        yield from pd.read_csv(text_stream, sep=delimiter, chunksize=chunk_size or settings.DATATABLE_UPLOAD_CHUNK_SIZE)
+
+
+def iter_excel_chunks(file: UploadedFile, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+    """
+    Parses first sheet of uploaded Excel file chunk by chunk. First row is used as header.
+
+    Workbooks (*xlsx*) are streamed row by row by read-only openpyxl reader, so peak memory is bounded by chunk size,
+    like for CSV files. Legacy *xls* files are loaded at once by pandas, their format limits them to 65536 rows.
+    Dates are normalized with ``normalize_dates``. At least one, possibly empty, chunk is yielded.
+
+    :param file: uploaded Excel file
+    :param chunk_size: number of rows in a chunk, ``settings.DATATABLE_UPLOAD_CHUNK_SIZE`` by default
+    :return: iterator of parsed chunks
+    """
+    chunk_size = chunk_size or settings.DATATABLE_UPLOAD_CHUNK_SIZE
+    file.file.seek(0)
+    if not zipfile.is_zipfile(file.file):
+        file.file.seek(0)
+        df = normalize_dates(pd.read_excel(file.file))
+        for i in range(0, max(len(df), 1), chunk_size):
+            yield df.iloc[i:i + chunk_size]
+        return
+
+    file.file.seek(0)
+    workbook = openpyxl.load_workbook(file.file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        columns = _excel_header(next(rows, ()))
+        if not columns:
+            raise pd.errors.EmptyDataError('No columns to parse from file')
+
+        chunk = []
+        parsed_rows = 0
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            row = row[:len(columns)]
+            chunk.append(row + (None,) * (len(columns) - len(row)))
+            parsed_rows += 1
+            if len(chunk) == chunk_size:
+                yield _excel_rows_to_dataframe(chunk, columns)
+                chunk = []
+        if chunk or not parsed_rows:
+            yield _excel_rows_to_dataframe(chunk, columns)
+    finally:
+        workbook.close()
+
+
+def _excel_header(row: Sequence) -> List[str]:
+    """
+    Builds column names the way ``pd.read_excel`` does: empty cells are named ``Unnamed: <position>`` and duplicated
+    names get ``.<number>`` suffix. Trailing empty cells are skipped.
+
+    :param row: first row of a sheet
+    :return: column names
+    """
+    row = list(row)
+    while row and row[-1] is None:
+        row.pop()
+
+    columns = []
+    for i, value in enumerate(row):
+        name = f'Unnamed: {i}' if value is None else str(value)
+        duplicates = 0
+        unique_name = name
+        while unique_name in columns:
+            duplicates += 1
+            unique_name = f'{name}.{duplicates}'
+        columns.append(unique_name)
+    return columns
+
+
+def _excel_rows_to_dataframe(rows: List[tuple], columns: List[str]) -> pd.DataFrame:
+    """
+    Builds DataFrame of sheet rows. Excel stores all numbers as floats, so float columns holding only whole numbers
+    are converted to integers, as ``pd.read_excel`` does.
+
+    :param rows: rows of sheet values, of the same length as columns
+    :param columns: column names
+    :return: DataFrame with normalized dates
+    """
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    for column in [column for column, dtype in df.dtypes.items() if dtype.kind == 'f']:
+        values = df[column].to_numpy()
+        if numpy.isfinite(values).all() and (numpy.abs(values) < 2 ** 53).all() and (values == numpy.trunc(values)).all():
+            df[column] = values.astype(numpy.int64)
+    return normalize_dates(df)
+
+
+def normalize_dates(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts date columns to strings, vectorized. Dates without time of day become ``YYYY-MM-DD``, others become ISO
+    8601 strings in UTC with millisecond precision (as in ``dataframe_to_documents``). Missing dates become ``None``.
+
+    :param df: DataFrame to convert, modified in place
+    :return: converted DataFrame
+    """
+    for column in [column for column, dtype in df.dtypes.items() if dtype.kind == 'M']:
+        values = df[column].to_numpy(dtype='datetime64[ms]')
+        days = values.astype('datetime64[D]')
+        strings = numpy.where(values == days, numpy.datetime_as_string(days),
+                              numpy.datetime_as_string(values, unit='ms', timezone='UTC')).astype(object)
+        strings[numpy.isnat(values)] = None
+        df[column] = strings
+    return df
+
+
+def dataframe_to_documents(df: pd.DataFrame) -> List[dict]:
+    """
+    Converts DataFrame to MongoDB documents column by column, without intermediate JSON text.
+
+    Values are converted the same way ``json.loads(df.to_json(orient='records', date_format='iso'))`` would:
+
+      - missing and infinite values become ``None``
+      - integers, floats and booleans become their Python counterparts (floats are not rounded)
+      - dates become ISO 8601 strings in UTC with millisecond precision, eg.: ``2020-01-01T00:00:00.000Z``
+
+    :param df: DataFrame to convert
+    :return: list of documents, one per DataFrame row
+    """
+    keys = [str(column) for column in df.columns]
+    columns = [_column_to_values(series) for _, series in df.items()]
+    return [dict(zip(keys, row)) for row in zip(*columns)]
+
+
+def _column_to_values(series: pd.Series) -> list:
+    """
+    Converts DataFrame column to list of BSON compliant values
+
+    :param series: DataFrame column
+    :return: list of converted values
+    """
+    dtype = series.dtype
+    if isinstance(dtype, numpy.dtype):
+        if dtype.kind in 'biu':
+            return series.tolist()
+        if dtype.kind == 'f':
+            values = series.to_numpy()
+            return _set_none(values.tolist(), ~numpy.isfinite(values))
+        if dtype.kind == 'M':
+            values = series.to_numpy(dtype='datetime64[ms]')
+            return _set_none(numpy.datetime_as_string(values, unit='ms', timezone='UTC').tolist(), numpy.isnat(values))
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return _column_to_values(series.dt.tz_convert('UTC').dt.tz_localize(None))
+
+    values = series.to_numpy(dtype=object)
+    result = _set_none(values.tolist(), pd.isna(values))
+    if pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+        return result
+    return [_to_bson_value(value) for value in result]
+
+
+def _set_none(values: list, mask: numpy.ndarray) -> list:
+    """
+    Replaces masked values with ``None``
+
+    :param values: values to be replaced
+    :param mask: boolean array marking values to replace
+    :return: values list
+    """
+    for i in numpy.flatnonzero(mask):
+        values[i] = None
+    return values
+
+
+def _to_bson_value(value):
+    """
+    Converts single value of mixed type column
+
+    :param value: value to be converted
+    :return: BSON compliant value
+    """
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, float):
+        return value if numpy.isfinite(value) else None
+    if isinstance(value, numpy.generic):
+        return _to_bson_value(value.item())
+    if isinstance(value, date):
+        if not isinstance(value, datetime):
+            value = datetime(value.year, value.month, value.day)
+        elif value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.strftime('%Y-%m-%dT%H:%M:%S.') + f'{value.microsecond // 1000:03d}Z'
+    return str(value)
+
+
+class BulkInsertPipeline:
+    """
+    Producer/consumer pipeline inserting documents to MongoDB collection.
+
+    Parsing thread puts chunks of documents on a bounded queue, which is drained by a pool of writer threads using
+    unordered bulk inserts. That way parsing next chunk overlaps with inserting previous ones and whole upload is
+    limited by the slower of the two. Queue size bounds number of parsed chunks held in memory.
+
+    Documents get their ``_id`` when put on the queue, so rows keep file order when sorted by ``_id`` no matter which
+    writer inserts them. First error raised by a writer stops the pipeline and is re-raised in producer thread.
+
+    **Example usage**
+
+    .. sourcecode:: python
+
+        with BulkInsertPipeline(collection) as pipeline:
+            for chunk in chunks:
+                pipeline.put(dataframe_to_documents(chunk))
+        inserted_rows = pipeline.inserted_rows
+    """
+
+    #: Sentinel telling writer to stop
+    _stop = object()
+
+    def __init__(self, collection: Collection, writers: int = None, queue_size: int = None):
+        """
+        :param collection: collection documents are inserted to
+        :param writers: number of writer threads, ``settings.DATATABLE_UPLOAD_WRITERS`` by default. If 0 documents
+                        are inserted synchronously in producer thread
+        :param queue_size: maximal number of chunks waiting for insert, ``settings.DATATABLE_UPLOAD_QUEUE_SIZE``
+                           by default
+        """
+        self.collection = collection
+        self.writers = settings.DATATABLE_UPLOAD_WRITERS if writers is None else writers
+        self.queue = queue.Queue(maxsize=queue_size or settings.DATATABLE_UPLOAD_QUEUE_SIZE)
+        #: Number of documents already inserted
+        self.inserted_rows = 0
+
+        self._threads = []
+        self._lock = threading.Lock()
+        self._error = None
+        self._aborted = False
+
+    def __enter__(self) -> BulkInsertPipeline:
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(abort=exc_type is not None)
+
+    def start(self):
+        """
+        Starts writer threads
+        """
+        for i in range(self.writers):
+            thread = threading.Thread(target=self.__write, name=f'bulk-insert-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, documents: List[dict]):
+        """
+        Queues documents for insert. Blocks while queue is full.
+
+        :param documents: documents to be inserted
+        """
+        if not documents:
+            return
+        for document in documents:
+            document['_id'] = ObjectId()
+
+        if not self._threads:
+            self.__insert(documents)
+            return
+
+        while True:
+            self.__raise_error()
+            try:
+                self.queue.put(documents, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self, abort: bool = False):
+        """
+        Waits until all queued documents are inserted and stops writers
+
+        :param abort: discard queued documents instead of inserting them
+        """
+        self._aborted = abort
+        for _ in self._threads:
+            self.queue.put(self._stop)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if not abort:
+            self.__raise_error()
+
+    def __write(self):
+        """
+        Writer thread loop. After an error or abort queue is still drained, so producer never blocks on full queue.
+        """
+        while True:
+            documents = self.queue.get()
+            if documents is self._stop:
+                return
+            if self._error is None and not self._aborted:
+                try:
+                    self.__insert(documents)
+                except BaseException as e:
+                    self._error = e
+
+    def __insert(self, documents: List[dict]):
+        self.collection.insert_many(documents, ordered=False)
+        with self._lock:
+            self.inserted_rows += len(documents)
+
+    def __raise_error(self):
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,30 @@
+"""
+Entry points of processes running background jobs. Processes are spawned, so this module is imported before Django
+is set up and can't import models on module level.
+"""
+import signal
+
+import django
+from django.apps import apps
+from django.db import close_old_connections
+
+
+def setup_process():
+    """
+    Sets up Django in worker process. Interrupts are handled by parent process, which lets running jobs finish.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    django.setup()
+
+
+def run_job(model_label: str, job_id: int):
+    """
+    Runs single job in worker process
+
+    :param model_label: label of job model, eg.: ``core.IngestionJob``
+    :param job_id: id of job to be run
+    """
+    try:
+        apps.get_model(model_label).objects.get(pk=job_id).run()
+    finally:
+        close_old_connections()
@@ -0,0 +1,207 @@
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from typing import Dict, List, Tuple, Type
+
+from django.conf import settings
+from django.db import transaction, close_old_connections, DatabaseError
+from django.utils import timezone
+
+from core.exceptions import JobInterrupted
+from core.indexing import sync_all_indexes
+from core.job_process import setup_process, run_job
+from core.models import BackgroundJob, IngestionJob, ExportJob, JobStatus
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorker:
+    """
+    Runs background jobs stored in database.
+
+    Pending jobs are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED``, so any number of workers can share job
+    tables without a message broker. Claimed jobs are run in a pool of processes, as ingestion is CPU bound.
+    Processes are spawned, not forked, so they never share database or MongoDB connections with the worker.
+
+    Jobs left running by a killed worker are failed once they didn't report progress for
+    ``settings.JOB_STALE_TIMEOUT`` seconds.
+
+    Every ``settings.DATATABLE_INDEX_SYNC_INTERVAL`` seconds worker also syncs automatic indexes of datatables
+    (see ``IndexManager``), in a thread, so long index builds don't hold up jobs.
+    """
+
+    #: Job models run by worker, oldest jobs of a model are claimed first
+    job_models: List[Type[BackgroundJob]] = [IngestionJob, ExportJob]
+
+    def __init__(self, processes: int = None, poll_interval: float = None, stale_timeout: int = None,
+                 index_sync_interval: int = None):
+        """
+        :param processes: number of processes running jobs, ``settings.JOB_WORKER_PROCESSES`` by default. If 0 jobs
+                          are run in worker process
+        :param poll_interval: interval in seconds between checks for new jobs, ``settings.JOB_POLL_INTERVAL``
+                              by default
+        :param stale_timeout: time in seconds without progress after which running job is marked as failed,
+                              ``settings.JOB_STALE_TIMEOUT`` by default
+        :param index_sync_interval: interval in seconds between syncs of datatable indexes,
+                                    ``settings.DATATABLE_INDEX_SYNC_INTERVAL`` by default. If 0 indexes aren't synced
+        """
+        self.processes = settings.JOB_WORKER_PROCESSES if processes is None else processes
+        self.poll_interval = settings.JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.stale_timeout = settings.JOB_STALE_TIMEOUT if stale_timeout is None else stale_timeout
+        self.index_sync_interval = settings.DATATABLE_INDEX_SYNC_INTERVAL if index_sync_interval is None \
+            else index_sync_interval
+
+        self._stopped = False
+        self._executor = None
+        self._running: Dict[Future, Tuple[Type[BackgroundJob], int]] = {}
+        self._index_sync_thread = None
+        self._index_synced_at = time.monotonic()
+
+    def claim(self, limit: int) -> List[Tuple[Type[BackgroundJob], int]]:
+        """
+        Marks up to ``limit`` oldest claimable jobs as running, within claim limits of job models
+
+        :param limit: maximal number of jobs to be claimed
+        :return: list of claimed jobs as pairs of job model and job id
+        """
+        claimed = []
+        for model in self.job_models:
+            if len(claimed) >= limit:
+                break
+            with transaction.atomic():
+                # limit is read in claiming transaction, so models can lock it until claimed jobs are committed
+                model_limit = model.get_claim_limit()
+                model_limit = limit - len(claimed) if model_limit is None else min(model_limit, limit - len(claimed))
+                if not model_limit:
+                    continue
+                job_ids = list(model.get_claimable().select_for_update(skip_locked=True)
+                               .order_by('created_at')
+                               .values_list('pk', flat=True)[:model_limit])
+                model.objects.filter(pk__in=job_ids).update(status=JobStatus.RUNNING.value, updated_at=timezone.now())
+            claimed.extend((model, job_id) for job_id in job_ids)
+        return claimed
+
+    def fail_stale_jobs(self) -> int:
+        """
+        Fails running jobs that didn't report progress for ``stale_timeout`` seconds, with their ``fail``, so they
+        are cleaned up like jobs that raised an error
+
+        :return: number of failed jobs
+        """
+        failed = 0
+        deadline = timezone.now() - timedelta(seconds=self.stale_timeout)
+        for model in self.job_models:
+            with transaction.atomic():
+                jobs = model.objects.filter(status=JobStatus.RUNNING.value, updated_at__lt=deadline) \
+                    .select_for_update(skip_locked=True)
+                for job in jobs:
+                    job.fail(JobInterrupted('Job was interrupted.'))
+                    failed += 1
+        return failed
+
+    def run_pending(self) -> int:
+        """
+        Claims and starts as many pending jobs as there are idle processes. Without processes jobs are run
+        one after another until none is pending.
+
+        :return: number of started jobs
+        """
+        if not self.processes:
+            started = 0
+            while not self._stopped:
+                claimed = self.claim(1)
+                if not claimed:
+                    break
+                model, job_id = claimed[0]
+                model.objects.get(pk=job_id).run()
+                started += 1
+            return started
+
+        claimed = self.claim(self.processes - len(self._running))
+        for model, job_id in claimed:
+            future = self.__get_executor().submit(run_job, model._meta.label, job_id)
+            self._running[future] = (model, job_id)
+        return len(claimed)
+
+    def sync_indexes(self) -> bool:
+        """
+        Starts sync of datatable indexes if ``index_sync_interval`` passed since the last one and it has finished
+
+        :return: True if sync was started
+        """
+        if not self.index_sync_interval or time.monotonic() - self._index_synced_at < self.index_sync_interval:
+            return False
+        if self._index_sync_thread is not None and self._index_sync_thread.is_alive():
+            return False
+
+        self._index_synced_at = time.monotonic()
+        self._index_sync_thread = threading.Thread(target=sync_all_indexes, name='index-sync', daemon=True)
+        self._index_sync_thread.start()
+        return True
+
+    def run(self, once: bool = False):
+        """
+        Runs jobs until stopped
+
+        :param once: stop when there are no more pending jobs
+        """
+        try:
+            while not self._stopped:
+                try:
+                    self.__collect_finished()
+                    self.fail_stale_jobs()
+                    self.run_pending()
+                    self.sync_indexes()
+                except DatabaseError:
+                    logger.exception('Can\'t fetch jobs from database')
+                    close_old_connections()
+
+                if once and not self._running:
+                    break
+                if self._running:
+                    wait(self._running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(self.poll_interval)
+        finally:
+            # Running jobs are let to finish
+            if self._running:
+                wait(self._running)
+                self.__collect_finished()
+            if self._executor is not None:
+                self._executor.shutdown()
+
+    def stop(self):
+        """
+        Stops claiming new jobs, ``run`` returns once running jobs finish
+        """
+        self._stopped = True
+
+    def __get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=setup_process)
+        return self._executor
+
+    def __collect_finished(self):
+        """
+        Forgets finished jobs. Jobs that crashed their process (so they couldn't report failure themselves) are
+        marked as failed.
+        """
+        for future in [future for future in self._running if future.done()]:
+            model, job_id = self._running.pop(future)
+            error = future.exception()
+            if error is None:
+                continue
+
+            logger.error('%s %s crashed: %r', model.__name__, job_id, error)
+            model.objects.filter(pk=job_id, status=JobStatus.RUNNING.value) \
+                .update(status=JobStatus.FAILED.value, error=str(error) or type(error).__name__,
+                        finished_at=timezone.now())
+            if isinstance(error, BrokenProcessPool) and self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
@@ -0,0 +1,27 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import JobWorker
+
+
+class Command(BaseCommand):
+    help = 'Runs background jobs, eg.: uploads of datatable files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, help='Number of processes running jobs')
+        parser.add_argument('--poll-interval', type=float, help='Interval in seconds between checks for new jobs')
+        parser.add_argument('--once', action='store_true', help='Exit when there are no more pending jobs')
+
+    def handle(self, *args, **options):
+        worker = JobWorker(processes=options['processes'], poll_interval=options['poll_interval'])
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping, waiting for running jobs to finish...')
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(f'Worker started with {worker.processes} processes')
+        worker.run(once=options['once'])
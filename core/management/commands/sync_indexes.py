@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.indexing import IndexManager
+from core.models import Datatable
+
+
+class Command(BaseCommand):
+    help = 'Builds and drops automatic indexes of datatables based on recorded usage of their columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('datatable_ids', nargs='*', type=int, help='Ids of datatables, all by default')
+        parser.add_argument('--budget', type=int, help='Maximal number of automatic indexes per datatable')
+        parser.add_argument('--min-hits', type=int, help='Minimal usage of columns combination to index it')
+
+    def handle(self, *args, **options):
+        datatables = Datatable.objects.all()
+        if options['datatable_ids']:
+            datatables = datatables.filter(pk__in=options['datatable_ids'])
+            if len(datatables) != len(set(options['datatable_ids'])):
+                raise CommandError('Some of datatables don\'t exist')
+
+        for datatable in datatables:
+            created, dropped = IndexManager(datatable).sync(budget=options['budget'], min_hits=options['min_hits'])
+            self.stdout.write(f'{datatable.collection_name}: created {len(created)}, dropped {len(dropped)} indexes')
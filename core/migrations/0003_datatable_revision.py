@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datatable',
+            name='revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
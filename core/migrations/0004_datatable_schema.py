@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:20
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_datatable_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datatable',
+            name='schema',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict),
+        ),
+    ]
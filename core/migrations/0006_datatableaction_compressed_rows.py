@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datatableaction',
+            name='compressed_rows',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -1,2 +1,3 @@
 from .datatable import Datatable
+from .job import BackgroundJob, IngestionJob, ExportJob, JobStatus
 from .datatable_action import DatatableAction, DatatableActionType
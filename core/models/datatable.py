@@ -1,27 +1,33 @@
 from __future__ import annotations
 
 import csv
-import json
+import time
 from abc import ABC, abstractmethod
-from datetime import datetime
-from io import StringIO, BytesIO
-from typing import Type
+from typing import Type, Callable, Iterator, List, Optional, Union
+from uuid import uuid4
+from zipfile import BadZipFile
 
-import numpy
 import pandas as pd
 from bson import ObjectId
 from django.conf import settings
-from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields import ArrayField, JSONField
 # Type imports for Docs
-from django.core.files.uploadedfile import InMemoryUploadedFile
-from django.db import models, transaction
-from pymongo import MongoClient
+from django.core.files.uploadedfile import UploadedFile
+from django.db import connection, models
+from openpyxl.utils.exceptions import InvalidFileException
+from pymongo import MongoClient, IndexModel, InsertOne, UpdateOne, DeleteOne, ReplaceOne, ReturnDocument
 from pymongo.collection import Collection
 from pymongo.cursor import Cursor
-from pymongo.results import InsertOneResult, UpdateResult, DeleteResult
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+from pymongo.results import InsertOneResult, UpdateResult, DeleteResult, BulkWriteResult
 
-from core.exceptions import WrongFileType
+from core.exceptions import WrongFileType, CorruptedFile
+from core.ingestion import iter_csv_chunks, iter_excel_chunks, dataframe_to_documents, read_first_line, \
+    BulkInsertPipeline
 from core.models.datatable_action import DatatableAction, DatatableActionType
+from core.mongo import mongo_clients, get_update
+from core.schema import SchemaInference
 
 
 class DatatableClient(ABC):
@@ -30,7 +36,7 @@ class DatatableClient(ABC):
     """
 
     @abstractmethod
-    def get_rows(self, query: dict = None):
+    def get_rows(self, query: dict = None, projection: dict = None):
         """
         Returns rows form given DB based on query
         """
@@ -48,9 +54,9 @@ class DatatableClient(ABC):
         """
 
     @abstractmethod
-    def patch_row(self, row_id: str, data: dict):
+    def patch_row(self, row_id: str, data: dict, unset: List[str] = None):
         """
-        Updates row specified by id with data
+        Updates row specified by id with data, removing unset columns
         """
 
     @abstractmethod
@@ -60,7 +66,31 @@ class DatatableClient(ABC):
         """
 
     @abstractmethod
-    def upload_file_to_db(self, file: InMemoryUploadedFile):
+    def find_and_patch_row(self, row_id: str, data: dict, unset: List[str] = None):
+        """
+        Updates row specified by id and returns it as it was before update
+        """
+
+    @abstractmethod
+    def find_and_delete_row(self, row_id: str):
+        """
+        Deletes row specified by id and returns it
+        """
+
+    @abstractmethod
+    def bulk_write(self, requests: list):
+        """
+        Writes many rows at once
+        """
+
+    @abstractmethod
+    def count_rows(self, query: dict = None, limit: int = None):
+        """
+        Counts rows matching query
+        """
+
+    @abstractmethod
+    def upload_file_to_db(self, file: UploadedFile, progress: Callable[[str, int], None] = None):
         """
         Upload given file as rows of a new table in DB
         """
@@ -71,25 +101,47 @@ class DatatableMongoClient(DatatableClient):
     MongoDB client for Datatable model
     """
 
-    def __init__(self, collection_name: str, mongo_client: Type[MongoClient] = MongoClient):
-        db = mongo_client(
-            host=settings.MONGO_HOST,
-            port=settings.MONGO_PORT,
-            username=settings.MONGO_USER,
-            password=settings.MONGO_PASSWORD,
-            connect=True
-        )[settings.MONGO_DATABASE]
-        self.collection: Collection = db[collection_name]
+    #: Infix of names of collections that uploaded files are staged in before replacing datatable collection
+    staging_infix = '__staging_'
+
+    def __init__(self, collection_name: str, mongo_client: MongoClient = None):
+        self.collection_name = collection_name
+        self.mongo_client = mongo_client
         self.columns = []
+        self.schema = {}
+        self._database = None
+
+    @property
+    def database(self) -> Database:
+        """
+        MongoDB database holding datatables. It's attached on first access, using process-wide pooled client
+        unless ``mongo_client`` was given.
+
+        :return: MongoDB database
+        """
+        if self._database is None:
+            mongo_client = self.mongo_client or mongo_clients.get_client()
+            self._database = mongo_client[settings.MONGO_DATABASE]
+        return self._database
+
+    @property
+    def collection(self) -> Collection:
+        """
+        MongoDB collection holding datatable rows
 
-    def get_rows(self, query: dict = None) -> Cursor:
+        :return: MongoDB collection
+        """
+        return self.database[self.collection_name]
+
+    def get_rows(self, query: dict = None, projection: dict = None) -> Cursor:
         """
         Queries MongoDB datatable
 
         :param query: MongoDB query
+        :param projection: MongoDB projection of returned fields, whole rows by default
         :return: MongoDB cursor with rows returned by query or all rows if query wasn't specified
         """
-        return self.collection.find(query if query else {})
+        return self.collection.find(query if query else {}, projection)
 
     def has_row(self, row_id: str) -> bool:
         """
@@ -114,16 +166,20 @@ class DatatableMongoClient(DatatableClient):
         result = self.collection.insert_one(data)
         return result
 
-    def patch_row(self, row_id: str, data: dict) -> UpdateResult:
+    def patch_row(self, row_id: str, data: dict, unset: List[str] = None) -> Optional[UpdateResult]:
         """
         Updates row in datatable
 
         :param data: MongoDB structured (json) new row data
         :param row_id: BSON compliant row id of row to be updated
-        :return: MongoDB update result
+        :param unset: columns to be removed from row
+        :return: MongoDB update result, ``None`` if there's nothing to update
         """
         data.pop('_id', None)
-        return self.collection.update_one({'_id': ObjectId(row_id)}, {'$set': data})
+        update = get_update(data, unset)
+        if not update:
+            return None
+        return self.collection.update_one({'_id': ObjectId(row_id)}, update)
 
     def delete_row(self, row_id: str) -> DeleteResult:
         """
@@ -134,60 +190,162 @@ class DatatableMongoClient(DatatableClient):
         """
         return self.collection.delete_one({'_id': ObjectId(row_id)})
 
-    def upload_file_to_db(self, file: InMemoryUploadedFile):
+    def find_and_patch_row(self, row_id: str, data: dict, unset: List[str] = None) -> Optional[dict]:
+        """
+        Updates row in datatable and fetches its previous state in one atomic operation
+
+        :param row_id: BSON compliant row id of row to be updated
+        :param data: MongoDB structured (json) new row data
+        :param unset: columns to be removed from row
+        :return: row as it was before update, ``None`` if there's no such row
+        """
+        data.pop('_id', None)
+        update = get_update(data, unset)
+        if not update:
+            return self.collection.find_one({'_id': ObjectId(row_id)})
+        return self.collection.find_one_and_update({'_id': ObjectId(row_id)}, update,
+                                                   return_document=ReturnDocument.BEFORE)
+
+    def find_and_delete_row(self, row_id: str) -> Optional[dict]:
+        """
+        Deletes row in datatable and fetches it in one atomic operation
+
+        :param row_id: id of row to be deleted
+        :return: deleted row, ``None`` if there's no such row
+        """
+        return self.collection.find_one_and_delete({'_id': ObjectId(row_id)})
+
+    def bulk_write(self, requests: List[Union[InsertOne, UpdateOne, ReplaceOne, DeleteOne]]) -> BulkWriteResult:
+        """
+        Writes rows in bulk, in order of requests, stopping at first failed request
+
+        :param requests: MongoDB write requests
+        :return: MongoDB bulk write result
+        :raise BulkWriteError: when one of requests failed
+        """
+        return self.collection.bulk_write(requests, ordered=True)
+
+    def count_rows(self, query: dict = None, limit: int = None) -> int:
+        """
+        Counts rows matching query. Rows of whole datatable are counted from collection metadata, without a scan.
+
+        :param query: MongoDB query
+        :param limit: maximal number of rows to scan, applies only to filtered rows
+        :return: number of rows
+        """
+        if not query:
+            return self.collection.estimated_document_count()
+        return self.collection.count_documents(query, **({'limit': limit} if limit else {}))
+
+    def upload_file_to_db(self, file: UploadedFile, progress: Callable[[str, int], None] = None):
         """
-        Load file to as a collection of given database
+        Load file to as a collection of given database.
+
+        File is parsed and inserted in a single pass into a staging collection. When whole file was loaded, indexes
+        of datatable collection are built on staging collection, which then atomically replaces datatable collection
+        (``renameCollection`` with ``dropTarget``). Readers never see partially loaded table and replacing a table
+        takes time proportional to the new data only. If file can't be parsed staging collection is dropped and
+        datatable is left untouched.
 
+        :exception WrongFileType: raises when file is of unsupported type
+        :exception CorruptedFile: raises when file can't be parsed
         :param file: request file in *csv* or *xlsx* format to be uploaded to MongoDB
+        :param progress: callable receiving upload stage (``inserting``, ``indexing``, ``replacing``) and number of
+                         rows inserted so far
         """
+        progress = progress or (lambda stage, rows_processed: None)
         try:
             file_type = settings.SUPPORTED_MIME_TYPES[file.content_type]
         except KeyError:
             raise WrongFileType(f'File with content-type {file.content_type} is unsupported.')
 
-        if file_type == 'csv':
-            in_memory_file = StringIO(file.file.read().decode('utf-8'))
+        self.drop_stale_staging_collections()
+
+        staging_name = f'{self.collection_name}{self.staging_infix}{int(time.time())}_{uuid4().hex}'
+        staging_collection = self.database[staging_name]
+        try:
+            if file_type == 'csv':
+                # CSV is parsed straight from uploaded file
+                chunks = iter_csv_chunks(file, self.__get_csv_delimiter(file))
+            else:  # file_type == 'excel'
+                # Workbook is streamed by read-only reader
+                chunks = iter_excel_chunks(file)
+            inserted_rows = self.__load_chunks(chunks, staging_collection, progress)
+            if inserted_rows:
+                progress('indexing', inserted_rows)
+                self.__copy_indexes(staging_collection)
+        except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError, BadZipFile,
+                InvalidFileException) as e:
+            staging_collection.drop()
+            raise CorruptedFile(f'{file_type.upper()} file is corrupted. {e}')
+        except BaseException:
+            staging_collection.drop()
+            raise
+
+        progress('replacing', inserted_rows)
+        if inserted_rows:
+            staging_collection.rename(self.collection_name, dropTarget=True)
         else:
-            in_memory_file = BytesIO(file.file.read())
-
-        # drop datatable if exists
-        self.collection.delete_many({})
-
-        if file_type == 'csv':
-            # CSV can be loaded in chunks
-            delimiter = self.__get_csv_delimiter(file)
-
-            chunk = None
-            for chunk in pd.read_csv(in_memory_file, chunksize=2048, sep=delimiter):
-                payload = json.loads(chunk.to_json(orient='records', date_format='iso'))
-                self.collection.insert_many(payload)
-            self.columns = list(chunk.columns)
-        else:  # file_type == 'excel'
-            loaded_file = pd.read_excel(in_memory_file)
-            columns = self.__get_string_converter_for_datetime_columns(loaded_file)
-            for column in columns:
-                if self.__if_date_column(loaded_file[column]):
-                    loaded_file[column] = loaded_file[column].dt.strftime('%Y-%m-%d')
-
-            self.collection.insert_many(json.loads(loaded_file.to_json(orient='records', date_format='iso')))
-            self.columns = list(loaded_file.columns)
+            # file had no rows, so nothing was staged
+            self.collection.drop()
 
-    @staticmethod
-    def __get_csv_delimiter(file):
-        file.file.seek(0)
-        chunk = file.file.readline().decode('utf-8')
-        file.file.seek(0)
+    def drop_stale_staging_collections(self, max_age: int = None):
+        """
+        Drops staging collections of this datatable left by uploads that were interrupted (eg. killed worker)
 
-        return csv.Sniffer().sniff(chunk).delimiter
+        :param max_age: age in seconds after which staging collection is considered stale,
+                        ``settings.DATATABLE_STAGING_TTL`` by default
+        """
+        prefix = f'{self.collection_name}{self.staging_infix}'
+        oldest_timestamp = time.time() - (settings.DATATABLE_STAGING_TTL if max_age is None else max_age)
+        for name in self.database.list_collection_names():
+            if not name.startswith(prefix):
+                continue
+            timestamp, _, _ = name[len(prefix):].partition('_')
+            if not timestamp.isdigit() or int(timestamp) < oldest_timestamp:
+                self.database.drop_collection(name)
 
-    @staticmethod
-    def __if_date_column(column):
-        zero_time = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).time()
-        return all(list(map(lambda x: x.time() == zero_time, column)))
+    def __copy_indexes(self, staging_collection: Collection):
+        """
+        Builds secondary indexes of datatable collection on staging collection, skipping ones on columns that staging
+        collection doesn't have. Building indexes on loaded collection is faster than maintaining them during inserts.
+
+        :param staging_collection: collection with uploaded rows
+        """
+        indexes = []
+        for name, index in self.collection.index_information().items():
+            if name == '_id_' or any(key not in self.columns for key, _ in index['key']):
+                continue
+            options = {option: value for option, value in index.items() if option not in ('key', 'v', 'ns')}
+            indexes.append(IndexModel(index['key'], name=name, **options))
+
+        if indexes:
+            staging_collection.create_indexes(indexes)
+
+    def __load_chunks(self, chunks: Iterator[pd.DataFrame], collection: Collection,
+                      progress: Callable[[str, int], None]) -> int:
+        """
+        Inserts parsed chunks of uploaded file in parallel to parsing, inferring columns and schema of datatable
+
+        :param chunks: iterator of parsed chunks, eg. from ``iter_csv_chunks`` or ``iter_excel_chunks``
+        :param collection: collection rows are inserted to
+        :param progress: callable receiving number of inserted rows after each parsed chunk
+        :return: number of inserted rows
+        """
+        chunk = None
+        schema_inference = SchemaInference()
+        with BulkInsertPipeline(collection) as pipeline:
+            for chunk in chunks:
+                pipeline.put(dataframe_to_documents(chunk))
+                schema_inference.update(chunk)
+                progress('inserting', pipeline.inserted_rows)
+        self.columns = list(chunk.columns) if chunk is not None else []
+        self.schema = schema_inference.schema
+        return pipeline.inserted_rows
 
     @staticmethod
-    def __get_string_converter_for_datetime_columns(df: pd.Dataframe):
-        return list(df.columns[df.dtypes == numpy.dtype(numpy.datetime64('2000-01-01T00:00:00.000000000'))])
+    def __get_csv_delimiter(file):
+        return csv.Sniffer().sniff(read_first_line(file)).delimiter
 
 
 class Datatable(models.Model):
@@ -204,6 +362,14 @@ class Datatable(models.Model):
     #: List of existing column names
     columns = ArrayField(models.TextField(blank=True), blank=True, null=True)
 
+    #: Schema of columns inferred at upload, eg.: ``{"height": {"type": "float", "nullable": false}}``. Types are
+    #: ``integer``, ``float``, ``boolean``, ``string``, ``date``, ``datetime`` (dates have their ``format``) and
+    #: ``mixed``
+    schema = JSONField(default=dict, blank=True)
+
+    #: Number of changes of datatable rows, cached data of older revisions is outdated
+    revision = models.PositiveIntegerField(default=0)
+
     def save(self, *args, **kwargs):
         """
         Saves Datatable metadata to database
@@ -222,16 +388,31 @@ class Datatable(models.Model):
         instance.__set_database_client()
         return instance
 
-    def upload_datatable_file(self, file: InMemoryUploadedFile):
+    def upload_datatable_file(self, file: UploadedFile, progress: Callable[[str, int], None] = None):
         """
         Upload file to database table using attached client
 
         :param file: file to upload
+        :param progress: callable receiving upload stage and number of rows inserted so far
+        """
+        self.client.upload_file_to_db(file, progress)
+        self.columns = self.client.columns
+        self.schema = self.client.schema
+        self.save()
+        self.bump_revision()
+
+    def bump_revision(self):
+        """
+        Marks datatable rows as changed. Revision is incremented and read back with single ``UPDATE ... RETURNING``
+        query, so concurrent writes never get the same revision.
         """
-        with transaction.atomic():
-            self.client.upload_file_to_db(file)
-            self.columns = self.client.columns
-            self.save()
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {connection.ops.quote_name(self._meta.db_table)} SET revision = revision + 1 '
+                           f'WHERE {connection.ops.quote_name(self._meta.pk.column)} = %s RETURNING revision', [self.pk])
+            row = cursor.fetchone()
+        if row is None:
+            raise Datatable.DoesNotExist('Datatable matching query does not exist.')
+        self.revision = row[0]
 
     def register_action(self, user, action: DatatableActionType, old_row: dict = None,
                         new_row: dict = None) -> DatatableAction:
@@ -240,11 +421,76 @@ class Datatable(models.Model):
 
         :return: created action model
         """
-        return DatatableAction.objects.create(user=user,
-                                              action=action,
-                                              datatable=self,
-                                              old_row=old_row,
-                                              new_row=new_row)
+        self.bump_revision()
+        action = self.build_action(user, action, old_row, new_row)
+        action.save()
+        return action
+
+    def register_actions(self, actions: List[DatatableAction]) -> List[DatatableAction]:
+        """
+        Register many actions committed on this Datatable to history at once
+
+        :param actions: actions built with ``build_action``
+        :return: created action models
+        """
+        if not actions:
+            return []
+        self.bump_revision()
+        return DatatableAction.objects.bulk_create(actions, batch_size=settings.DATATABLE_BATCH_HISTORY_SIZE)
+
+    def revert_actions(self, actions: models.QuerySet) -> int:
+        """
+        Reverts many actions committed on this Datatable at once. Compensating writes are computed newest action first,
+        so row reverted by a few actions ends up in its oldest state, and sent with single bulk write. Actions are
+        marked as reverted with single query.
+
+        If one of writes fails, actions reverted by writes sent before it are still marked as reverted.
+
+        :param actions: actions of this datatable, already reverted ones are skipped
+        :return: number of reverted actions
+        :raise BulkWriteError: when one of writes failed, ``index`` of write error is index of failed action
+        :exception WrongAction: raises when one of actions is of unimplemented type
+        """
+        actions = list(actions.filter(datatable=self, reverted=False).order_by('-created_at', '-id'))
+        if not actions:
+            return 0
+
+        # actions with nothing to revert have no write request
+        requests = [(index, action.get_revert_request()) for index, action in enumerate(actions)]
+        requests = [(index, request) for index, request in requests if request is not None]
+        try:
+            if requests:
+                self.client.bulk_write([request for _, request in requests])
+        except BulkWriteError as error:
+            write_error = error.details['writeErrors'][0]
+            write_error['index'] = requests[write_error['index']][0]
+            self.__set_reverted(actions[:write_error['index']])
+            raise
+        self.__set_reverted(actions)
+        return len(actions)
+
+    def build_action(self, user, action: DatatableActionType, old_row: dict = None,
+                     new_row: dict = None) -> DatatableAction:
+        """
+        Builds action committed on this Datatable, without saving it
+
+        :return: unsaved action model
+        """
+        action = DatatableAction(user=user,
+                                 action=action,
+                                 datatable=self)
+        action.set_rows(old_row=old_row, new_row=new_row)
+        return action
+
+    def __set_reverted(self, actions: List[DatatableAction]):
+        """
+        Marks actions as reverted and datatable rows as changed
+
+        :param actions: reverted actions
+        """
+        if actions:
+            DatatableAction.objects.filter(pk__in=[action.pk for action in actions]).update(reverted=True)
+            self.bump_revision()
 
     def __set_database_client(self, client: Type[DatatableClient] = DatatableMongoClient):
         """
@@ -278,3 +524,10 @@ class Datatable(models.Model):
 
     def has_object_write_permission(self, request):
         return self.has_write_permission(request)
+
+    @staticmethod
+    def has_indexes_permission(request):
+        return request.user.is_superuser
+
+    def has_object_indexes_permission(self, request):
+        return self.has_indexes_permission(request)
@@ -1,12 +1,18 @@
+import json
+import zlib
 from enum import Enum
-from typing import List, Tuple
+from typing import List, Optional, Tuple, Union
 
+from bson import ObjectId
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import JSONField
 from django.db import models
+from django.utils.functional import cached_property
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
 
 from core.exceptions import WrongAction
+from core.mongo import get_update
 
 
 class DatatableActionType(Enum):
@@ -43,36 +49,119 @@ class DatatableAction(models.Model):
     #: Time of action commitment
     created_at = models.DateTimeField(auto_now_add=True)
 
-    #: State of row before edition/deletion
+    #: State of row before edition/deletion, only edited columns of updated row
     old_row = JSONField(null=True)
-    #: State of row after edition/creation
+    #: State of row after edition/creation, only edited columns of updated row
     new_row = JSONField(null=True)
+    #: Old and new row compressed with zlib, instead of ``old_row`` and ``new_row``, see ``set_rows``
+    compressed_rows = models.BinaryField(null=True, editable=False)
     #: Information if action was already reverted
     reverted = models.BooleanField(default=False)
 
+    def set_rows(self, old_row: dict = None, new_row: dict = None):
+        """
+        Sets rows of action. If ``settings.DATATABLE_HISTORY_COMPRESSION`` is on they are stored compressed in
+        ``compressed_rows``.
+
+        :param old_row: state of row before action, with ``_id`` as string
+        :param new_row: state of row after action, with ``_id`` as string
+        """
+        self.__dict__.pop('decompressed_rows', None)
+        if settings.DATATABLE_HISTORY_COMPRESSION:
+            self.old_row = self.new_row = None
+            self.compressed_rows = zlib.compress(json.dumps([old_row, new_row], separators=(',', ':')).encode('utf-8'))
+        else:
+            self.old_row, self.new_row = old_row, new_row
+            self.compressed_rows = None
+
+    def get_rows(self) -> Tuple[Optional[dict], Optional[dict]]:
+        """
+        Gets rows of action, decompressing them if they are compressed
+
+        :return: state of row before and after action
+        """
+        if self.compressed_rows is None:
+            return self.old_row, self.new_row
+        return self.decompressed_rows
+
+    @cached_property
+    def decompressed_rows(self) -> Tuple[Optional[dict], Optional[dict]]:
+        """
+        Rows of action decompressed from ``compressed_rows``, decompressed once per instance
+        """
+        old_row, new_row = json.loads(zlib.decompress(self.compressed_rows))
+        return old_row, new_row
+
+    def get_unset_columns(self) -> List[str]:
+        """
+        Gets columns row of update action didn't have before update, they are removed when action is reverted
+
+        :return: columns of new row missing in old row
+        """
+        old_row, new_row = self.get_rows()
+        return [column for column in new_row if column not in old_row]
+
+    @staticmethod
+    def get_update_rows(row: dict, data: dict, unset: List[str] = ()) -> Tuple[dict, dict]:
+        """
+        Builds rows of update action: row id and edited columns only, which is enough to revert it, so history of
+        an edit grows with number of edited columns instead of number of all columns. Columns row didn't have are
+        missing in old row, removed columns are missing in new row.
+
+        :param row: state of row before update
+        :param data: new values of edited columns
+        :param unset: columns removed from row
+        :return: old and new values of edited columns, with ``_id`` as string
+        """
+        row_id = str(row['_id'])
+        return ({'_id': row_id, **{column: row[column] for column in [*data, *unset] if column in row}},
+                {'_id': row_id, **data})
+
     def revert_action(self):
         """
         Reverts action based on action type and stored old row
         :exception WrongAction: raises when action value is of unimplemented type
         """
+        old_row, new_row = self.get_rows()
         if self.action == DatatableActionType.DELETE.value:
-            self.datatable.client.add_row(self.old_row, row_id=self.old_row['_id'])
+            self.datatable.client.add_row(old_row, row_id=old_row['_id'])
             self.__set_reverted()
         elif self.action == DatatableActionType.CREATE.value:
-            self.datatable.client.delete_row(self.new_row['_id'])
+            self.datatable.client.delete_row(new_row['_id'])
             self.__set_reverted()
         elif self.action == DatatableActionType.UPDATE.value:
-            self.datatable.client.patch_row(self.old_row['_id'], self.old_row)
+            self.datatable.client.patch_row(old_row['_id'], dict(old_row), unset=self.get_unset_columns())
             self.__set_reverted()
         else:
             raise WrongAction(f'Action {self.action} is not proper action')
 
+    def get_revert_request(self) -> Optional[Union[DeleteOne, ReplaceOne, UpdateOne]]:
+        """
+        Builds MongoDB write request reverting action, used to revert many actions with single bulk write. Deleted
+        row is restored with upsert, so restoring it again doesn't fail.
+
+        :return: MongoDB write request, ``None`` if update action changed no columns
+        :exception WrongAction: raises when action value is of unimplemented type
+        """
+        old_row, new_row = self.get_rows()
+        if self.action == DatatableActionType.DELETE.value:
+            row = {key: value for key, value in old_row.items() if key != '_id'}
+            return ReplaceOne({'_id': ObjectId(old_row['_id'])}, row, upsert=True)
+        elif self.action == DatatableActionType.CREATE.value:
+            return DeleteOne({'_id': ObjectId(new_row['_id'])})
+        elif self.action == DatatableActionType.UPDATE.value:
+            row = {key: value for key, value in old_row.items() if key != '_id'}
+            update = get_update(row, self.get_unset_columns())
+            return UpdateOne({'_id': ObjectId(old_row['_id'])}, update) if update else None
+        raise WrongAction(f'Action {self.action} is not proper action')
+
     def __set_reverted(self):
         """
-        Sets reverted to True and push it to DB
+        Sets reverted to True and push it to DB, marking datatable rows as changed
         """
         self.reverted = True
         self.save(update_fields=['reverted'])
+        self.datatable.bump_revision()
 
     class Meta:
         ordering = ['-created_at']
@@ -0,0 +1,359 @@
+import logging
+import os
+import time
+from datetime import timedelta
+from enum import Enum
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.fields import JSONField
+from django.core.files.uploadedfile import UploadedFile
+from django.db import connection, models
+from django.db.models import Q
+from django.utils import timezone
+from requests import RequestException
+
+from core.exceptions import DataverseError, JobInterrupted
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus(Enum):
+    """
+    Statuses of background jobs
+    """
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+
+    @staticmethod
+    def choices() -> List[Tuple[str, str]]:
+        """
+        Return available statuses as choices
+
+        :return: Django compliant choices list
+        """
+        return [(choice.value, choice.name) for choice in JobStatus]
+
+
+class BackgroundJob(models.Model):
+    """
+    Base of jobs run outside of request by ``run_worker`` command. Database table of a job model is its queue.
+    """
+
+    #: User that requested a job
+    user = models.ForeignKey(get_user_model(), on_delete=models.SET_NULL, null=True, related_name='+')
+    #: Job status
+    status = models.CharField(choices=JobStatus.choices(), default=JobStatus.PENDING.value, max_length=10,
+                              db_index=True)
+    #: Step of a job that is currently executed
+    stage = models.CharField(max_length=32, blank=True)
+    #: Error message of failed job
+    error = models.TextField(blank=True)
+
+    #: Time of job request
+    created_at = models.DateTimeField(auto_now_add=True)
+    #: Time of last job progress, used to detect jobs of killed workers
+    updated_at = models.DateTimeField(auto_now=True)
+    #: Time of job start
+    started_at = models.DateTimeField(null=True)
+    #: Time of job end
+    finished_at = models.DateTimeField(null=True)
+
+    #: Minimal interval in seconds between progress updates saved to database
+    progress_interval = 1
+
+    @property
+    def duration(self) -> float:
+        """
+        Duration of a job in seconds, up to now if job is still running
+        """
+        if not self.started_at:
+            return 0.0
+        return ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+
+    def run(self):
+        """
+        Runs a job, marking it as running and afterwards as done or failed. Job logic is implemented in ``execute``.
+        """
+        self.set_progress(status=JobStatus.RUNNING.value, started_at=timezone.now())
+        try:
+            self.execute()
+        except Exception as e:
+            logger.exception('%s %s failed', type(self).__name__, self.pk)
+            self.fail(e)
+        else:
+            self.set_progress(status=JobStatus.DONE.value, stage='', finished_at=timezone.now())
+
+    def execute(self):
+        """
+        Executes job logic
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def get_claimable(cls) -> models.QuerySet:
+        """
+        Gets jobs that can be claimed by worker now
+
+        :return: pending jobs
+        """
+        return cls.objects.filter(status=JobStatus.PENDING.value)
+
+    @classmethod
+    def get_claim_limit(cls) -> Optional[int]:
+        """
+        Gets maximal number of jobs that can be claimed by worker now. It's called in transaction claiming jobs.
+
+        :return: number of jobs, ``None`` if it isn't limited
+        """
+        return None
+
+    def fail(self, error: Exception):
+        """
+        Marks job as failed
+
+        :param error: reason of failure
+        """
+        self.set_progress(status=JobStatus.FAILED.value, error=str(error) or type(error).__name__,
+                          finished_at=timezone.now())
+
+    def set_progress(self, **fields):
+        """
+        Sets given fields and saves only them to database
+
+        :param fields: job fields to be updated
+        """
+        for field, value in fields.items():
+            setattr(self, field, value)
+        self.save(update_fields=[*fields, 'updated_at'])
+
+    class Meta:
+        abstract = True
+        ordering = ['-created_at']
+
+    # DRY Permissions
+
+    @staticmethod
+    def has_read_permission(request):
+        return request.user.is_superuser or request.user.groups.filter(name__in=[settings.READONLY_GROUP_NAME,
+                                                                                 settings.READWRITE_GROUP_NAME])
+
+    def has_object_read_permission(self, request):
+        return self.has_read_permission(request)
+
+
+class IngestionJob(BackgroundJob):
+    """
+    Upload of a file to datatable, run in background. Uploaded file is kept in ``settings.INGESTION_MEDIA_PATH``
+    until job finishes.
+    """
+
+    #: Datatable file is uploaded to. It's removed if its first upload fails
+    datatable = models.ForeignKey('Datatable', on_delete=models.SET_NULL, null=True, related_name='ingestion_jobs')
+    #: Path of stored uploaded file
+    file_path = models.CharField(max_length=1024)
+    #: Name of uploaded file
+    file_name = models.CharField(max_length=255)
+    #: Content type of uploaded file
+    content_type = models.CharField(max_length=255)
+    #: Number of rows already inserted
+    rows_processed = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def create_from_upload(cls, datatable, file: UploadedFile, user=None) -> 'IngestionJob':
+        """
+        Stores uploaded file on disk and queues its ingestion
+
+        :param datatable: Datatable file should be uploaded to
+        :param file: uploaded file
+        :param user: user requesting upload
+        :return: created pending job
+        """
+        Path(settings.INGESTION_MEDIA_PATH).mkdir(parents=True, exist_ok=True)
+        file_path = os.path.join(settings.INGESTION_MEDIA_PATH, uuid4().hex)
+        with open(file_path, 'wb') as stored_file:
+            for chunk in file.chunks():
+                stored_file.write(chunk)
+
+        return cls.objects.create(datatable=datatable, user=user, file_path=file_path, file_name=file.name,
+                                  content_type=file.content_type)
+
+    @property
+    def throughput(self) -> float:
+        """
+        Number of rows inserted per second
+        """
+        duration = self.duration
+        return self.rows_processed / duration if duration else 0.0
+
+    def execute(self):
+        """
+        Uploads stored file to datatable, reporting stage and number of inserted rows
+        """
+        last_report = 0.0
+
+        def report_progress(stage: str, rows_processed: int):
+            nonlocal last_report
+            if stage != self.stage or time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                self.set_progress(stage=stage, rows_processed=rows_processed)
+
+        try:
+            with open(self.file_path, 'rb') as stored_file:
+                file = UploadedFile(stored_file, name=self.file_name, content_type=self.content_type)
+                self.datatable.upload_datatable_file(file, progress=report_progress)
+        finally:
+            self.__remove_file()
+
+    def fail(self, error: Exception):
+        """
+        Marks job as failed, removes stored file and datatable that has no rows yet
+
+        :param error: reason of failure
+        """
+        if self.datatable and not self.datatable.columns:
+            self.datatable.delete()
+            self.datatable = None
+        self.__remove_file()
+        super().fail(error)
+
+    def __remove_file(self):
+        try:
+            os.remove(self.file_path)
+        except FileNotFoundError:
+            pass
+
+
+class ExportJob(BackgroundJob):
+    """
+    Export of filtered datatable rows to Dataverse dataset, run in background. Rows are streamed to Dataverse as CSV
+    file, without storing it on disk.
+
+    Export that failed because Dataverse couldn't be reached or was overloaded is retried up to
+    ``settings.EXPORT_JOB_MAX_ATTEMPTS`` times, with delay starting at ``settings.EXPORT_JOB_RETRY_DELAY`` seconds
+    and doubling after every attempt. At most ``settings.EXPORT_JOB_CONCURRENCY`` exports run at once.
+    """
+
+    #: Exported datatable
+    datatable = models.ForeignKey('Datatable', on_delete=models.SET_NULL, null=True, related_name='export_jobs')
+    #: Persistent identifier of Dataverse dataset file is added to
+    dataset_pid = models.CharField(max_length=255)
+    #: MongoDB query of exported rows
+    query = JSONField(default=dict, blank=True)
+    #: MongoDB ordering of exported rows, list of ``[column name, asc or desc order]``
+    ordering = JSONField(default=list, blank=True)
+    #: Exported columns, all columns by default
+    columns = JSONField(null=True, blank=True)
+    #: Whether file is gzip compressed
+    compress = models.BooleanField(default=False)
+    #: Name of uploaded file
+    file_name = models.CharField(max_length=255, blank=True)
+    #: Number of bytes of file sent in current attempt
+    bytes_sent = models.BigIntegerField(default=0)
+    #: Number of started attempts
+    attempts = models.PositiveIntegerField(default=0)
+    #: Time after which failed export is retried
+    retry_at = models.DateTimeField(null=True, blank=True)
+
+    #: Key of PostgreSQL advisory lock serializing claims of exports
+    claim_lock_id = 0x45585054
+
+    @classmethod
+    def get_claimable(cls) -> models.QuerySet:
+        """
+        Gets pending jobs, without jobs waiting for retry
+
+        :return: pending jobs
+        """
+        return super().get_claimable().filter(Q(retry_at__isnull=True) | Q(retry_at__lte=timezone.now()))
+
+    @classmethod
+    def get_claim_limit(cls) -> Optional[int]:
+        """
+        Gets number of exports that can be started without exceeding ``settings.EXPORT_JOB_CONCURRENCY``. Limit is
+        shared by all workers, as it's checked against running jobs in database. Transaction advisory lock is taken
+        first, so other workers wait with their check until jobs claimed in this transaction are committed as running.
+
+        :return: number of jobs
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [cls.claim_lock_id])
+        return max(settings.EXPORT_JOB_CONCURRENCY - cls.objects.filter(status=JobStatus.RUNNING.value).count(), 0)
+
+    @property
+    def throughput(self) -> float:
+        """
+        Number of bytes sent per second
+        """
+        duration = self.duration
+        return self.bytes_sent / duration if duration else 0.0
+
+    def execute(self):
+        """
+        Checks if dataset exists and streams rows to it, reporting number of sent bytes
+        """
+        # imported here, as streaming imports serializers which import models
+        from core.dataverse import dataverse_clients, get_error_message
+        from core.streaming import iter_csv, iter_gzip
+
+        self.set_progress(stage='connecting', attempts=self.attempts + 1, bytes_sent=0, retry_at=None, error='')
+        if self.datatable is None:
+            raise ValueError('Datatable was deleted.')
+        client = dataverse_clients.get_client()
+        if not client.get_dataset(self.dataset_pid):
+            raise DataverseError('Dataset doesn\'t exist in Dataverse.', 404)
+
+        columns = self.columns or self.datatable.columns
+        projection = {'_id': True, **{column: True for column in columns}} if self.columns else None
+        cursor = self.datatable.client.get_rows(self.query, projection)
+        if self.ordering:
+            cursor = cursor.sort([(column, direction) for column, direction in self.ordering])
+
+        content = iter_csv(cursor, ['_id', *columns])
+        content_type = 'text/csv'
+        if self.compress:
+            content = iter_gzip(content)
+            content_type = 'application/gzip'
+
+        self.set_progress(stage='uploading')
+        response = client.add_file(self.dataset_pid, self.file_name, self.__report_progress(content), content_type)
+        if response.status_code != 200:
+            raise DataverseError(get_error_message(response), response.status_code)
+        self.set_progress(bytes_sent=self.bytes_sent)
+
+    def fail(self, error: Exception):
+        """
+        Queues retry of export if Dataverse couldn't be reached or was overloaded, or worker was killed, and attempts
+        are left, marks job as failed otherwise
+
+        :param error: reason of failure
+        """
+        retryable = isinstance(error, (RequestException, JobInterrupted)) or \
+            isinstance(error, DataverseError) and error.retryable
+        if not retryable or self.attempts >= settings.EXPORT_JOB_MAX_ATTEMPTS:
+            super().fail(error)
+            return
+
+        delay = settings.EXPORT_JOB_RETRY_DELAY * 2 ** (self.attempts - 1)
+        self.set_progress(status=JobStatus.PENDING.value, stage='', error=str(error) or type(error).__name__,
+                          retry_at=timezone.now() + timedelta(seconds=delay))
+
+    # DRY Permissions
+
+    @staticmethod
+    def has_metrics_permission(request):
+        return request.user.is_superuser
+
+    def __report_progress(self, content: Iterable[bytes]) -> Iterator[bytes]:
+        last_report = time.monotonic()
+        for chunk in content:
+            self.bytes_sent += len(chunk)
+            if time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                self.set_progress(bytes_sent=self.bytes_sent)
+            yield chunk
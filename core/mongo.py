@@ -0,0 +1,101 @@
+import logging
+from typing import List, Type
+
+from django.conf import settings
+from pymongo import MongoClient
+from pymongo.database import Database
+from pymongo.errors import PyMongoError
+
+from core.registry import ClientRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class MongoClientRegistry(ClientRegistry):
+    """
+    Process-wide registry of pooled MongoDB clients.
+
+    ``MongoClient`` is thread-safe and maintains its own connection pool and monitor threads, so one instance should be
+    shared by every Datatable in a process instead of being built per model instance. Clients are keyed by their
+    connection options, see ``core.registry.ClientRegistry``.
+    """
+
+    def __init__(self, client_class: Type[MongoClient] = MongoClient):
+        super().__init__()
+        self.client_class = client_class
+
+    @staticmethod
+    def get_client_options() -> dict:
+        """
+        Builds MongoClient keyword arguments from settings
+
+        :return: MongoClient connection and pool options
+        """
+        options = {
+            'host': settings.MONGO_HOST,
+            'port': settings.MONGO_PORT,
+            'username': settings.MONGO_USER,
+            'password': settings.MONGO_PASSWORD,
+            'maxPoolSize': settings.MONGO_MAX_POOL_SIZE,
+            'minPoolSize': settings.MONGO_MIN_POOL_SIZE,
+            'connectTimeoutMS': settings.MONGO_CONNECT_TIMEOUT_MS,
+            'serverSelectionTimeoutMS': settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            'socketTimeoutMS': settings.MONGO_SOCKET_TIMEOUT_MS,
+            # Connecting is deferred to first operation, so client created before fork is never used after it
+            'connect': False,
+        }
+        if settings.MONGO_COMPRESSORS:
+            options['compressors'] = settings.MONGO_COMPRESSORS
+        return options
+
+    def create_client(self, options: dict) -> MongoClient:
+        """
+        Creates MongoDB client
+
+        :param options: MongoClient connection and pool options
+        :return: new MongoClient
+        """
+        return self.client_class(**options)
+
+    def get_database(self) -> Database:
+        """
+        Returns datatables database of shared client
+
+        :return: MongoDB database from ``settings.MONGO_DATABASE``
+        """
+        return self.get_client()[settings.MONGO_DATABASE]
+
+    def warm_up(self) -> bool:
+        """
+        Opens connection to MongoDB server ahead of first request. Failure is logged and not raised, as server may
+        become available later.
+
+        :return: True if server responded, False otherwise
+        """
+        try:
+            self.get_client().admin.command('ping')
+        except PyMongoError as e:
+            logger.warning('MongoDB warm up failed: %s', e)
+            return False
+        return True
+
+
+def get_update(data: dict, unset: List[str] = None) -> dict:
+    """
+    Builds MongoDB update setting and removing columns of a row. MongoDB rejects empty update operators, so there's
+    no update if there's nothing to set or remove, and write should be skipped.
+
+    :param data: new values of columns
+    :param unset: columns to be removed
+    :return: MongoDB update, empty if there's nothing to update
+    """
+    update = {}
+    if data:
+        update['$set'] = data
+    if unset:
+        update['$unset'] = {column: '' for column in unset}
+    return update
+
+
+#: Registry used by Datatable clients
+mongo_clients = MongoClientRegistry()
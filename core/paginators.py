@@ -1,5 +1,21 @@
+import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Tuple, Optional, Mapping
+
+import pymongo
+from bson import ObjectId, json_util, Binary, Decimal128, Regex, Timestamp
+from bson.errors import BSONError
 from pymongo.cursor import Cursor
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination, BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+from core.counts import RowCounter
+from core.models.datatable import DatatableClient
 
 
 class MongoCursorLimitOffsetPagination(LimitOffsetPagination):
@@ -8,6 +24,13 @@ class MongoCursorLimitOffsetPagination(LimitOffsetPagination):
     """
     max_limit = 100000
 
+    def __init__(self, row_counter: RowCounter):
+        """
+        :param row_counter: counter of rows matching paginated cursor
+        """
+        self.row_counter = row_counter
+        self.row_count = None
+
     def paginate_queryset(self, cursor: Cursor, request, view=None) -> list:
         """
         Paginate given MongoDB cursor
@@ -17,9 +40,9 @@ class MongoCursorLimitOffsetPagination(LimitOffsetPagination):
         :param view: Django view
         :return: list of objects representing single page
         """
-        self.count = self.get_count(cursor)
         self.limit = self.get_limit(request)
         self.offset = self.get_offset(request)
+        self.count = self.get_count(cursor)
         self.request = request
         if self.count > self.limit and self.template is not None:
             self.display_page_controls = True
@@ -30,9 +53,334 @@ class MongoCursorLimitOffsetPagination(LimitOffsetPagination):
 
     def get_count(self, cursor: Cursor) -> int:
         """
-        Gets count of object returned in cursor
+        Gets count of object returned in cursor. Capped count reaches at least to the row after current page, so next
+        page link is right.
 
         :param cursor: MongoDB cursor
-        :return: numbers of items in cursor
+        :return: numbers of items in cursor, lower bound if count isn't exact
+        """
+        self.row_count = self.row_counter.count(minimal_cap=self.offset + self.limit)
+        # there's at least one more row than capped count
+        return self.row_count.value if self.row_count.exact else self.row_count.value + 1
+
+    def get_paginated_response(self, data) -> Response:
+        response = super().get_paginated_response(data)
+        if not self.row_count.exact:
+            response.data['count'] = str(self.row_count)
+        return response
+
+    @classmethod
+    def get_window(cls, request) -> Tuple[int, Optional[int]]:
+        """
+        Reads offset and limit from request, for rows that are streamed instead of paginated, so they aren't counted
+
+        :param request: request to get pagination variables from
+        :return: offset and limit, ``None`` if limit wasn't requested
+        """
+        try:
+            offset = _positive_int(request.query_params[cls.offset_query_param])
+        except (KeyError, ValueError):
+            offset = 0
+        if cls.limit_query_param not in request.query_params:
+            return offset, None
+        try:
+            return offset, _positive_int(request.query_params[cls.limit_query_param], strict=True, cutoff=cls.max_limit)
+        except ValueError:
+            return offset, cls.default_limit
+
+
+#: BSON types in order MongoDB sorts them. Types in one bracket are compared by value, eg.: ``int`` and ``double``.
+BSON_TYPE_BRACKETS = [
+    ['null'],
+    ['double', 'int', 'long', 'decimal'],
+    ['string', 'symbol'],
+    ['object'],
+    ['array'],
+    ['binData'],
+    ['objectId'],
+    ['bool'],
+    ['date'],
+    ['timestamp'],
+    ['regex'],
+]
+
+
+def get_type_bracket(value) -> int:
+    """
+    Finds position of value type in MongoDB sort order
+
+    :exception ValueError: raises when value is of type that can't be stored in datatable row
+    :param value: value of a row field
+    :return: index of type bracket in ``BSON_TYPE_BRACKETS``
+    """
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 7
+    if isinstance(value, (int, float, Decimal128)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, Mapping):
+        return 3
+    if isinstance(value, (list, tuple)):
+        return 4
+    if isinstance(value, (bytes, Binary)):
+        return 5
+    if isinstance(value, ObjectId):
+        return 6
+    if isinstance(value, datetime):
+        return 8
+    if isinstance(value, Timestamp):
+        return 9
+    if isinstance(value, (Regex, re.Pattern)):
+        return 10
+    raise ValueError(f'Unsupported value type {type(value).__name__}')
+
+
+#: Types of values cursor position can hold, documents, arrays and regular expressions would be run as query operators
+CURSOR_VALUE_TYPES = (bool, int, float, Decimal128, str, ObjectId, datetime)
+
+
+class MongoCursorKeysetPagination(BasePagination):
+    """
+    Keyset (seek) paginator for datatable rows.
+
+    Instead of skipping ``offset`` rows, which makes MongoDB walk every skipped row, page starts right after sort key
+    of the last row of previous page. Next and previous links carry an opaque cursor with that key, so every page costs
+    as much as the first one (given an index on ordering columns).
+
+    Ordering is made total by appending ``_id`` as a tiebreaker. Rows with field of different types (eg.: numbers
+    and strings in one column, or missing values) are paged in the same order MongoDB sorts them.
+
+    Paginator is used when ``cursor`` query param is present or when ``?pagination=cursor`` is requested.
+    """
+    cursor_query_param = 'cursor'
+    pagination_query_param = 'pagination'
+    limit_query_param = 'limit'
+    default_limit = api_settings.PAGE_SIZE
+    max_limit = 100000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.base_url = None
+        self.limit = None
+        self.ordering = None
+        self.page = []
+        self.has_next = False
+        self.has_previous = False
+        self.position = None
+        self.first_position = None
+        self.last_position = None
+        self.reverse = False
+
+    @classmethod
+    def is_requested(cls, request) -> bool:
+        """
+        Checks if request asks for keyset pagination
+
+        :param request: request to get pagination variables from
+        :return: True if keyset pagination should be used
+        """
+        return cls.cursor_query_param in request.query_params or \
+            request.query_params.get(cls.pagination_query_param) == 'cursor'
+
+    def paginate_rows(self, client: DatatableClient, query: dict, ordering: List[Tuple[str, int]], request,
+                      projection: dict = None) -> list:
+        """
+        Fetches single page of rows matching query
+
+        :param client: client of paginated datatable
+        :param query: MongoDB query rows are filtered with
+        :param ordering: rows ordering, as returned by ``RowOrdering.get_ordering``
+        :param request: request to get pagination variables from
+        :param projection: MongoDB projection of returned columns, as returned by ``RowProjection.get_projection``.
+                           Sorted columns are fetched too, for positions of the page, and then removed
+        :return: list of rows representing single page
+        """
+        self.base_url = request.build_absolute_uri()
+        self.limit = self.get_limit(request)
+        self.ordering = self.get_unique_ordering(ordering)
+        cursor = self.decode_cursor(request)
+
+        sort = self.ordering
+        if cursor is not None:
+            self.position, self.reverse, inclusive = cursor
+            if self.reverse:
+                sort = [(field, -direction) for field, direction in self.ordering]
+            seek_query = self.get_seek_query(sort, self.position, inclusive)
+            query = {'$and': [query, seek_query]} if query else seek_query
+
+        sorted_projection = None
+        if projection is not None:
+            sorted_projection = {**projection, **{field: True for field, _ in self.ordering}}
+        rows = list(client.get_rows(query, sorted_projection).sort(sort).limit(self.limit + 1))
+        has_more = len(rows) > self.limit
+        self.page = rows[:self.limit]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        if self.page:
+            self.first_position = self.get_position(self.page[0])
+            self.last_position = self.get_position(self.page[-1])
+        if projection is not None:
+            for field in sorted_projection.keys() - projection.keys():
+                for row in self.page:
+                    row.pop(field, None)
+        return self.page
+
+    def get_paginated_response(self, data) -> Response:
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_limit(self, request) -> int:
+        """
+        Gets page size from request, falling back to ``default_limit`` if it's missing or invalid
+
+        :param request: request to get pagination variables from
+        :return: number of rows in a page
+        """
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return min(limit, self.max_limit) if limit > 0 else self.default_limit
+
+    @staticmethod
+    def get_unique_ordering(ordering: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        """
+        Makes ordering total: drops repeated fields and appends ``_id``, so no two rows have the same sort key
+
+        :param ordering: rows ordering
+        :return: ordering ending with ``_id``
+        """
+        unique_ordering = []
+        for field, direction in ordering:
+            if field not in [unique_field for unique_field, _ in unique_ordering]:
+                unique_ordering.append((field, direction))
+            if field == '_id':
+                return unique_ordering
+        return unique_ordering + [('_id', pymongo.ASCENDING)]
+
+    @staticmethod
+    def get_seek_query(sort: List[Tuple[str, int]], position: list, inclusive: bool = False) -> dict:
+        """
+        Builds query matching rows that are sorted after given position. For ordering ``a, b, _id`` it is
+        ``a > A or (a = A and b > B) or (a = A and b = B and _id > ID)``, where each comparison also matches values of
+        types MongoDB sorts after type of compared value.
+
+        :param sort: total ordering of rows
+        :param position: values of sorted fields of the row page starts after
+        :param inclusive: match also the row at position
+        :return: MongoDB query
+        """
+        clauses = []
+        equal = {}
+        for (field, direction), value in zip(sort, position):
+            for condition in MongoCursorKeysetPagination.__get_seek_conditions(field, value, direction):
+                clauses.append({**equal, field: condition})
+            equal[field] = {'$eq': value}
+        if inclusive:
+            clauses.append(equal)
+        return {'$or': clauses}
+
+    def decode_cursor(self, request) -> Optional[Tuple[list, bool, bool]]:
+        """
+        Decodes cursor from request
+
+        :exception NotFound: raises when cursor is malformed or was created for different ordering
+        :param request: request to get cursor from
+        :return: tuple of position, reverse and inclusive flags or None if request has no cursor
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            cursor = json_util.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position, reverse, inclusive, ordering = cursor['p'], bool(cursor['r']), bool(cursor['i']), cursor['o']
+            for value in position:
+                if value is not None and not isinstance(value, CURSOR_VALUE_TYPES):
+                    raise ValueError(f'Unsupported cursor value type {type(value).__name__}')
+        except (TypeError, ValueError, KeyError, BSONError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if ordering != [[field, direction] for field, direction in self.ordering] or \
+                len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse, inclusive
+
+    def encode_cursor(self, position: list, reverse: bool, inclusive: bool = False) -> str:
+        """
+        Encodes cursor as URL of a page
+
+        :param position: values of sorted fields of the row page starts after
+        :param reverse: page ends before position
+        :param inclusive: page includes row at position
+        :return: absolute URL of a page
+        """
+        cursor = {'p': position, 'r': reverse, 'i': inclusive, 'o': self.ordering}
+        encoded = json_util.dumps(cursor, json_options=json_util.CANONICAL_JSON_OPTIONS)
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   urlsafe_b64encode(encoded.encode('utf-8')).decode('ascii'))
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_next:
+            return None
+        if self.page:
+            return self.encode_cursor(self.last_position, reverse=False)
+        # nothing before position, next page starts at it
+        return self.encode_cursor(self.position, reverse=False, inclusive=True)
+
+    def get_previous_link(self) -> Optional[str]:
+        if not self.has_previous:
+            return None
+        if self.page:
+            return self.encode_cursor(self.first_position, reverse=True)
+        if self.position is None:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        # nothing after position, previous page ends at it
+        return self.encode_cursor(self.position, reverse=True, inclusive=True)
+
+    def get_position(self, row: dict) -> list:
+        """
+        Gets sort key of a row
+
+        :param row: MongoDB document
+        :return: values of sorted fields, missing fields are ``None``
         """
-        return cursor.count()
+        return [row.get(field) for field, _ in self.ordering]
+
+    @staticmethod
+    def __get_seek_conditions(field: str, value, direction: int) -> list:
+        """
+        Builds conditions matching values sorted after given value. Comparison operators match only values of the same
+        type bracket, so values of brackets sorted later are matched by their types. Missing fields are sorted as
+        ``null``, so they are matched by equality to ``None``.
+
+        :param field: sorted field
+        :param value: value to compare with
+        :param direction: sort direction
+        :return: list of conditions on field, ``None`` stands for ``null`` or missing field
+        """
+        bracket = get_type_bracket(value)
+        conditions = []
+        if bracket:
+            conditions.append({'$gt' if direction == pymongo.ASCENDING else '$lt': value})
+        if field == '_id':
+            # row ids are always ObjectIds
+            return conditions
+
+        following = BSON_TYPE_BRACKETS[bracket + 1:] if direction == pymongo.ASCENDING else BSON_TYPE_BRACKETS[1:bracket]
+        types = [bson_type for types in following for bson_type in types]
+        if types:
+            conditions.append({'$type': types})
+        if direction == pymongo.DESCENDING and bracket:
+            conditions.append(None)
+        return conditions
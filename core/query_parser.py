@@ -0,0 +1,322 @@
+import copy
+import re
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Union, FrozenSet, Iterable, Tuple, Dict
+
+from core.exceptions import QueryParseError
+from core.schema import cast_value
+
+#: Maximal length of query string
+MAX_QUERY_LENGTH = 4096
+#: Maximal nesting of logical operations
+MAX_QUERY_DEPTH = 16
+#: Size of cache of compiled queries
+QUERY_CACHE_SIZE = 1024
+
+LOGICAL_OPERATORS = ['and', 'or']
+#: Comparison operators and MongoDB operators they compile to, ``None`` stands for plain equality
+COMPARISON_OPERATORS = {
+    '=': None,
+    '!=': '$ne',
+    '>': '$gt',
+    '>=': '$gte',
+    '<': '$lt',
+    '<=': '$lte',
+    '^=': '$regex',
+    'in': '$in',
+}
+
+TOKEN_PATTERN = re.compile(r'''
+    (?P<lparen>\() |
+    (?P<rparen>\)) |
+    (?P<comma>,) |
+    (?P<operator>!=|>=|<=|\^=|=|>|<) |
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*') |
+    (?P<space>\s+) |
+    (?P<text>[^()",'=!<>^\s]+|[!<>^'"])
+''', re.VERBOSE)
+IN_PATTERN = re.compile(r'^(?P<field>.*\S)\s+in$', re.IGNORECASE | re.DOTALL)
+
+
+class Token(NamedTuple):
+    """
+    Token of a query string
+    """
+    #: One of ``TOKEN_PATTERN`` group names
+    kind: str
+    #: Token text, unquoted for strings
+    value: str
+    #: Position of token start in query string
+    start: int
+    #: Position of token end in query string
+    end: int
+
+
+class Value(NamedTuple):
+    """
+    Value of a comparison
+    """
+    text: str
+    #: Quoted values are never cast to column type
+    quoted: bool = False
+
+
+class Comparison(NamedTuple):
+    """
+    Query AST node comparing a field with a value, eg.: ``height>=2`` or ``species in (deer, bear)``
+    """
+    field: str
+    operator: str
+    value: Union[Value, List[Value]]
+
+
+class Operation(NamedTuple):
+    """
+    Query AST node joining nested nodes with logical operator, eg.: ``or(species=deer, species=bear)``
+    """
+    operator: str
+    operands: List[Union['Operation', Comparison, None]]
+
+
+def tokenize(query: str) -> List[Token]:
+    """
+    Splits query string into tokens, skipping whitespace
+
+    :exception QueryParseError: raises when query is too long
+    :param query: query string
+    :return: list of tokens
+    """
+    if len(query) > MAX_QUERY_LENGTH:
+        raise QueryParseError(f'Query is longer than {MAX_QUERY_LENGTH} characters')
+
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(query):
+        kind = match.lastgroup
+        if kind == 'space':
+            continue
+        value = match.group()
+        if kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        tokens.append(Token(kind, value, match.start(), match.end()))
+    return tokens
+
+
+class QueryParser:
+    """
+    Recursive descent parser of ``logical_query`` filter, with grammar::
+
+        query       := expression (',' expression)*
+        expression  := operation | comparison | term
+        operation   := ('and' | 'or') '(' [expression (',' expression)*] ')'
+        comparison  := field ('=' | '!=' | '>' | '>=' | '<' | '<=' | '^=') value
+                     | field 'in' '(' value (',' value)* ')'
+
+    Fields and values are either quoted (``"red deer"``) or bare text, which ends at ``,`` or ``)``. Bare terms
+    (eg.: ``and(species)``) are ignored, like fields that aren't datatable columns.
+
+    Parsing is linear in query length, nesting is limited to ``MAX_QUERY_DEPTH``.
+    """
+
+    def __init__(self, query: str):
+        """
+        :param query: query string
+        """
+        self.query = query
+        self.tokens = tokenize(query)
+        self.position = 0
+
+    def parse(self) -> Optional[Operation]:
+        """
+        Parses query string into AST. Coma separated top level expressions are joined with ``and``.
+
+        :exception QueryParseError: raises when query isn't valid
+        :return: root of AST or None if query is empty
+        """
+        if not self.tokens:
+            return None
+        operands = self.__parse_list(depth=0)
+        if self.__peek() is not None:
+            self.__error('Unexpected', self.__peek())
+        return Operation('and', operands)
+
+    def __parse_list(self, depth: int) -> List[Union[Operation, Comparison, None]]:
+        operands = [self.__parse_expression(depth)]
+        while self.__accept('comma'):
+            operands.append(self.__parse_expression(depth))
+        return operands
+
+    def __parse_expression(self, depth: int) -> Union[Operation, Comparison, None]:
+        token = self.__peek()
+        if token is None or token.kind not in ('text', 'string'):
+            self.__error('Expected field or operation', token)
+
+        following = self.__peek(1)
+        if token.kind == 'text' and token.value.lower() in LOGICAL_OPERATORS and \
+                following is not None and following.kind == 'lparen':
+            return self.__parse_operation(depth)
+
+        field, operator = self.__parse_field()
+        if operator is None:
+            return None
+        if operator == 'in':
+            return Comparison(field, operator, self.__parse_values())
+        return Comparison(field, operator, self.__parse_value())
+
+    def __parse_operation(self, depth: int) -> Operation:
+        if depth >= MAX_QUERY_DEPTH:
+            self.__error(f'Query is nested deeper than {MAX_QUERY_DEPTH} levels', self.__peek())
+        operator = self.__next().value.lower()
+        self.__expect('lparen')
+        operands = [] if self.__peek_kind() == 'rparen' else self.__parse_list(depth + 1)
+        self.__expect('rparen')
+        return Operation(operator, operands)
+
+    def __parse_field(self) -> Tuple[str, Optional[str]]:
+        """
+        Parses field and operator following it
+
+        :return: tuple of field name and operator, operator is None for bare term
+        """
+        if self.__peek_kind() == 'string':
+            field = self.__next().value
+            token = self.__peek()
+            if token is not None and token.kind == 'text' and token.value.lower() == 'in' and \
+                    self.__peek_kind(1) == 'lparen':
+                self.__next()
+                return field, 'in'
+        else:
+            tokens = self.__take_until('operator', 'lparen', 'comma', 'rparen')
+            field = self.__source(tokens)
+            if self.__peek_kind() == 'lparen':
+                match = IN_PATTERN.match(field)
+                if not match:
+                    self.__error('Unexpected', self.__peek())
+                return match.group('field'), 'in'
+
+        if self.__peek_kind() == 'operator':
+            return field, self.__next().value
+        if self.__peek_kind() in (None, 'comma', 'rparen'):
+            return field, None
+        self.__error('Expected operator', self.__peek())
+
+    def __parse_value(self) -> Value:
+        if self.__peek_kind() == 'string' and self.__peek_kind(1) in (None, 'comma', 'rparen'):
+            return Value(self.__next().value, quoted=True)
+        tokens = self.__take_until('comma', 'rparen', 'lparen')
+        if self.__peek_kind() == 'lparen':
+            self.__error('Unexpected', self.__peek())
+        return Value(self.__source(tokens))
+
+    def __parse_values(self) -> List[Value]:
+        self.__expect('lparen')
+        values = [self.__parse_value()]
+        while self.__accept('comma'):
+            values.append(self.__parse_value())
+        self.__expect('rparen')
+        return values
+
+    def __source(self, tokens: List[Token]) -> str:
+        """
+        Gets query text spanned by tokens, so bare text keeps its inner whitespace and operator characters
+        """
+        if not tokens:
+            return ''
+        return self.query[tokens[0].start:tokens[-1].end]
+
+    def __take_until(self, *kinds: str) -> List[Token]:
+        tokens = []
+        while self.__peek() is not None and self.__peek_kind() not in kinds:
+            tokens.append(self.__next())
+        return tokens
+
+    def __peek(self, offset: int = 0) -> Optional[Token]:
+        position = self.position + offset
+        return self.tokens[position] if position < len(self.tokens) else None
+
+    def __peek_kind(self, offset: int = 0) -> Optional[str]:
+        token = self.__peek(offset)
+        return token.kind if token is not None else None
+
+    def __next(self) -> Token:
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def __accept(self, kind: str) -> bool:
+        if self.__peek_kind() == kind:
+            self.position += 1
+            return True
+        return False
+
+    def __expect(self, kind: str):
+        if not self.__accept(kind):
+            self.__error(f'Expected "{dict(lparen="(", rparen=")").get(kind, kind)}"', self.__peek())
+
+    def __error(self, message: str, token: Optional[Token]):
+        if token is None:
+            raise QueryParseError(f'{message}, but query ended')
+        raise QueryParseError(f'{message} "{token.value}" at position {token.start}')
+
+
+def compile_node(node: Union[Operation, Comparison, None], columns: FrozenSet[str],
+                 schema: Dict[str, dict] = None) -> dict:
+    """
+    Compiles query AST into MongoDB query. Comparisons of fields that aren't columns and empty operations are dropped.
+    Values are cast to types of columns with ``cast_value``, prefixes are always matched as text.
+
+    :param node: root of AST
+    :param columns: datatable columns
+    :param schema: datatable schema, as in ``Datatable.schema``
+    :return: MongoDB query, empty if nothing is left after dropping
+    """
+    if node is None:
+        return {}
+
+    if isinstance(node, Comparison):
+        if node.field not in columns:
+            return {}
+        mongo_operator = COMPARISON_OPERATORS[node.operator]
+        if mongo_operator == '$regex':
+            return {node.field: {mongo_operator: f'^{re.escape(node.value.text)}'}}
+
+        column_schema = (schema or {}).get(node.field)
+        if mongo_operator == '$in':
+            value = [_cast(value, column_schema) for value in node.value]
+        else:
+            value = _cast(node.value, column_schema)
+        return {node.field: value if mongo_operator is None else {mongo_operator: value}}
+
+    operands = [query for query in (compile_node(operand, columns, schema) for operand in node.operands) if query]
+    if not operands:
+        return {}
+    if len(operands) == 1 and node.operator == 'and':
+        return operands[0]
+    return {f'${node.operator}': operands}
+
+
+def _cast(value: Value, column_schema: Optional[dict]):
+    return value.text if value.quoted else cast_value(value.text, column_schema)
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _compile_query(query: str, columns: FrozenSet[str], schema: Tuple[Tuple[str, str, str], ...]) -> dict:
+    return compile_node(QueryParser(query).parse(), columns,
+                        {column: {'type': column_type, 'format': date_format}
+                         for column, column_type, date_format in schema})
+
+
+def compile_query(query: str, columns: Iterable[str], schema: Dict[str, dict] = None) -> dict:
+    """
+    Parses query string and compiles it into MongoDB query. Compiled queries are cached per query, columns and schema.
+
+    :exception QueryParseError: raises when query isn't valid
+    :param query: query string, eg.: ``or(species=deer, and(species=bear, height>=2))``
+    :param columns: datatable columns
+    :param schema: datatable schema, values are cast to types of columns
+    :return: MongoDB query, empty if query has no valid comparisons
+    """
+    # only type and format of columns matter, which makes schema hashable
+    schema_key = tuple(sorted((column, column_schema.get('type'), column_schema.get('format'))
+                              for column, column_schema in (schema or {}).items()))
+    # cached query is shared, caller gets its own copy
+    return copy.deepcopy(_compile_query(query, frozenset(columns), schema_key))
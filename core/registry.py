@@ -0,0 +1,79 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Tuple
+
+
+class ClientRegistry(ABC):
+    """
+    Process-wide registry of shared clients. Clients are keyed by their options, which are read from settings on each
+    lookup, and are created with ``create_client`` on first use.
+
+    Clients are never shared between processes. When registry is used in a forked child (eg. gunicorn worker) clients
+    inherited from the parent are discarded and new ones are created lazily.
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple, Any] = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    @abstractmethod
+    def get_client_options() -> dict:
+        """
+        Builds client keyword arguments from settings
+
+        :return: client options
+        """
+        pass
+
+    @abstractmethod
+    def create_client(self, options: dict):
+        """
+        Creates new client
+
+        :param options: client options from ``get_client_options``
+        :return: client
+        """
+        pass
+
+    def get_client(self):
+        """
+        Returns client for current settings, creating it on first use in this process
+
+        :return: shared client
+        """
+        self._reset_after_fork()
+        options = self.get_client_options()
+        key = tuple(sorted(options.items()))
+
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._clients[key] = self.create_client(options)
+        return client
+
+    def close(self):
+        """
+        Closes all clients created by this process
+        """
+        self._reset_after_fork()
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients = {}
+        for client in clients:
+            client.close()
+
+    def _reset_after_fork(self):
+        """
+        Forgets clients inherited from parent process. They are not closed, as their sockets are still in use by parent.
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            # Inherited lock could have been held by a thread that doesn't exist in this process
+            self._lock = threading.Lock()
+            self._clients = {}
+            self._pid = pid
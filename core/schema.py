@@ -0,0 +1,196 @@
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+
+#: Column types, values of ``Datatable.schema``
+INTEGER = 'integer'
+FLOAT = 'float'
+BOOLEAN = 'boolean'
+STRING = 'string'
+DATE = 'date'
+DATETIME = 'datetime'
+#: Column holding values of different types
+MIXED = 'mixed'
+
+NUMERIC_TYPES = {INTEGER, FLOAT}
+TEXT_TYPES = {STRING, DATE, DATETIME}
+
+#: Formats of dates stored as text, with patterns of their exact shape, in order of preference when values match
+#: more than one
+DATE_FORMATS = [
+    (DATE, '%Y-%m-%d', r'\d{4}-\d{2}-\d{2}'),
+    (DATETIME, '%Y-%m-%dT%H:%M:%S.%fZ', r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}Z'),
+    (DATETIME, '%Y-%m-%d %H:%M:%S', r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}'),
+    (DATE, '%d.%m.%Y', r'\d{1,2}\.\d{1,2}\.\d{4}'),
+    (DATE, '%d/%m/%Y', r'\d{1,2}/\d{1,2}/\d{4}'),
+    (DATE, '%m/%d/%Y', r'\d{1,2}/\d{1,2}/\d{4}'),
+]
+NUMBER_PATTERN = re.compile(r'^[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?$')
+BOOLEAN_VALUES = {'true': True, '1': True, 'false': False, '0': False}
+
+
+class SchemaInference:
+    """
+    Infers schema of a table parsed in chunks: type of every column, whether it has missing values and format of
+    dates stored as text. Chunks are inspected column by column with vectorized pandas operations.
+
+    Types of chunks are merged: integers and floats make a float column, dates and text make a string column and
+    any other combination makes a mixed column. Format of a date column has to match every value of every chunk.
+
+    **Example usage**
+
+    .. sourcecode:: python
+
+        schema_inference = SchemaInference()
+        for chunk in chunks:
+            schema_inference.update(chunk)
+        schema = schema_inference.schema
+    """
+
+    def __init__(self):
+        self.__types: Dict[str, Optional[str]] = {}
+        self.__nullable: Dict[str, bool] = {}
+        self.__date_formats: Dict[str, List[tuple]] = {}
+
+    def update(self, df: pd.DataFrame):
+        """
+        Inspects parsed chunk of a table
+
+        :param df: parsed chunk
+        """
+        for column, series in df.items():
+            column = str(column)
+            missing = series.isna()
+            self.__nullable[column] = self.__nullable.get(column, False) or bool(missing.any())
+            values = series[~missing]
+            if values.empty:
+                self.__types.setdefault(column, None)
+                continue
+
+            column_type = self.__get_type(column, values)
+            known_type = self.__types.get(column)
+            self.__types[column] = column_type if known_type is None else self.__merge_types(known_type, column_type)
+
+    @property
+    def schema(self) -> Dict[str, dict]:
+        """
+        Schema of inspected chunks
+
+        :return: dict of column names and their schema: ``type``, ``nullable`` and ``format`` of date columns
+        """
+        schema = {}
+        for column, column_type in self.__types.items():
+            column_schema = {'type': column_type or STRING, 'nullable': self.__nullable[column]}
+            if column_type in (DATE, DATETIME):
+                column_schema['format'] = self.__date_formats[column][0][1]
+            schema[column] = column_schema
+        return schema
+
+    def __get_type(self, column: str, values: pd.Series) -> str:
+        """
+        Gets type of non missing values of a column
+
+        :param column: column name
+        :param values: column values
+        :return: column type
+        """
+        kind = values.dtype.kind
+        if kind == 'b':
+            return BOOLEAN
+        if kind in 'iu':
+            return INTEGER
+        if kind == 'f':
+            return FLOAT
+        if kind == 'M':
+            # stored as ISO 8601 strings, see ``core.ingestion.dataframe_to_documents``
+            self.__date_formats[column] = [DATE_FORMATS[1]]
+            return DATETIME
+
+        inferred_type = pd.api.types.infer_dtype(values, skipna=True)
+        if inferred_type == 'boolean':
+            return BOOLEAN
+        if inferred_type != 'string':
+            return MIXED
+
+        date_formats = [(date_type, date_format, pattern)
+                        for date_type, date_format, pattern in self.__date_formats.get(column, DATE_FORMATS)
+                        if self.__is_date_format(values, date_format, pattern)]
+        self.__date_formats[column] = date_formats
+        return date_formats[0][0] if date_formats else STRING
+
+    @staticmethod
+    def __is_date_format(values: pd.Series, date_format: str, pattern: str) -> bool:
+        """
+        Checks if every value is a date of given shape and format. First value is checked alone, so columns of other
+        text are rejected without parsing them whole.
+        """
+        for checked_values in (values.iloc[:1], values):
+            if not checked_values.str.match(f'{pattern}$').all() or \
+                    pd.isna(pd.to_datetime(checked_values, format=date_format, errors='coerce')).any():
+                return False
+        return True
+
+    @staticmethod
+    def __merge_types(first: str, second: str) -> str:
+        if first == second:
+            return first
+        if first in NUMERIC_TYPES and second in NUMERIC_TYPES:
+            return FLOAT
+        if first in TEXT_TYPES and second in TEXT_TYPES:
+            return STRING
+        return MIXED
+
+
+def cast_value(value: str, column_schema: Optional[dict]) -> Union[str, float, int, bool]:
+    """
+    Casts value of a filter to type of column, so it matches stored values (and their indexes). Values that can't be
+    cast are left as they are. Without schema (eg.: datatables uploaded before schemas were inferred) and in mixed
+    columns numeric values are cast to float.
+
+    :param value: filter value
+    :param column_schema: schema of filtered column, as in ``Datatable.schema``
+    :return: cast value
+    """
+    column_type = column_schema['type'] if column_schema else None
+    if column_type in (None, MIXED):
+        return float(value) if NUMBER_PATTERN.match(value.strip()) else value
+
+    if column_type in NUMERIC_TYPES and NUMBER_PATTERN.match(value.strip()):
+        number = float(value)
+        return int(number) if column_type == INTEGER and number.is_integer() else number
+    if column_type == BOOLEAN:
+        return BOOLEAN_VALUES.get(value.strip().lower(), value)
+    if column_type in (DATE, DATETIME):
+        return format_date(value, column_schema['format'])
+    return value
+
+
+def format_date(value: str, date_format: str) -> str:
+    """
+    Formats date given in any of ``DATE_FORMATS`` or ISO 8601 in format dates of a column are stored in
+
+    :param value: date
+    :param date_format: format of stored dates
+    :return: formatted date, value as it is if it isn't a date
+    """
+    parsed = None
+    for known_format in [date_format, *[known_format for _, known_format, _ in DATE_FORMATS]]:
+        try:
+            parsed = datetime.strptime(value.strip(), known_format)
+            break
+        except ValueError:
+            continue
+    if parsed is None:
+        try:
+            parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+        except ValueError:
+            return value
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+    if date_format.endswith('.%fZ'):
+        # stored with millisecond precision, see ``core.ingestion.dataframe_to_documents``
+        return parsed.strftime(date_format[:-len('%fZ')]) + f'{parsed.microsecond // 1000:03d}Z'
+    return parsed.strftime(date_format)
@@ -1,3 +1,4 @@
 from .datatable import DatatableReadOnlySerializer, DatatableSerializer, DatatableExportSerializer
-from .datatable_action import DatatableActionReadOnlySerializer
-from .datatable_rows import DatatableRowsReadOnlySerializer, DatatableRowsSerializer
+from .datatable_action import DatatableActionReadOnlySerializer, DatatableActionRevertSerializer
+from .datatable_rows import DatatableRowsReadOnlySerializer, DatatableRowsSerializer, DatatableRowsBatchSerializer
+from .job import IngestionJobReadOnlySerializer, ExportJobReadOnlySerializer
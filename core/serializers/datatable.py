@@ -1,21 +1,19 @@
 import csv
 import mimetypes
-import os
 from datetime import datetime
-from io import StringIO
-from pathlib import Path
+from typing import List, Tuple
 
-import pandas as pd
 from django.conf import settings
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.db import transaction
-from pyDataverse.api import Api
-from pymongo.cursor import Cursor
-from requests import ConnectionError
+from requests import RequestException
 from rest_framework import serializers
 from slugify import slugify
 
-from core.models import Datatable
+from core.dataverse import dataverse_clients
+from core.exceptions import DataverseError
+from core.ingestion import read_first_line
+from core.models import Datatable, IngestionJob, ExportJob
 
 
 class DatatableReadOnlySerializer(serializers.ModelSerializer):
@@ -39,10 +37,12 @@ class DatatableSerializer(serializers.ModelSerializer):
     class Meta:
         model = Datatable
         exclude = ['columns']
+        read_only_fields = ['revision', 'schema']
 
     def validate_file(self, file: InMemoryUploadedFile) -> InMemoryUploadedFile:
         """
-        Checks if file content-type is supported
+        Checks if file content-type is supported and if CSV file is encoded with
+        ``settings.DATATABLE_UPLOAD_ENCODING`` and has determinable delimiter
 
         :param file: uploaded file
         :return: validated file
@@ -54,129 +54,91 @@ class DatatableSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(f'Unsupported file type. File is of type {file.content_type}')
 
         if settings.SUPPORTED_MIME_TYPES[file.content_type] == 'csv':
-            chunk = file.file.readline().decode('utf-8')
-            file.file.seek(0)
+            try:
+                chunk = read_first_line(file)
+            except UnicodeDecodeError:
+                raise serializers.ValidationError(f'File isn\'t encoded with {settings.DATATABLE_UPLOAD_ENCODING}')
 
             if not chunk:
                 raise serializers.ValidationError('File can\'t be empty')
 
             try:
-                dialect = csv.Sniffer().sniff(chunk)
+                csv.Sniffer().sniff(chunk)
 
             except csv.Error:
                 raise serializers.ValidationError('CSV delimiter can\'t be determined')
 
-            try:
-                for _ in pd.read_csv(StringIO(file.file.read().decode('utf-8')), chunksize=2048, sep=dialect.delimiter):
-                    pass
-            except pd.errors.ParserError as e:
-                raise serializers.ValidationError(f'CSV file is corrupted. {e}')
-
-            file.file.seek(0)
+        # File content is validated while it's uploaded to database by background worker, see ``create``
         return file
 
     def create(self, validated_data):
         """
-        Creates datatable metadata and uploads file as datable content
+        Creates datatable metadata and queues upload of file as datatable content. File is stored on disk and parsed
+        by background worker, see ``core.models.IngestionJob``.
 
         :param validated_data: data validated by serializer
         :return: created Datatable instance
         """
         file = validated_data.pop('file')
+        user = self.context['request'].user
         with transaction.atomic():
             result = super().create(validated_data)
-            result.upload_datatable_file(file)
+            self.ingestion_job = IngestionJob.create_from_upload(result, file,
+                                                                 user if user.is_authenticated else None)
         return result
 
 
 class DatatableExportSerializer(serializers.ModelSerializer):
     """
-    Datatable serializer for exporting user uploaded file to database
+    Datatable serializer for queuing export of datatable rows to Dataverse
     """
     dataset_pid = serializers.CharField(write_only=True, required=True)
+    compress = serializers.BooleanField(write_only=True, default=False)
 
     class Meta:
         model = Datatable
-        fields = ['id', 'title', 'collection_name', 'dataset_pid']
-        read_only_fields = fields
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.client = Api(base_url=settings.DATAVERSE_URL,
-                          api_token=settings.DATAVERSE_ACCESS_TOKEN)
+        fields = ['id', 'title', 'collection_name', 'dataset_pid', 'compress']
+        read_only_fields = ['id', 'title', 'collection_name']
 
     def validate_dataset_pid(self, dataset_pid: str) -> str:
         """
-        Validates if:
-          -  Dataverse client can connect to Dataverse
-          -  supplied dataset pid corresponds to existing Dataset in Dataverse
+        Validates if supplied dataset pid corresponds to existing Dataset in Dataverse. Status of Dataverse and
+        existing datasets are cached by shared client, so repeated exports to a dataset don't wait for Dataverse.
+        If Dataverse can't be reached or rejects the request, export is queued anyway and its job retries or reports the
+        error.
 
         :param dataset_pid: Identifier of Dataverse Dataset
         :return: validated Dataset identifier
         """
-        if self.client.status != 'OK':
-            raise serializers.ValidationError('Can\'t connect to Dataverse server.')
+        client = dataverse_clients.get_client()
+        if client.get_status() != 'OK':
+            return dataset_pid
 
         try:
-            dataset = self.client.get_dataset(dataset_pid)
-        except ConnectionError:
-            raise serializers.ValidationError(f'Can\'t find Dataset {dataset_pid} in Dataverse.')
+            dataset = client.get_dataset(dataset_pid)
+        except (RequestException, DataverseError):
+            return dataset_pid
 
         if not dataset:
             raise serializers.ValidationError('Dataset doesn\'t exist in Dataverse.')
 
         return dataset_pid
 
-    def export(self, cursor: Cursor):
-        """
-        Exports user requested Datatable with applied filters to Dataverse. To do so temporary .csv file is created
-        form user submitted Datatable query and uploading said file with Dataverse client.
-
-        Finally temporary file is deleted.
-
-        :param cursor: MongoDB cursor build from user query
-        :return: validated Dataset identifier
-        """
-
-        # Create temp directory if doesn't exist
-        Path(settings.TMP_MEDIA_PATH).mkdir(parents=True, exist_ok=True)
-
-        identifier = self.validated_data['dataset_pid']
-
-        tmp_file_name = os.path.join(settings.TMP_MEDIA_PATH,
-                                     f'{slugify(self.instance.title)}-{datetime.now().timestamp()}.csv')
-        try:
-            with open(tmp_file_name, 'w') as file:
-                dict_writer = csv.DictWriter(file, ['_id', *self.instance.columns])
-                dict_writer.writeheader()
-                dict_writer.writerows(cursor)
-
-            response = self._upload_file(self.client, tmp_file_name, identifier)
-            parsed_response = {'status': response.status_code,
-                               'content': None}
-            if response.status_code != 200:
-                content = {'dataset_pid': [response.content.decode(response.encoding or 'utf-8').split('"')[-2]]}
-                parsed_response['content'] = content
-
-        finally:
-            os.remove(tmp_file_name)
-
-        return parsed_response
-
-    @staticmethod
-    def _upload_file(client: Api, filename: str, identifier: str):
+    def export(self, query: dict, ordering: List[Tuple[str, int]], columns: List[str] = None) -> ExportJob:
         """
-        Function overwriting faulty client upload file function
-
-        :param client: pyDataverse Client
-        :param filename: name of file to be uploaded
-        :param identifier: DOI of Dataset to which file should be uploaded
-        :return: Response from dataverse
+        Queues export of user requested Datatable with applied filters to Dataverse as .csv file (or .csv.gz file if
+        ``compress`` was requested). Existence of dataset is checked and rows are uploaded by background worker,
+        see ``core.models.ExportJob``.
+
+        :param query: MongoDB query of exported rows
+        :param ordering: MongoDB ordering of exported rows
+        :param columns: exported columns, all columns by default
+        :return: created pending job
         """
-        url = client.native_api_base_url[:-3]
-        url += "/datasets/:persistentId/add?persistentId={0}".format(identifier)
-
-        files = {"file": open(filename, "rb")}
-        return client.post_request(
-            files=files, auth=True, url=url
-        )
+        request = self.context.get('request')
+        user = request.user if request and request.user.is_authenticated else None
+        compress = self.validated_data['compress']
+        file_name = f'{slugify(self.instance.title)}-{datetime.now().timestamp()}.csv{".gz" if compress else ""}'
+        return ExportJob.objects.create(datatable=self.instance, user=user,
+                                        dataset_pid=self.validated_data['dataset_pid'], query=query,
+                                        ordering=ordering, columns=columns, compress=compress, file_name=file_name)
@@ -1,6 +1,8 @@
+from django.contrib.auth import get_user_model
+from django.db.models import QuerySet
 from rest_framework import serializers
 
-from core.models import DatatableAction
+from core.models import Datatable, DatatableAction
 
 
 class DatatableActionReadOnlySerializer(serializers.ModelSerializer):
@@ -10,11 +12,12 @@ class DatatableActionReadOnlySerializer(serializers.ModelSerializer):
 
     username = serializers.SerializerMethodField()
     datatable_title = serializers.CharField(source="datatable.title")
+    old_row = serializers.SerializerMethodField()
+    new_row = serializers.SerializerMethodField()
 
     class Meta:
         model = DatatableAction
-        fields = '__all__'
-        read_only_fields = [fields]
+        exclude = ['compressed_rows']
 
     def get_username(self, obj: DatatableAction) -> str:
         """
@@ -25,3 +28,74 @@ class DatatableActionReadOnlySerializer(serializers.ModelSerializer):
         """
         full_name = f'{obj.user.first_name} {obj.user.last_name}'
         return full_name if full_name.strip() else obj.user.username
+
+    def get_old_row(self, obj: DatatableAction) -> dict:
+        """
+        Gets state of row before action, decompressed if needed
+
+        :param obj: DatatableAction object
+        :return: state of row, only edited columns of updated row
+        """
+        return obj.get_rows()[0]
+
+    def get_new_row(self, obj: DatatableAction) -> dict:
+        """
+        Gets state of row after action, decompressed if needed
+
+        :param obj: DatatableAction object
+        :return: state of row, only edited columns of updated row
+        """
+        return obj.get_rows()[1]
+
+
+class DatatableActionRevertSerializer(serializers.Serializer):
+    """
+    Serializer selecting actions of a datatable to be reverted at once: actions matching filters, or all actions
+    committed after given time, restoring datatable to its state at that time
+    """
+
+    datatable = serializers.PrimaryKeyRelatedField(queryset=Datatable.objects.all())
+    user = serializers.PrimaryKeyRelatedField(queryset=get_user_model().objects.all(), required=False)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    at = serializers.DateTimeField(required=False)
+
+    class Meta:
+        model = DatatableAction
+        fields = ['datatable', 'user', 'since', 'until', 'at']
+
+    def validate(self, attrs: dict) -> dict:
+        """
+        Checks that point in time isn't combined with filters
+
+        :param attrs: validated fields
+        :return: validated fields
+        """
+        if 'at' in attrs and {'user', 'since', 'until'} & set(attrs):
+            raise serializers.ValidationError({'at': 'Point in time can\'t be combined with user, since or until.'})
+        return attrs
+
+    def get_actions(self) -> QuerySet:
+        """
+        Builds queryset of actions to be reverted
+
+        :return: actions of datatable matching filters
+        """
+        actions = DatatableAction.objects.filter(datatable=self.validated_data['datatable'])
+        if 'at' in self.validated_data:
+            return actions.filter(created_at__gt=self.validated_data['at'])
+        if 'user' in self.validated_data:
+            actions = actions.filter(user=self.validated_data['user'])
+        if 'since' in self.validated_data:
+            actions = actions.filter(created_at__gte=self.validated_data['since'])
+        if 'until' in self.validated_data:
+            actions = actions.filter(created_at__lte=self.validated_data['until'])
+        return actions
+
+    def revert(self) -> int:
+        """
+        Reverts selected actions, see ``Datatable.revert_actions``
+
+        :return: number of reverted actions
+        """
+        return self.validated_data['datatable'].revert_actions(self.get_actions())
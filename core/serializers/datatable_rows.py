@@ -1,41 +1,70 @@
-from copy import deepcopy
+import logging
+from itertools import groupby
+from typing import Iterable, List, Optional
 
 from bson import ObjectId
+from django.conf import settings
 from django.db import transaction
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 from rest_framework import serializers
 
-from core.models import DatatableActionType, Datatable
+from core.models import DatatableActionType, Datatable, DatatableAction
+from core.mongo import get_update
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_row(row: dict) -> dict:
+    """
+    Converts stored row to response shape: values become strings and missing values (``None``) become empty strings
+
+    :param row: MongoDB document
+    :return: serialized row
+    """
+    return {key: '' if value is None else str(value) for key, value in row.items()}
+
+
+class DatatableRowsListSerializer(serializers.ListSerializer):
+    """
+    Serializer for pages of datatable rows, converting the whole page in one pass instead of running serializer
+    machinery for every row
+    """
+
+    def to_representation(self, data) -> list:
+        """
+        :param data: iterable of MongoDB documents
+        :return: list of serialized rows
+        """
+        return [serialize_row(row) for row in data]
 
 
 class DatatableRowsReadOnlySerializer(serializers.Serializer):
     """
-    Serializer for datatable rows read only actions.
+    Serializer for datatable rows read only actions. Used with ``many=True`` it serializes rows with
+    ``DatatableRowsListSerializer``.
     """
 
     class Meta:
         model = Datatable
         fields = ('columns',)
         read_only_fields = fields
+        list_serializer_class = DatatableRowsListSerializer
 
-    def to_representation(self, instance: Datatable):
+    def to_representation(self, instance: dict) -> dict:
         """
         Skips converting default fields as only specifically stored row should be returned by this serializer.
 
-        :param instance: Datatable to read rows from
-        :return: serialized values of instance fields
+        :param instance: MongoDB document of a row
+        :return: serialized row
         """
-
-        ret = super().to_representation(instance)
-
-        for key, val in instance.items():
-            ret[key] = str(val) if val else ''
-
-        return ret
+        return serialize_row(instance)
 
 
 class DatatableRowsSerializer(serializers.Serializer):
     """
-    Serializer for datatable rows creation, edition and deletion
+    Serializer for datatable rows creation, edition and deletion. Column set to ``null`` is removed from patched
+    row and skipped in created one.
     """
 
     # Add Meta class for permissions
@@ -63,66 +92,72 @@ class DatatableRowsSerializer(serializers.Serializer):
         Yields Datatable columns as valid writable fields
         """
         for column in self.instance.columns:
-            field = serializers.CharField(required=False, allow_blank=True)
+            field = serializers.CharField(required=False, allow_blank=True, allow_null=True)
             field.field_name = column
             field.source_attrs = [column]
             yield field
 
-    def add_row(self) -> Datatable:
+    def add_row(self) -> dict:
         """
         Adds row to datatable based on data supplied to serializer and logs this operation as DatatableAction instance.
 
-        :return: Datatable row was added to
+        :return: added row
         """
+        new_row = {column: value for column, value in self.validated_data.items() if value is not None}
         with transaction.atomic():
-            row = self.instance.client.add_row(self.validated_data)
-
-            new_row = self.validated_data
+            row = self.instance.client.add_row(dict(new_row))
             new_row['_id'] = str(row.inserted_id)
 
             self.instance.register_action(
                 self.context['request'].user,
                 DatatableActionType.CREATE.value,
-                new_row=self.validated_data
+                new_row=new_row
             )
-        return self.instance
+        return new_row
 
-    def patch_row(self, row_id: str):
+    def patch_row(self, row_id: str) -> Optional[dict]:
         """
         Updates row in datatable based on data supplied to serializer and logs this operation as DatatableAction
-        instance.
+        instance. Row is updated and its previous state is fetched in one atomic operation, so history has exactly
+        the replaced values. Only edited columns are saved to history.
 
         :param row_id: BSON compliant id of row to be updated
-        :return: Datatable row was updated in
+        :return: updated row, ``None`` if there's no row with given id
         """
-        with transaction.atomic():
-            old_row = self.instance.client.get_rows({'_id': ObjectId(row_id)})[0]
-            self.instance.client.patch_row(row_id, self.validated_data)
+        if not ObjectId.is_valid(row_id):
+            return None
 
-            old_row['_id'] = str(old_row['_id'])
-
-            new_row = deepcopy(old_row)
-            for key, value in self.validated_data.items():
-                new_row[key] = value
+        data = {column: value for column, value in self.validated_data.items() if value is not None}
+        unset = [column for column, value in self.validated_data.items() if value is None]
+        with transaction.atomic():
+            row = self.instance.client.find_and_patch_row(row_id, dict(data), unset)
+            if row is None:
+                return None
 
+            old_row, new_row = DatatableAction.get_update_rows(row, data, unset)
             self.instance.register_action(
                 self.context['request'].user,
                 DatatableActionType.UPDATE.value,
                 new_row=new_row,
                 old_row=old_row
             )
+        return {column: value for column, value in {**row, **new_row}.items() if column not in unset}
 
-    def delete_row(self, row_id):
+    def delete_row(self, row_id: str) -> Optional[dict]:
         """
-        Deletes row from datatable based on data supplied to serializer and logs this operation as DatatableAction
-        instance.
+        Deletes row from datatable and logs this operation as DatatableAction instance. Row is deleted and fetched in
+        one atomic operation.
 
-        :param row_id: BSON compliant id of row to be updated
-        :return: Datatable row was deleted from
+        :param row_id: BSON compliant id of row to be deleted
+        :return: deleted row, ``None`` if there's no row with given id
         """
+        if not ObjectId.is_valid(row_id):
+            return None
+
         with transaction.atomic():
-            old_row = self.instance.client.get_rows({'_id': ObjectId(row_id)})[0]
-            self.instance.client.delete_row(row_id)
+            old_row = self.instance.client.find_and_delete_row(row_id)
+            if old_row is None:
+                return None
 
             old_row['_id'] = str(old_row['_id'])
 
@@ -131,3 +166,240 @@ class DatatableRowsSerializer(serializers.Serializer):
                 DatatableActionType.DELETE.value,
                 old_row=old_row
             )
+        return old_row
+
+
+class DatatableRowsBatchSerializer(serializers.Serializer):
+    """
+    Serializer for batches of datatable row creations, editions and deletions. Consecutive creations are written
+    with a single MongoDB bulk write and the whole batch is saved to history with a single query.
+
+    Operations are ``{"op": "create", "row": {...}}``, ``{"op": "patch", "_id": "...", "row": {...}}`` and
+    ``{"op": "delete", "_id": "..."}``, where ``row`` has values of columns (other keys are ignored). Column set to
+    ``null`` is removed from patched row and skipped in created one.
+    """
+
+    operations = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+
+    #: Statuses of written operations
+    statuses = {'create': 'created', 'patch': 'updated', 'delete': 'deleted'}
+    #: Types of history actions of operations
+    action_types = {'create': DatatableActionType.CREATE.value, 'patch': DatatableActionType.UPDATE.value,
+                    'delete': DatatableActionType.DELETE.value}
+
+    # Add Meta class for permissions
+    class Meta:
+        model = Datatable
+
+    def validate_operations(self, operations: List[dict]) -> List[dict]:
+        """
+        Validates if there aren't too many operations and every operation is of known type, has valid row id and
+        value of at least one column
+
+        :param operations: operations supplied to serializer
+        :return: operations with ``_id`` as ObjectId and ``row`` with values of columns
+        """
+        if len(operations) > settings.DATATABLE_BATCH_MAX_OPERATIONS:
+            raise serializers.ValidationError(
+                f'Batch can have at most {settings.DATATABLE_BATCH_MAX_OPERATIONS} operations.')
+
+        columns = set(self.instance.columns)
+        validated, errors = [], {}
+        for index, operation in enumerate(operations):
+            try:
+                validated.append(self.__validate_operation(operation, columns))
+            except serializers.ValidationError as e:
+                errors[index] = e.detail
+        if errors:
+            raise serializers.ValidationError(errors)
+        return validated
+
+    def write(self) -> List[dict]:
+        """
+        Writes operations to datatable in order and logs written ones as DatatableAction instances. Rows of patched
+        and deleted rows are fetched at once, operations on missing rows are skipped. Consecutive creations are
+        written with a single bulk write, patches and deletions one by one. If a write fails, following operations
+        aren't written.
+
+        Patch only applies if patched columns still have fetched values, so values changed by someone else in the
+        meantime aren't overwritten. Row is deleted and fetched in one atomic operation, so history has exactly the
+        deleted row. If patched values were changed or row was deleted in the meantime, operation isn't written
+        (``conflict``) and neither are following operations on that row.
+
+        If history can't be saved, written operations are reverted.
+
+        :return: result of every operation: its ``op``, ``_id`` and ``status`` (``created``, ``updated``,
+                 ``deleted``, ``not_found``, ``conflict``, ``failed`` with ``error``, or ``skipped`` after failed one)
+        """
+        operations = self.validated_data['operations']
+        row_ids = [operation['_id'] for operation in operations if operation['_id'] is not None]
+        rows = {row['_id']: row for row in self.instance.client.get_rows({'_id': {'$in': row_ids}})} \
+            if row_ids else {}
+
+        # result, write request and history rows of every operation on existing row
+        results, writes = [], []
+        for operation in operations:
+            op, row_id, data, unset = operation['op'], operation['_id'], operation['row'], operation['unset']
+            if op == 'create':
+                row_id = ObjectId()
+                new_row = {**data, '_id': row_id}
+                history = [None, self.__to_history(new_row)]
+                request = InsertOne(dict(new_row))
+            elif row_id not in rows:
+                results.append({'op': op, '_id': str(row_id), 'status': 'not_found'})
+                continue
+            elif op == 'patch':
+                new_row = {column: value for column, value in {**rows[row_id], **data}.items() if column not in unset}
+                history = list(DatatableAction.get_update_rows(rows[row_id], data, unset))
+                request = UpdateOne(self.__get_guard(rows[row_id], [*data, *unset]), get_update(data, unset))
+            else:
+                new_row = None
+                history = [self.__to_history(rows[row_id]), None]
+                request = None
+
+            # later operations on the same row see its state after this one
+            if new_row is None:
+                del rows[row_id]
+            else:
+                rows[row_id] = new_row
+            result = {'op': op, '_id': str(row_id), 'status': 'skipped'}
+            results.append(result)
+            writes.append((result, request, history))
+
+        written, conflicted = [], set()
+        for creations, group in groupby(writes, key=lambda write: write[0]['op'] == 'create'):
+            if creations:
+                if not self.__create_rows(list(group), written):
+                    break
+            elif not self.__write_rows(group, written, conflicted):
+                break
+
+        user = self.context['request'].user
+        actions = []
+        for result, _, history in written:
+            result['status'] = self.statuses[result['op']]
+            actions.append(self.instance.build_action(user, self.action_types[result['op']],
+                                                      old_row=history[0], new_row=history[1]))
+        try:
+            with transaction.atomic():
+                self.instance.register_actions(actions)
+        except Exception:
+            self.__revert(actions)
+            raise
+        return results
+
+    def __create_rows(self, creations: list, written: list) -> bool:
+        """
+        Inserts rows of creations with single bulk write
+
+        :param creations: results, write requests and history rows of consecutive creations
+        :param written: list extended with written creations
+        :return: True if all rows were inserted, False otherwise
+        """
+        try:
+            self.instance.client.bulk_write([request for _, request, _ in creations])
+        except BulkWriteError as e:
+            write_error = e.details['writeErrors'][0]
+            written.extend(creations[:write_error['index']])
+            creations[write_error['index']][0].update(status='failed', error=write_error['errmsg'])
+            return False
+        written.extend(creations)
+        return True
+
+    def __write_rows(self, writes: Iterable[tuple], written: list, conflicted: set) -> bool:
+        """
+        Patches and deletes existing rows one by one. Patch which matched no row and following operations on its row
+        are conflicted, as is deletion of row deleted in the meantime.
+
+        :param writes: results, write requests and history rows of consecutive patches and deletions
+        :param written: list extended with written operations
+        :param conflicted: ids of conflicted rows, extended with newly conflicted ones
+        :return: True if no write failed, False otherwise
+        """
+        for result, request, history in writes:
+            if result['_id'] in conflicted:
+                result['status'] = 'conflict'
+                continue
+            try:
+                if result['op'] == 'patch':
+                    applied = bool(self.instance.client.bulk_write([request]).matched_count)
+                else:
+                    row = self.instance.client.find_and_delete_row(result['_id'])
+                    applied = row is not None
+                    if applied:
+                        history[0] = self.__to_history(row)
+            except PyMongoError as e:
+                error = e.details['writeErrors'][0]['errmsg'] if isinstance(e, BulkWriteError) else str(e)
+                result.update(status='failed', error=error)
+                return False
+            if applied:
+                written.append((result, request, history))
+            else:
+                conflicted.add(result['_id'])
+                result['status'] = 'conflict'
+        return True
+
+    def __revert(self, actions: List[DatatableAction]):
+        """
+        Reverts written operations which couldn't be saved to history. History and rows are in different databases,
+        so rows are reverted by hand. Failed revert is logged, as rows and history are left out of sync.
+
+        :param actions: unsaved actions of written operations
+        """
+        requests = [request for request in (action.get_revert_request() for action in actions[::-1]) if request]
+        if not requests:
+            return
+        try:
+            self.instance.client.bulk_write(requests)
+        except Exception:
+            logger.exception('Can\'t revert rows of datatable %s written without history', self.instance.pk)
+
+    @staticmethod
+    def __get_guard(row: dict, columns: List[str]) -> dict:
+        """
+        Builds query matching row only if patched columns still have fetched values
+
+        :param row: fetched state of row
+        :param columns: patched columns
+        :return: MongoDB query
+        """
+        guard = {'_id': row['_id']}
+        guard.update({column: {'$eq': row[column]} if column in row else {'$exists': False} for column in columns})
+        return guard
+
+    def __validate_operation(self, operation: dict, columns: set) -> dict:
+        op = operation.get('op')
+        if op not in self.statuses:
+            raise serializers.ValidationError(f'op has to be one of: {", ".join(self.statuses)}.')
+
+        row_id = None
+        if op != 'create':
+            row_id = operation.get('_id')
+            if not isinstance(row_id, str) or not ObjectId.is_valid(row_id):
+                raise serializers.ValidationError('_id has to be a valid row id.')
+            row_id = ObjectId(row_id)
+
+        data, unset = {}, []
+        if op != 'delete':
+            row = operation.get('row')
+            if not isinstance(row, dict):
+                raise serializers.ValidationError('row has to be an object with column values.')
+            for column, value in row.items():
+                if column not in columns:
+                    continue
+                if value is None:
+                    if op == 'patch':
+                        unset.append(column)
+                    continue
+                # same values as accepted by CharField of DatatableRowsSerializer
+                if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                    raise serializers.ValidationError(f'Value of {column} has to be a string.')
+                data[column] = str(value)
+            if not data and not unset:
+                raise serializers.ValidationError('To create or patch a row at least one column has to be specified.')
+
+        return {'op': op, '_id': row_id, 'row': data, 'unset': unset}
+
+    @staticmethod
+    def __to_history(row: dict):
+        return {**row, '_id': str(row['_id'])}
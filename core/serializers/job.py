@@ -0,0 +1,33 @@
+from rest_framework import serializers
+
+from core.models import IngestionJob, ExportJob
+
+
+class IngestionJobReadOnlySerializer(serializers.ModelSerializer):
+    """
+    IngestionJob serializer reporting upload progress
+    """
+
+    duration = serializers.FloatField()
+    throughput = serializers.FloatField()
+
+    class Meta:
+        model = IngestionJob
+        fields = ['id', 'datatable', 'status', 'stage', 'rows_processed', 'throughput', 'error', 'file_name',
+                  'created_at', 'started_at', 'finished_at', 'duration']
+        read_only_fields = fields
+
+
+class ExportJobReadOnlySerializer(serializers.ModelSerializer):
+    """
+    ExportJob serializer reporting export progress
+    """
+
+    duration = serializers.FloatField()
+    throughput = serializers.FloatField()
+
+    class Meta:
+        model = ExportJob
+        fields = ['id', 'datatable', 'dataset_pid', 'status', 'stage', 'bytes_sent', 'throughput', 'attempts',
+                  'retry_at', 'error', 'file_name', 'created_at', 'started_at', 'finished_at', 'duration']
+        read_only_fields = fields
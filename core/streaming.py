@@ -0,0 +1,267 @@
+import csv
+import json
+import zlib
+from io import StringIO
+from typing import Dict, Iterator, List, Optional, Union
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from pymongo.cursor import Cursor
+from rest_framework.renderers import BaseRenderer
+
+from core.schema import BOOLEAN, FLOAT, INTEGER, cast_value
+from core.serializers.datatable_rows import serialize_row
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+#: Formats of downloaded rows and their content types, Parquet is available with ``pyarrow`` installed
+DOWNLOAD_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'csv.gz': 'application/gzip',
+    **({'parquet': 'application/vnd.apache.parquet'} if pq else {}),
+}
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renderer of newline delimited JSON. Rows are streamed by ``stream_rows``, so renderer is used for content
+    negotiation and for responses that aren't streamed (eg.: errors), which are rendered as a single line.
+    """
+    media_type = NDJSON_MEDIA_TYPE
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        if data is None:
+            return b''
+        return _dumps(data).encode('utf-8') + b'\n'
+
+
+def iter_row_batches(cursor: Cursor, batch_size: int = None) -> Iterator[List[dict]]:
+    """
+    Fetches rows from cursor in batches and serializes them like ``DatatableRowsReadOnlySerializer`` does. Only one
+    batch is held in memory. Cursor is closed when iteration ends or is abandoned.
+
+    :param cursor: MongoDB cursor with rows
+    :param batch_size: number of rows in a batch, ``settings.DATATABLE_STREAM_BATCH_SIZE`` by default
+    :return: iterator of batches of serialized rows
+    """
+    for batch in _iter_batches(cursor, batch_size):
+        yield [serialize_row(row) for row in batch]
+
+
+def iter_ndjson(cursor: Cursor, batch_size: int = None) -> Iterator[bytes]:
+    """
+    Encodes rows as newline delimited JSON, one row per line
+
+    :param cursor: MongoDB cursor with rows
+    :param batch_size: number of rows encoded at once, ``settings.DATATABLE_STREAM_BATCH_SIZE`` by default
+    :return: iterator of encoded batches
+    """
+    for batch in iter_row_batches(cursor, batch_size):
+        yield ''.join(f'{_dumps(row)}\n' for row in batch).encode('utf-8')
+
+
+def iter_json(cursor: Cursor, columns: List[str], batch_size: int = None) -> Iterator[bytes]:
+    """
+    Encodes rows as JSON document ``{"columns": [...], "results": [...]}``
+
+    :param cursor: MongoDB cursor with rows
+    :param columns: datatable columns
+    :param batch_size: number of rows encoded at once, ``settings.DATATABLE_STREAM_BATCH_SIZE`` by default
+    :return: iterator of encoded parts of document
+    """
+    yield f'{{"columns": {_dumps(columns)}, "results": ['.encode('utf-8')
+    separator = ''
+    for batch in iter_row_batches(cursor, batch_size):
+        yield (separator + ', '.join(_dumps(row) for row in batch)).encode('utf-8')
+        separator = ', '
+    yield b']}'
+
+
+def stream_rows(cursor: Cursor, columns: List[str], ndjson: bool = False) -> StreamingHttpResponse:
+    """
+    Builds response streaming rows as they are fetched from MongoDB, so memory use and time to first byte don't
+    depend on number of rows
+
+    :param cursor: MongoDB cursor with rows
+    :param columns: datatable columns
+    :param ndjson: stream newline delimited JSON instead of JSON document
+    :return: streaming response
+    """
+    if ndjson:
+        return StreamingHttpResponse(iter_ndjson(cursor), content_type=f'{NDJSON_MEDIA_TYPE}; charset=utf-8')
+    return StreamingHttpResponse(iter_json(cursor, columns), content_type='application/json')
+
+
+def iter_csv(cursor: Cursor, columns: List[str], batch_size: int = None) -> Iterator[bytes]:
+    """
+    Encodes rows as CSV with header, values are formatted like in JSON responses
+
+    :param cursor: MongoDB cursor with rows
+    :param columns: columns of CSV, in order
+    :param batch_size: number of rows encoded at once, ``settings.DATATABLE_STREAM_BATCH_SIZE`` by default
+    :return: iterator of encoded batches
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    def take() -> bytes:
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow(columns)
+    yield take()
+    for batch in iter_row_batches(cursor, batch_size):
+        writer.writerows([row.get(column, '') for column in columns] for row in batch)
+        yield take()
+
+
+def iter_gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    Compresses chunks as a single gzip file, chunks are compressed as they come
+
+    :param chunks: iterator of chunks of data
+    :return: iterator of chunks of gzip file
+    """
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_parquet(cursor: Cursor, columns: List[str], schema: Dict[str, dict],
+                 batch_size: int = None) -> Iterator[bytes]:
+    """
+    Encodes rows as Parquet file with row group per batch. Integer, float and boolean columns of schema are
+    stored with their types and their values that aren't of column type (eg.: text added to numeric column) are
+    stored as missing. Other columns are stored as text.
+
+    :param cursor: MongoDB cursor with rows
+    :param columns: columns of file, in order
+    :param schema: schema of columns, as in ``Datatable.schema``
+    :param batch_size: number of rows in a row group, ``settings.DATATABLE_STREAM_BATCH_SIZE`` by default
+    :return: iterator of chunks of file
+    """
+    arrow_types = {INTEGER: pa.int64(), FLOAT: pa.float64(), BOOLEAN: pa.bool_()}
+    column_schemas = [schema.get(column) for column in columns]
+    arrow_schema = pa.schema([(column, arrow_types.get(column_schema['type'] if column_schema else None, pa.string()))
+                              for column, column_schema in zip(columns, column_schemas)])
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, arrow_schema)
+    try:
+        yield sink.take()
+        for batch in _iter_batches(cursor, batch_size):
+            arrays = [pa.array([_get_parquet_value(row.get(column), column_schema) for row in batch], type=field.type)
+                      for column, column_schema, field in zip(columns, column_schemas, arrow_schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=arrow_schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def stream_file(cursor: Cursor, columns: List[str], schema: Dict[str, dict], file_format: str,
+                filename: str) -> StreamingHttpResponse:
+    """
+    Builds response streaming rows as file to download, encoded as they are fetched from MongoDB
+
+    :param cursor: MongoDB cursor with rows
+    :param columns: columns of file, in order
+    :param schema: schema of columns, as in ``Datatable.schema``
+    :param file_format: one of ``DOWNLOAD_FORMATS``
+    :param filename: name of file without extension
+    :return: streaming response
+    """
+    if file_format == 'parquet':
+        content = iter_parquet(cursor, columns, schema)
+    elif file_format == 'csv.gz':
+        content = iter_gzip(iter_csv(cursor, columns))
+    else:
+        content = iter_csv(cursor, columns)
+
+    response = StreamingHttpResponse(content, content_type=DOWNLOAD_FORMATS[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{file_format}"'
+    return response
+
+
+class _ChunkSink:
+    """
+    Write-only file collecting data written by ``pyarrow.parquet.ParquetWriter`` until it's taken
+    """
+
+    def __init__(self):
+        self.__chunks = []
+        self.__position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.__chunks.append(bytes(data))
+        self.__position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.__position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def take(self) -> bytes:
+        data = b''.join(self.__chunks)
+        self.__chunks = []
+        return data
+
+
+def _iter_batches(cursor: Cursor, batch_size: int = None) -> Iterator[List[dict]]:
+    batch_size = batch_size or settings.DATATABLE_STREAM_BATCH_SIZE
+    batch = []
+    try:
+        for row in cursor.batch_size(batch_size):
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        cursor.close()
+
+
+def _get_parquet_value(value, column_schema: Optional[dict]) -> Union[str, float, int, bool, None]:
+    column_type = column_schema['type'] if column_schema else None
+    if value is None:
+        return None
+    if column_type not in (INTEGER, FLOAT, BOOLEAN):
+        return str(value)
+
+    if isinstance(value, str):
+        value = cast_value(value, column_schema)
+    if column_type == BOOLEAN:
+        return value if isinstance(value, bool) else None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+        return None
+    if column_type == INTEGER:
+        return int(value) if float(value).is_integer() else None
+    return float(value)
+
+
+def _dumps(data) -> str:
+    # same encoding as DRF JSONRenderer with default settings
+    return json.dumps(data, ensure_ascii=False)
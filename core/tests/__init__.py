@@ -1,4 +1,11 @@
 from .models import DatatableTestCase, DatatableMongoClientTestCase, DatatableActionTestCase
 from .views import DatatableViewSetTestCase, DatatableActionViewSetTestCase
-from .serializers import DatatableSerializerTestCase, DatatableExportSerializerTestCase
-from .utils import UtilsTestCase
+from .serializers import DatatableSerializerTestCase, DatatableExportSerializerTestCase, \
+    DatatableRowsReadOnlySerializerTestCase, DatatableRowsBatchSerializerTestCase
+from .utils import UtilsTestCase, MongoClientRegistryTestCase, MongoCursorLimitOffsetPaginationTestCase, \
+    MongoCursorKeysetPaginationTestCase, RowCounterTestCase, IndexManagerTestCase
+from .ingestion import DataframeToDocumentsTestCase, IterExcelChunksTestCase, BulkInsertPipelineTestCase
+from .jobs import IngestionJobTestCase, ExportJobTestCase, JobWorkerTestCase
+from .query_parser import CompileQueryTestCase
+from .schema import SchemaInferenceTestCase, CastValueTestCase
+from .dataverse import DataverseClientTestCase, TTLCacheTestCase, DataverseClientRegistryTestCase
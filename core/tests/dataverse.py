@@ -0,0 +1,107 @@
+import time
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from core.dataverse import DataverseClient, DataverseClientRegistry, TTLCache, iter_multipart
+from core.exceptions import DataverseError
+from core.tests.mocks import FakeDataverse
+
+
+class DataverseClientTestCase(TestCase):
+
+    def test_get_status(self):
+        with FakeDataverse() as dataverse:
+            self.assertEqual(DataverseClient(dataverse.url).get_status(), 'OK')
+        self.assertEqual(DataverseClient(dataverse.url, timeout=1).get_status(), 'ERROR')
+
+    def test_get_dataset(self):
+        with FakeDataverse(datasets=['doi:10.5072/FK2/ABCDEF'], forbidden=['doi:10.5072/FK2/SECRET']) as dataverse:
+            client = DataverseClient(dataverse.url)
+            self.assertEqual(client.get_dataset('doi:10.5072/FK2/ABCDEF'), {'persistentUrl': 'doi:10.5072/FK2/ABCDEF'})
+            self.assertIsNone(client.get_dataset('doi:10.5072/FK2/MISSING'))
+            with self.assertRaises(DataverseError) as context:
+                client.get_dataset('doi:10.5072/FK2/SECRET')
+            self.assertEqual((str(context.exception), context.exception.status_code), ('User not authorized.', 403))
+
+    def test_cache(self):
+        """
+        Tests if available status and existing datasets are cached until removed dataset is found on upload
+        """
+        with FakeDataverse(datasets=['pid']) as dataverse:
+            client = DataverseClient(dataverse.url, cache_ttl=60)
+            for _ in range(2):
+                self.assertEqual(client.get_status(), 'OK')
+                self.assertTrue(client.get_dataset('pid'))
+                self.assertIsNone(client.get_dataset('missing_pid'))
+            self.assertEqual(len(dataverse.paths), 4)
+
+            dataverse.datasets.clear()
+            client.add_file('pid', 'deer.csv', [b'species'])
+            self.assertIsNone(client.get_dataset('pid'))
+
+        self.assertEqual(client.dataset_cache.metrics, {'hits': 1, 'misses': 4, 'hit_rate': 0.2, 'size': 0})
+
+    def test_add_file(self):
+        def content():
+            yield b'species\r\n'
+            yield b''
+            yield b'deer\r\n'
+
+        with FakeDataverse(datasets=['pid']) as dataverse:
+            response = DataverseClient(dataverse.url).add_file('pid', 'deer.csv', content())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(dataverse.files, {'deer.csv': b'species\r\ndeer\r\n'})
+        self.assertEqual(dataverse.headers[0]['Transfer-Encoding'], 'chunked')
+
+    def test_iter_multipart(self):
+        body = b''.join(iter_multipart('b', 'deer.csv', [b'deer'], 'text/csv', {'description': 'Deer'}))
+        self.assertEqual(body, b'--b\r\nContent-Disposition: form-data; name="jsonData"\r\n\r\n{"description": "Deer"}\r\n'
+                               b'--b\r\nContent-Disposition: form-data; name="file"; filename="deer.csv"\r\n'
+                               b'Content-Type: text/csv\r\n\r\ndeer\r\n--b--\r\n')
+
+
+class TTLCacheTestCase(TestCase):
+
+    def test_expire(self):
+        cache = TTLCache(ttl=60, max_size=2)
+        cache.set('deer', 1)
+        cache.set('bear', 2)
+        cache.set('boar', 3)
+        self.assertIsNone(cache.get('deer'))
+        self.assertEqual(cache.get('bear'), 2)
+
+        with patch('core.dataverse.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('boar'))
+        self.assertEqual(cache.metrics, {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3, 'size': 1})
+
+
+class DataverseClientRegistryTestCase(TestCase):
+
+    def test_get_client(self):
+        """
+        Tests if client is shared until settings change or process is forked
+        """
+        registry = DataverseClientRegistry()
+        with override_settings(DATAVERSE_URL='http://dataverse.example.org'):
+            client = registry.get_client()
+            self.assertIs(registry.get_client(), client)
+            self.assertEqual(client.api_url, 'http://dataverse.example.org/api/v1')
+
+            with patch('core.registry.os.getpid', return_value=-1):
+                self.assertIsNot(registry.get_client(), client)
+
+        with override_settings(DATAVERSE_URL='http://other.example.org'):
+            self.assertIsNot(registry.get_client(), client)
+
+    def test_get_metrics(self):
+        registry = DataverseClientRegistry()
+        with FakeDataverse(datasets=['pid']) as dataverse, override_settings(DATAVERSE_URL=dataverse.url):
+            for _ in range(4):
+                registry.get_client().get_dataset('pid')
+
+        metrics = registry.get_metrics()
+        self.assertEqual(metrics['clients'], 1)
+        self.assertEqual(metrics['dataset'], {'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'size': 1})
+        self.assertEqual(metrics['status']['hits'], 0)
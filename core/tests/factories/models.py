@@ -3,7 +3,7 @@ from datetime import datetime
 import factory
 from django.contrib.auth import get_user_model
 
-from core.models import Datatable, DatatableAction
+from core.models import Datatable, DatatableAction, IngestionJob, ExportJob
 
 
 class DatatableFactory(factory.DjangoModelFactory):
@@ -37,3 +37,26 @@ class DatatableActionFactory(factory.DjangoModelFactory):
     old_row = {'_id': 'old_row_id'}
     new_row = {'_id': 'new_row_id'}
     reverted = False
+
+
+class IngestionJobFactory(factory.DjangoModelFactory):
+    class Meta:
+        model = IngestionJob
+
+    user = factory.SubFactory(UserFactory)
+    datatable = factory.SubFactory(DatatableFactory)
+
+    file_path = factory.Sequence(lambda n: f'/tmp/upload_{n}')
+    file_name = 'csv.csv'
+    content_type = 'text/csv'
+
+
+class ExportJobFactory(factory.DjangoModelFactory):
+    class Meta:
+        model = ExportJob
+
+    user = factory.SubFactory(UserFactory)
+    datatable = factory.SubFactory(DatatableFactory)
+
+    dataset_pid = 'doi:10.5072/FK2/ABCDEF'
+    file_name = factory.Sequence(lambda n: f'export_{n}.csv')
@@ -0,0 +1,147 @@
+import json
+from datetime import date, datetime
+from io import BytesIO
+from unittest.mock import MagicMock, Mock
+
+import numpy
+import openpyxl
+import pandas as pd
+from django.test import TestCase
+
+from core.ingestion import dataframe_to_documents, BulkInsertPipeline, iter_excel_chunks, normalize_dates
+
+
+class DataframeToDocumentsTestCase(TestCase):
+    def test_same_as_json_round_trip(self):
+        """
+        Tests if conversion gives the same documents as ``to_json``/``json.loads`` round-trip
+        """
+        df = pd.DataFrame({'str_col': ['str_1', None, 'str_3'],
+                           'int_col': [1, 2, 3],
+                           'float_col': [1.5, numpy.nan, numpy.inf],
+                           'bool_col': [True, False, True],
+                           'mixed_col': [1, 'str', 2.5],
+                           'empty_col': [numpy.nan] * 3})
+
+        self.assertEqual(dataframe_to_documents(df), json.loads(df.to_json(orient='records', date_format='iso')))
+
+    def test_dates(self):
+        df = pd.DataFrame({'datetime_col': pd.to_datetime(['2020-01-01 10:11:12.345678', None]),
+                           'tz_col': pd.to_datetime(['2020-01-01', '2020-01-02']).tz_localize('Europe/Warsaw'),
+                           'date_col': [date(2020, 1, 1), None]})
+
+        self.assertEqual(dataframe_to_documents(df), [
+            {'datetime_col': '2020-01-01T10:11:12.345Z', 'tz_col': '2019-12-31T23:00:00.000Z',
+             'date_col': '2020-01-01T00:00:00.000Z'},
+            {'datetime_col': None, 'tz_col': '2020-01-01T23:00:00.000Z', 'date_col': None},
+        ])
+
+    def test_types(self):
+        """
+        Tests if values are converted to Python types and floats keep their precision
+        """
+        document = dataframe_to_documents(pd.DataFrame({'int_col': [1], 'float_col': [0.1 + 0.2]}))[0]
+
+        self.assertIs(type(document['int_col']), int)
+        self.assertEqual(document['float_col'], 0.1 + 0.2)
+
+    def test_empty(self):
+        self.assertEqual(dataframe_to_documents(pd.DataFrame({'col': []})), [])
+
+
+class IterExcelChunksTestCase(TestCase):
+    @staticmethod
+    def build_file(rows: list):
+        workbook = openpyxl.Workbook()
+        for row in rows:
+            workbook.active.append(row)
+        file = Mock()
+        file.file = BytesIO()
+        workbook.save(file.file)
+        return file
+
+    def test_chunks(self):
+        """
+        Tests if workbook rows are parsed in chunks of given size, skipping empty rows
+        """
+        file = self.build_file([['str_col', 'int_col', 'float_col'],
+                                ['str_1', 1.0, 1.5],
+                                [None, None, None],
+                                ['str_2', 2.0, None],
+                                ['str_3', 3.0, 3.0]])
+
+        chunks = list(iter_excel_chunks(file, chunk_size=2))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual(dataframe_to_documents(pd.concat(chunks)),
+                         [{'str_col': 'str_1', 'int_col': 1, 'float_col': 1.5},
+                          {'str_col': 'str_2', 'int_col': 2, 'float_col': None},
+                          {'str_col': 'str_3', 'int_col': 3, 'float_col': 3.0}])
+        self.assertIsInstance(dataframe_to_documents(chunks[0])[0]['int_col'], int)
+
+    def test_header(self):
+        """
+        Tests if empty and duplicated column names are named like by ``pd.read_excel``
+        """
+        file = self.build_file([['col', None, 'col', None], ['a', 'b', 'c']])
+
+        chunk, = iter_excel_chunks(file)
+
+        self.assertEqual(list(chunk.columns), ['col', 'Unnamed: 1', 'col.1'])
+
+    def test_header_only(self):
+        chunk, = iter_excel_chunks(self.build_file([['str_col', 'int_col']]))
+
+        self.assertTrue(chunk.empty)
+        self.assertEqual(list(chunk.columns), ['str_col', 'int_col'])
+
+    def test_empty_sheet(self):
+        with self.assertRaises(pd.errors.EmptyDataError):
+            list(iter_excel_chunks(self.build_file([])))
+
+    def test_normalize_dates(self):
+        """
+        Tests if dates without time become ``YYYY-MM-DD`` and others ISO 8601 strings
+        """
+        df = pd.DataFrame({'date_col': [datetime(2020, 1, 1), datetime(2020, 1, 8, 12, 30), None]})
+
+        self.assertEqual(normalize_dates(df)['date_col'].tolist(), ['2020-01-01', '2020-01-08T12:30:00.000Z', None])
+
+
+class BulkInsertPipelineTestCase(TestCase):
+    def test_insert(self):
+        collection = MagicMock()
+        with BulkInsertPipeline(collection, writers=2, queue_size=1) as pipeline:
+            for i in range(10):
+                pipeline.put([{'col': i}, {'col': i}])
+            pipeline.put([])
+
+        self.assertEqual(pipeline.inserted_rows, 20)
+        self.assertEqual(collection.insert_many.call_count, 10)
+        self.assertFalse(collection.insert_many.call_args[1]['ordered'])
+
+        documents = sorted((document for call in collection.insert_many.call_args_list for document in call[0][0]),
+                           key=lambda document: document['_id'])
+        self.assertEqual([document['col'] for document in documents], [i // 2 for i in range(20)])
+
+    def test_insert_without_writers(self):
+        collection = MagicMock()
+        with BulkInsertPipeline(collection, writers=0) as pipeline:
+            pipeline.put([{'col': 1}])
+
+        collection.insert_many.assert_called_once()
+        self.assertEqual(pipeline.inserted_rows, 1)
+
+    def test_writer_error(self):
+        """
+        Tests if writer error stops pipeline and is raised in producer thread
+        """
+        collection = MagicMock()
+        collection.insert_many.side_effect = ValueError()
+
+        with self.assertRaises(ValueError):
+            with BulkInsertPipeline(collection, writers=1, queue_size=1) as pipeline:
+                for i in range(100):
+                    pipeline.put([{'col': i}])
+
+        self.assertLess(collection.insert_many.call_count, 100)
@@ -0,0 +1,252 @@
+import gzip
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest.mock import Mock, patch
+
+from django.db import connections
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+import core
+from core.jobs import JobWorker
+from core.models import IngestionJob, ExportJob, JobStatus, Datatable
+from core.tests.factories.models import IngestionJobFactory, ExportJobFactory, DatatableFactory
+from core.tests.mocks import FakeDataverse
+
+
+class IngestionJobTestCase(TestCase):
+
+    def test_run(self):
+        """
+        Tests if job reports upload progress and removes stored file
+        """
+        with tempfile.NamedTemporaryFile(delete=False) as stored_file:
+            stored_file.write(b'str_col;int_col\nstr_1;1\n')
+        job = IngestionJobFactory(file_path=stored_file.name)
+        stages = []
+
+        def upload_datatable_file(datatable, file, progress):
+            progress('inserting', 1)
+            stages.append(IngestionJob.objects.values_list('stage', 'rows_processed').get(pk=job.pk))
+
+        with patch.object(Datatable, 'upload_datatable_file', upload_datatable_file):
+            job.run()
+
+        job.refresh_from_db()
+        self.assertEqual(stages, [('inserting', 1)])
+        self.assertEqual(job.status, JobStatus.DONE.value)
+        self.assertEqual(job.rows_processed, 1)
+        self.assertIsNotNone(job.finished_at)
+        with self.assertRaises(FileNotFoundError):
+            open(stored_file.name)
+
+    def test_run_failed(self):
+        """
+        Tests if job failure is saved, datatable with rows is kept and datatable without rows is removed
+        """
+        with tempfile.NamedTemporaryFile(delete=False) as stored_file:
+            stored_file.write(b'str_col;int_col\nstr_1;1\n')
+        job = IngestionJobFactory(file_path=stored_file.name)
+
+        with patch.object(Datatable, 'upload_datatable_file', side_effect=ValueError('Unexpected value')):
+            job.run()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.FAILED.value)
+        self.assertEqual(job.error, 'Unexpected value')
+        self.assertIsNotNone(job.datatable)
+
+        with tempfile.NamedTemporaryFile(delete=False) as stored_file:
+            stored_file.write(b'str_col;int_col\nstr_1;1\n')
+        job = IngestionJobFactory(file_path=stored_file.name, datatable=DatatableFactory(columns=[]))
+        with patch.object(Datatable, 'upload_datatable_file', side_effect=MemoryError()):
+            job.run()
+
+        job.refresh_from_db()
+        self.assertEqual(job.error, 'MemoryError')
+        self.assertIsNone(job.datatable)
+
+
+class ExportJobTestCase(TestCase):
+
+    def setUp(self):
+        self.job = ExportJobFactory()
+        file = Mock()
+        file.content_type = 'text/csv'
+        with open(os.path.join(os.path.dirname(core.__file__), 'tests/data_samples/csv.csv'), 'rb') as csv_file:
+            file.file = csv_file
+            self.job.datatable.upload_datatable_file(file)
+
+    def test_run(self):
+        """
+        Tests if filtered rows are uploaded and sent bytes are reported
+        """
+        self.job.query = {'int_col': {'$gte': 1}}
+        self.job.ordering = [['int_col', -1]]
+        self.job.columns = ['str_col']
+        self.job.compress = True
+        self.job.save()
+
+        with FakeDataverse(datasets=[self.job.dataset_pid]) as dataverse, \
+                override_settings(DATAVERSE_URL=dataverse.url):
+            self.job.run()
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, JobStatus.DONE.value, msg=self.job.error)
+        self.assertEqual(self.job.attempts, 1)
+        content = dataverse.files[self.job.file_name]
+        self.assertEqual(self.job.bytes_sent, len(content))
+        rows = gzip.decompress(content).decode('utf-8').splitlines()
+        self.assertEqual(rows[0], '_id,str_col')
+        self.assertEqual([row.split(',')[1] for row in rows[1:]], ['str_2', 'str_1'])
+
+    def test_run_missing_dataset(self):
+        """
+        Tests if export to missing dataset fails without retry
+        """
+        with FakeDataverse() as dataverse, override_settings(DATAVERSE_URL=dataverse.url):
+            self.job.run()
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, JobStatus.FAILED.value)
+        self.assertEqual(self.job.error, 'Dataset doesn\'t exist in Dataverse.')
+        self.assertIsNone(self.job.retry_at)
+
+    @override_settings(EXPORT_JOB_MAX_ATTEMPTS=2, EXPORT_JOB_RETRY_DELAY=60)
+    def test_run_retry(self):
+        """
+        Tests if export is retried with growing delay until attempts run out when Dataverse can't be reached
+        """
+        with FakeDataverse() as dataverse:
+            pass
+
+        with override_settings(DATAVERSE_URL=dataverse.url, DATAVERSE_TIMEOUT=1):
+            self.job.run()
+            self.job.refresh_from_db()
+            self.assertEqual(self.job.status, JobStatus.PENDING.value)
+            self.assertEqual(self.job.attempts, 1)
+            self.assertAlmostEqual((self.job.retry_at - timezone.now()).total_seconds(), 60, delta=5)
+            self.assertFalse(ExportJob.get_claimable().exists())
+
+            self.job.run()
+            self.job.refresh_from_db()
+            self.assertEqual(self.job.status, JobStatus.FAILED.value)
+            self.assertEqual(self.job.attempts, 2)
+
+
+class JobWorkerTestCase(TestCase):
+
+    def test_claim(self):
+        """
+        Tests if oldest pending jobs are claimed
+        """
+        jobs = [IngestionJobFactory() for _ in range(3)]
+        IngestionJobFactory(status=JobStatus.DONE.value)
+
+        claimed = JobWorker(processes=0).claim(2)
+
+        self.assertEqual(claimed, [(IngestionJob, jobs[0].pk), (IngestionJob, jobs[1].pk)])
+        self.assertEqual(list(IngestionJob.objects.filter(status=JobStatus.RUNNING.value).order_by('pk')),
+                         jobs[:2])
+
+    @override_settings(EXPORT_JOB_CONCURRENCY=2)
+    def test_claim_export_jobs(self):
+        """
+        Tests if export jobs waiting for retry aren't claimed and number of running exports is limited
+        """
+        ExportJobFactory(status=JobStatus.RUNNING.value)
+        ExportJobFactory(retry_at=timezone.now() + timedelta(minutes=1))
+        jobs = [ExportJobFactory(retry_at=timezone.now() - timedelta(minutes=1)), ExportJobFactory()]
+
+        self.assertEqual(JobWorker(processes=0).claim(3), [(ExportJob, jobs[0].pk)])
+        self.assertEqual(JobWorker(processes=0).claim(3), [])
+
+    def test_claim_export_jobs_locked(self):
+        """
+        Tests if claims of export jobs are serialized by advisory lock held until claimed jobs are committed
+        """
+        ExportJobFactory()
+        get_claimable = ExportJob.get_claimable
+        lock_taken = []
+
+        def try_lock():
+            with connections['default'].cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', [ExportJob.claim_lock_id])
+                lock_taken.append(cursor.fetchone()[0])
+            connections['default'].close()
+
+        def get_claimable_of_other_worker():
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+            return get_claimable()
+
+        with patch.object(ExportJob, 'get_claimable', get_claimable_of_other_worker):
+            JobWorker(processes=0).claim(1)
+
+        self.assertEqual(lock_taken, [False])
+
+    def test_fail_stale_export_jobs(self):
+        """
+        Tests if interrupted exports are retried
+        """
+        job = ExportJobFactory(status=JobStatus.RUNNING.value, attempts=1)
+        ExportJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(JobWorker(processes=0, stale_timeout=3600).fail_stale_jobs(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (JobStatus.PENDING.value, 'Job was interrupted.'))
+        self.assertIsNotNone(job.retry_at)
+
+    def test_fail_stale_jobs(self):
+        """
+        Tests if jobs that stopped reporting progress are marked as failed
+        """
+        with tempfile.NamedTemporaryFile(delete=False) as stored_file:
+            stale_job = IngestionJobFactory(status=JobStatus.RUNNING.value, datatable=DatatableFactory(columns=[]),
+                                            file_path=stored_file.name)
+        IngestionJob.objects.filter(pk=stale_job.pk).update(updated_at=timezone.now() - timedelta(hours=2))
+        running_job = IngestionJobFactory(status=JobStatus.RUNNING.value)
+
+        self.assertEqual(JobWorker(processes=0, stale_timeout=3600).fail_stale_jobs(), 1)
+
+        datatable_id = stale_job.datatable_id
+        stale_job.refresh_from_db()
+        running_job.refresh_from_db()
+        self.assertEqual((stale_job.status, stale_job.error), (JobStatus.FAILED.value, 'Job was interrupted.'))
+        self.assertEqual(running_job.status, JobStatus.RUNNING.value)
+        self.assertFalse(Datatable.objects.filter(pk=datatable_id).exists())
+        self.assertFalse(os.path.exists(stored_file.name))
+
+    def test_run_once(self):
+        """
+        Tests if worker without processes runs all pending jobs and stops
+        """
+        jobs = [IngestionJobFactory() for _ in range(2)]
+
+        with patch.object(IngestionJob, 'execute') as execute:
+            JobWorker(processes=0, poll_interval=0).run(once=True)
+
+        self.assertEqual(execute.call_count, 2)
+        for job in jobs:
+            job.refresh_from_db()
+            self.assertEqual(job.status, JobStatus.DONE.value)
+
+    def test_sync_indexes(self):
+        """
+        Tests if worker syncs indexes once interval passes and previous sync finished
+        """
+        worker = JobWorker(processes=0, index_sync_interval=60)
+        with patch('core.jobs.sync_all_indexes') as sync_all_indexes:
+            self.assertFalse(worker.sync_indexes())
+
+            with patch('core.jobs.time.monotonic', return_value=time.monotonic() + 61):
+                self.assertTrue(worker.sync_indexes())
+                worker._index_sync_thread.join()
+                self.assertFalse(worker.sync_indexes())
+
+        sync_all_indexes.assert_called_once()
@@ -1,4 +1,9 @@
+import json
+import re
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
 from unittest.mock import MagicMock
+from urllib.parse import parse_qs, urlparse
 
 
 class MockCollection:
@@ -7,10 +12,105 @@ class MockCollection:
     insert_one = MagicMock()
     update_one = MagicMock()
     delete_one = MagicMock()
+    find_one_and_update = MagicMock()
+    find_one_and_delete = MagicMock()
     insert_many = MagicMock()
+    delete_many = MagicMock()
+    rename = MagicMock()
+    drop = MagicMock()
+    index_information = MagicMock(return_value={'_id_': {'key': [('_id', 1)], 'v': 2}})
 
 
 class MockClient:
     add_row = MagicMock()
     delete_row = MagicMock()
     patch_row = MagicMock()
+
+
+class FakeDataverse:
+    """
+    Local HTTP server answering requests of ``core.dataverse.DataverseClient`` like Dataverse does. Uploaded files,
+    headers of upload requests and paths of all requests are recorded in ``files``, ``headers`` and ``paths``.
+    Datasets in ``forbidden`` are answered with 403, like datasets the API token can't access.
+
+    .. sourcecode:: python
+
+        with FakeDataverse(datasets=['doi:10.5072/FK2/ABCDEF']) as dataverse:
+            client = DataverseClient(dataverse.url)
+    """
+
+    def __init__(self, datasets: list = (), forbidden: list = ()):
+        self.datasets = set(datasets)
+        self.forbidden = set(forbidden)
+        self.files = {}
+        self.headers = []
+        self.paths = []
+        self.server = HTTPServer(('127.0.0.1', 0), self.__get_handler_class())
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __enter__(self):
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __get_handler_class(self):
+        dataverse = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                dataverse.paths.append(self.path)
+                url = urlparse(self.path)
+                pid = parse_qs(url.query).get('persistentId', [None])[0]
+                if url.path == '/api/v1/info/server':
+                    self.respond(200, {'status': 'OK', 'data': {'message': 'localhost'}})
+                elif url.path == '/api/v1/datasets/:persistentId/' and pid in dataverse.forbidden:
+                    self.respond(403, {'status': 'ERROR', 'message': 'User not authorized.'})
+                elif url.path == '/api/v1/datasets/:persistentId/' and pid in dataverse.datasets:
+                    self.respond(200, {'status': 'OK', 'data': {'persistentUrl': pid}})
+                else:
+                    self.respond(404, {'status': 'ERROR', 'message': f'Dataset with Persistent ID {pid} not found.'})
+
+            def do_POST(self):
+                dataverse.paths.append(self.path)
+                url = urlparse(self.path)
+                pid = parse_qs(url.query).get('persistentId', [None])[0]
+                body = self.read_body()
+                dataverse.headers.append(dict(self.headers))
+                if url.path != '/api/v1/datasets/:persistentId/add' or pid not in dataverse.datasets:
+                    self.respond(404, {'status': 'ERROR', 'message': f'Dataset with Persistent ID {pid} not found.'})
+                    return
+
+                boundary = self.headers['Content-Type'].split('boundary=')[1].encode()
+                for part in body.split(b'--' + boundary)[1:-1]:
+                    headers, content = part[2:-2].split(b'\r\n\r\n', 1)
+                    filename = re.search(rb'filename="([^"]+)"', headers)
+                    if filename:
+                        dataverse.files[filename.group(1).decode()] = content
+                self.respond(200, {'status': 'OK', 'data': {'files': [{'label': name} for name in dataverse.files]}})
+
+            def read_body(self) -> bytes:
+                if 'Content-Length' in self.headers:
+                    return self.rfile.read(int(self.headers['Content-Length']))
+                body = b''
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    body += self.rfile.read(size)
+                    self.rfile.readline()
+                    if not size:
+                        return body
+
+            def respond(self, status_code: int, data: dict):
+                content = json.dumps(data).encode('utf-8')
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
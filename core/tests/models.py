@@ -1,14 +1,18 @@
 import os
-from unittest.mock import MagicMock, Mock
+import time
+from io import BytesIO
+from unittest.mock import MagicMock, Mock, patch
 
 from bson import ObjectId
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.test import TestCase, override_settings
+from pymongo import ReturnDocument, UpdateOne
 
 import core
-from core.exceptions import WrongFileType, WrongAction
-from core.models import DatatableActionType, DatatableAction
+from core.exceptions import WrongFileType, WrongAction, CorruptedFile
+from core.models import Datatable, DatatableActionType, DatatableAction
 from core.models.datatable import DatatableMongoClient
 from core.tests.factories.models import DatatableFactory, DatatableActionFactory
 from core.tests.mocks import MockCollection, MockClient
@@ -34,7 +38,39 @@ class DatatableTestCase(TestCase):
         client_upload_function = instance.client.upload_file_to_db
         instance.upload_datatable_file(file=b'test_file')
 
-        client_upload_function.assert_called_once_with(b'test_file')
+        client_upload_function.assert_called_once_with(b'test_file', None)
+
+    def test_upload_datatable_file_keeps_indexes(self):
+        """
+        Tests if replaced collection keeps secondary indexes on columns that still exist
+        """
+        instance = DatatableFactory()
+        instance.client.add_row({'str_col': 'str_0', 'removed_col': 0})
+        instance.client.collection.create_index('str_col', name='str_col_index')
+        instance.client.collection.create_index('removed_col', name='removed_col_index')
+
+        file = Mock()
+        file.content_type = 'text/csv'
+        self_path = os.path.dirname(core.__file__)
+        with open(os.path.join(self_path, 'tests/data_samples/csv.csv'), 'rb') as csv_file:
+            file.file = csv_file
+            instance.upload_datatable_file(file)
+
+        self.assertEqual(instance.client.collection.count_documents({}), 2)
+        self.assertIn('str_col_index', instance.client.collection.index_information())
+        self.assertNotIn('removed_col_index', instance.client.collection.index_information())
+
+    def test_drop_stale_staging_collections(self):
+        instance = DatatableFactory()
+        database = instance.client.database
+        prefix = f'{instance.collection_name}{instance.client.staging_infix}'
+        database[f'{prefix}1_stale'].insert_one({})
+        database[f'{prefix}{int(time.time())}_fresh'].insert_one({})
+
+        instance.client.drop_stale_staging_collections()
+
+        self.assertNotIn(f'{prefix}1_stale', database.list_collection_names())
+        self.assertIn(f'{prefix}{int(time.time())}_fresh', database.list_collection_names())
 
     def test_register_action(self):
         instance = DatatableFactory()
@@ -46,6 +82,25 @@ class DatatableTestCase(TestCase):
         action = DatatableAction.objects.get(datatable=instance)
         self.assertEqual(action.datatable, instance)
 
+    def test_bump_revision(self):
+        """
+        Tests if revision is incremented and read back with single query, and action is saved with one more
+        """
+        instance = DatatableFactory()
+        revision = instance.revision
+
+        with self.assertNumQueries(1):
+            instance.bump_revision()
+        self.assertEqual(instance.revision, revision + 1)
+        with self.assertNumQueries(2):
+            instance.register_action(self.user, DatatableActionType.CREATE.value, new_row={'_id': str(ObjectId())})
+        instance.refresh_from_db(fields=['revision'])
+        self.assertEqual(instance.revision, revision + 2)
+
+        instance.delete()
+        with self.assertRaises(Datatable.DoesNotExist):
+            instance.bump_revision()
+
     def test_repr(self):
         instance = DatatableFactory(title='test')
         self.assertEqual(repr(instance), 'test')
@@ -57,19 +112,39 @@ class DatatableMongoClientTestCase(TestCase):
     def setUpClass(cls):
         super().setUpClass()
         cls.mock_collection = MockCollection()
-        cls.instance = DatatableMongoClient('collection', MagicMock(
-            return_value={settings.MONGO_DATABASE: MagicMock(
-                return_value={'collection': cls.mock_collection})}))
+        mock_database = MagicMock()
+        mock_database.__getitem__.return_value = cls.mock_collection
+        cls.instance = DatatableMongoClient('collection', {settings.MONGO_DATABASE: mock_database})
 
         # ObjectId compliant value
         cls.binary_id = '0123456789ab0123456789ab'
 
+    def assertInserted(self, rows):
+        """
+        Asserts that rows were inserted to collection in given order, ignoring their ``_id``
+        """
+        documents = sorted((document for call in self.instance.collection.insert_many.call_args_list
+                            for document in call[0][0]), key=lambda document: document['_id'])
+        self.assertEqual([{key: val for key, val in document.items() if key != '_id'} for document in documents], rows)
+
+    @patch('core.models.datatable.mongo_clients')
+    def test_collection_is_attached_lazily(self, mock_registry):
+        instance = DatatableMongoClient('lazy_collection')
+        mock_registry.get_client.assert_not_called()
+
+        collection = instance.collection
+        self.assertIs(collection, instance.collection)
+        mock_registry.get_client.assert_called_once_with()
+
     def test_get_rows(self):
         self.instance.get_rows()
-        self.instance.collection.find.assert_called_with({})
+        self.instance.collection.find.assert_called_with({}, None)
 
         self.instance.get_rows({'column': 'value'})
-        self.instance.collection.find.assert_called_with({'column': 'value'})
+        self.instance.collection.find.assert_called_with({'column': 'value'}, None)
+
+        self.instance.get_rows({'column': 'value'}, {'_id': True, 'column': True})
+        self.instance.collection.find.assert_called_with({'column': 'value'}, {'_id': True, 'column': True})
 
     def test_has_row_true(self):
         """
@@ -105,10 +180,31 @@ class DatatableMongoClientTestCase(TestCase):
         self.instance.collection.update_one.assert_called_with({'_id': ObjectId(self.binary_id)},
                                                                {'$set': {'column': 'value'}})
 
+    def test_patch_row_nothing_to_update(self):
+        self.instance.collection.update_one.reset_mock()
+        self.assertIsNone(self.instance.patch_row(self.binary_id, {'_id': 'ignored'}, unset=[]))
+        self.instance.collection.update_one.assert_not_called()
+
     def test_delete_row(self):
         self.instance.delete_row(self.binary_id)
         self.instance.collection.delete_one.assert_called_with({'_id': ObjectId(self.binary_id)})
 
+    def test_find_and_patch_row(self):
+        self.instance.collection.find_one_and_update.return_value = {'_id': ObjectId(self.binary_id), 'column': 'old'}
+        old_row = self.instance.find_and_patch_row(self.binary_id, {'_id': 'ignored', 'column': 'value'})
+        self.instance.collection.find_one_and_update.assert_called_with(
+            {'_id': ObjectId(self.binary_id)}, {'$set': {'column': 'value'}}, return_document=ReturnDocument.BEFORE)
+        self.assertEqual(old_row['column'], 'old')
+
+        self.instance.find_and_patch_row(self.binary_id, {'column': 'value'}, unset=['other'])
+        self.instance.collection.find_one_and_update.assert_called_with(
+            {'_id': ObjectId(self.binary_id)}, {'$set': {'column': 'value'}, '$unset': {'other': ''}},
+            return_document=ReturnDocument.BEFORE)
+
+    def test_find_and_delete_row(self):
+        self.instance.find_and_delete_row(self.binary_id)
+        self.instance.collection.find_one_and_delete.assert_called_with({'_id': ObjectId(self.binary_id)})
+
     def test_upload_file_to_db_csv(self):
         file = Mock()
         file.content_type = 'text/csv'
@@ -116,11 +212,43 @@ class DatatableMongoClientTestCase(TestCase):
         with open(os.path.join(self_path, 'tests/data_samples/csv.csv'), 'rb') as csv_file:
             file.file = csv_file
 
+            self.instance.collection.insert_many.reset_mock()
             self.instance.upload_file_to_db(file)
-        self.instance.collection.insert_many.assert_called_with([{'str_col': 'str_1',
-                                                                  'int_col': 1},
-                                                                 {'str_col': 'str_2',
-                                                                  'int_col': 2}])
+        self.instance.collection.rename.assert_called_with('collection', dropTarget=True)
+        self.assertInserted([{'str_col': 'str_1', 'int_col': 1},
+                             {'str_col': 'str_2', 'int_col': 2}])
+
+    @override_settings(DATATABLE_UPLOAD_CHUNK_SIZE=1)
+    def test_upload_file_to_db_csv_temporary_file(self):
+        """
+        Tests if file spooled to disk is streamed in chunks of configured size
+        """
+        file = TemporaryUploadedFile('csv.csv', 'text/csv', 0, 'utf-8')
+        self_path = os.path.dirname(core.__file__)
+        with open(os.path.join(self_path, 'tests/data_samples/csv.csv'), 'rb') as csv_file:
+            file.write(csv_file.read())
+
+        self.instance.collection.insert_many.reset_mock()
+        self.instance.upload_file_to_db(file)
+
+        self.assertEqual(self.instance.collection.insert_many.call_count, 2)
+        self.assertInserted([{'str_col': 'str_1', 'int_col': 1},
+                             {'str_col': 'str_2', 'int_col': 2}])
+        self.assertFalse(file.file.closed)
+        file.close()
+
+    @override_settings(DATATABLE_UPLOAD_ENCODING='cp1250')
+    def test_upload_file_to_db_csv_encoding(self):
+        """
+        Tests if delimiter is sniffed from file decoded with configured encoding
+        """
+        file = Mock()
+        file.content_type = 'text/csv'
+        file.file = BytesIO('gatunek;liczebność\nżubr;1\n'.encode('cp1250'))
+
+        self.instance.collection.insert_many.reset_mock()
+        self.instance.upload_file_to_db(file)
+        self.assertInserted([{'gatunek': 'żubr', 'liczebność': 1}])
 
     def test_upload_file_to_db_excel(self):
         file = Mock()
@@ -129,10 +257,33 @@ class DatatableMongoClientTestCase(TestCase):
         with open(os.path.join(self_path, 'tests/data_samples/excel.xlsx'), 'rb') as excel_file:
             file.file = excel_file
 
+            self.instance.collection.insert_many.reset_mock()
             self.instance.upload_file_to_db(file)
-        self.instance.collection.insert_many.assert_called_with(
-            [{'str_col': 'str_1', 'int_col': 1, 'date_col': '2020-01-01'},
-             {'str_col': 'str_2', 'int_col': 2, 'date_col': '2020-01-08'}])
+        self.assertInserted([{'str_col': 'str_1', 'int_col': 1, 'date_col': '2020-01-01'},
+                             {'str_col': 'str_2', 'int_col': 2, 'date_col': '2020-01-08'}])
+        self.assertEqual(self.instance.schema, {
+            'str_col': {'type': 'string', 'nullable': False},
+            'int_col': {'type': 'integer', 'nullable': False},
+            'date_col': {'type': 'date', 'nullable': False, 'format': '%Y-%m-%d'},
+        })
+
+    def test_upload_file_to_db_corrupted_csv(self):
+        """
+        Tests if staged rows are dropped and live collection is kept when file can't be parsed
+        """
+        file = Mock()
+        file.content_type = 'text/csv'
+        self_path = os.path.dirname(core.__file__)
+        self.instance.collection.rename.reset_mock()
+        self.instance.collection.drop.reset_mock()
+        with open(os.path.join(self_path, 'tests/data_samples/corrupted.csv'), 'rb') as csv_file:
+            file.file = csv_file
+
+            with self.assertRaises(CorruptedFile):
+                self.instance.upload_file_to_db(file)
+
+        self.instance.collection.drop.assert_called_once_with()
+        self.instance.collection.rename.assert_not_called()
 
     def test_upload_file_to_db_wrong_filetype(self):
         file = Mock()
@@ -147,6 +298,7 @@ class DatatableActionTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
+        cls.binary_id = '0123456789ab0123456789ab'
         cls.instance = DatatableActionFactory()
         cls.instance.datatable.client = MockClient()
 
@@ -170,9 +322,42 @@ class DatatableActionTestCase(TestCase):
         self.instance.revert_action()
 
         self.instance.datatable.client.patch_row.assert_called_with(self.instance.old_row['_id'],
-                                                                    self.instance.old_row)
+                                                                    self.instance.old_row,
+                                                                    unset=self.instance.get_unset_columns())
         self.assertTrue(self.instance.reverted)
 
+    def test_get_revert_request(self):
+        self.instance.action = DatatableActionType.UPDATE.value
+        self.instance.old_row = {'_id': '0123456789ab0123456789ab', 'column': 'value'}
+        request = self.instance.get_revert_request()
+        self.assertEqual(request, UpdateOne({'_id': ObjectId('0123456789ab0123456789ab')}, {'$set': {'column': 'value'}}))
+
+        self.instance.new_row = {'_id': '0123456789ab0123456789ab', 'column': 'new', 'added': 'new'}
+        request = self.instance.get_revert_request()
+        self.assertEqual(request, UpdateOne({'_id': ObjectId('0123456789ab0123456789ab')},
+                                            {'$set': {'column': 'value'}, '$unset': {'added': ''}}))
+
+        self.instance.old_row = self.instance.new_row = {'_id': '0123456789ab0123456789ab'}
+        self.assertIsNone(self.instance.get_revert_request())
+
+        self.instance.action = 'WRONG'
+        with self.assertRaises(WrongAction):
+            self.instance.get_revert_request()
+
+    def test_get_update_rows(self):
+        old_row, new_row = DatatableAction.get_update_rows({'_id': ObjectId(self.binary_id), 'a': '1', 'b': '2'},
+                                                           {'b': '3', 'c': '4'})
+        self.assertEqual(old_row, {'_id': self.binary_id, 'b': '2'})
+        self.assertEqual(new_row, {'_id': self.binary_id, 'b': '3', 'c': '4'})
+
+    @override_settings(DATATABLE_HISTORY_COMPRESSION=True)
+    def test_set_rows_compressed(self):
+        action = DatatableAction()
+        action.set_rows(old_row={'_id': self.binary_id, 'column': 'old'}, new_row=None)
+        self.assertIsNone(action.old_row)
+        self.assertTrue(action.compressed_rows)
+        self.assertEqual(action.get_rows(), ({'_id': self.binary_id, 'column': 'old'}, None))
+
     def test_revert_action_wrong_action(self):
         self.instance.action = 'WRONG'
 
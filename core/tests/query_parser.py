@@ -0,0 +1,49 @@
+from django.test import TestCase
+
+from core.exceptions import QueryParseError
+from core.query_parser import compile_query, MAX_QUERY_DEPTH
+
+COLUMNS = ['species', 'color', 'height', 'red deer']
+
+
+class CompileQueryTestCase(TestCase):
+
+    def test_logical_query(self):
+        self.assertEqual(compile_query('or(species=deer, and(species=bear, color=black))', COLUMNS),
+                         {'$or': [{'species': 'deer'}, {'$and': [{'species': 'bear'}, {'color': 'black'}]}]})
+        self.assertEqual(compile_query('species=deer, color=brown', COLUMNS),
+                         {'$and': [{'species': 'deer'}, {'color': 'brown'}]})
+
+    def test_comparison_operators(self):
+        self.assertEqual(compile_query('and(height>=1.5, height<2, color!=black, species^=de.)', COLUMNS),
+                         {'$and': [{'height': {'$gte': 1.5}}, {'height': {'$lt': 2.0}}, {'color': {'$ne': 'black'}},
+                                   {'species': {'$regex': r'^de\.'}}]})
+        self.assertEqual(compile_query('species in (deer, "bear, brown", 12)', COLUMNS),
+                         {'species': {'$in': ['deer', 'bear, brown', 12.0]}})
+
+    def test_fields_and_values(self):
+        """
+        Tests if bare text keeps inner whitespace and operator characters and quoted values aren't cast
+        """
+        self.assertEqual(compile_query('red deer = a=b', COLUMNS), {'red deer': 'a=b'})
+        self.assertEqual(compile_query('"red deer" in ("1", 1)', COLUMNS), {'red deer': {'$in': ['1', 1.0]}})
+
+    def test_invalid_fields_are_dropped(self):
+        self.assertEqual(compile_query('or(unknown=1, and(species))', COLUMNS), {})
+        self.assertEqual(compile_query('or(unknown=1, species=deer)', COLUMNS), {'$or': [{'species': 'deer'}]})
+
+    def test_syntax_errors(self):
+        for query in ['and(species=deer', 'species=deer)', 'xor(species=deer)', 'species=(deer)',
+                      'and(,)', 'species in (deer']:
+            with self.subTest(query=query), self.assertRaises(QueryParseError):
+                compile_query(query, COLUMNS)
+
+    def test_depth_limit(self):
+        query = 'and(' * MAX_QUERY_DEPTH + 'species=deer' + ')' * MAX_QUERY_DEPTH
+        self.assertEqual(compile_query(query, COLUMNS), {'species': 'deer'})
+        with self.assertRaises(QueryParseError):
+            compile_query('and(' + query + ')', COLUMNS)
+
+    def test_compiled_query_is_copied(self):
+        compile_query('species=deer', COLUMNS)['species'] = 'bear'
+        self.assertEqual(compile_query('species=deer', COLUMNS), {'species': 'deer'})
@@ -0,0 +1,62 @@
+import pandas as pd
+from django.test import TestCase
+
+from core.query_parser import compile_query
+from core.schema import SchemaInference, cast_value
+
+
+class SchemaInferenceTestCase(TestCase):
+
+    def test_infer_types(self):
+        schema_inference = SchemaInference()
+        schema_inference.update(pd.DataFrame({
+            'int': [1, 2],
+            'bool': [True, None],
+            'date': ['01/02/2020', '03/04/2020'],
+            'datetime': ['2020-01-01T10:00:00.000Z', None],
+            'text': ['2020-01-01', 'deer'],
+            'empty': [None, None],
+        }))
+        schema_inference.update(pd.DataFrame({
+            'int': [1.5, None],
+            'bool': [False, True],
+            'date': ['13/02/2020', None],
+            'datetime': [None, None],
+            'text': ['bear', 'boar'],
+            'empty': [None, None],
+        }))
+
+        self.assertEqual(schema_inference.schema, {
+            'int': {'type': 'float', 'nullable': True},
+            'bool': {'type': 'boolean', 'nullable': True},
+            'date': {'type': 'date', 'nullable': True, 'format': '%d/%m/%Y'},
+            'datetime': {'type': 'datetime', 'nullable': True, 'format': '%Y-%m-%dT%H:%M:%S.%fZ'},
+            'text': {'type': 'string', 'nullable': False},
+            'empty': {'type': 'string', 'nullable': True},
+        })
+
+    def test_mixed_types(self):
+        schema_inference = SchemaInference()
+        schema_inference.update(pd.DataFrame({'mixed': [1, 2]}))
+        schema_inference.update(pd.DataFrame({'mixed': ['deer', 'bear']}))
+        self.assertEqual(schema_inference.schema['mixed']['type'], 'mixed')
+
+
+class CastValueTestCase(TestCase):
+
+    def test_cast_value(self):
+        self.assertEqual(cast_value('-1.5', {'type': 'float'}), -1.5)
+        self.assertEqual(cast_value('2', {'type': 'integer'}), 2)
+        self.assertEqual(cast_value('deer', {'type': 'integer'}), 'deer')
+        self.assertEqual(cast_value('True', {'type': 'boolean'}), True)
+        self.assertEqual(cast_value('1', {'type': 'string'}), '1')
+        self.assertEqual(cast_value('2020-02-13', {'type': 'date', 'format': '%d.%m.%Y'}), '13.02.2020')
+        self.assertEqual(cast_value('2020-01-01T10:00:00+01:00', {'type': 'datetime',
+                                                                  'format': '%Y-%m-%dT%H:%M:%S.%fZ'}),
+                         '2020-01-01T09:00:00.000Z')
+        self.assertEqual(cast_value('1.5', None), 1.5)
+
+    def test_compile_query_with_schema(self):
+        schema = {'height': {'type': 'integer'}, 'name': {'type': 'string'}}
+        self.assertEqual(compile_query('and(height>=-2, name in (1, deer), height="3")', ['height', 'name'], schema),
+                         {'$and': [{'height': {'$gte': -2}}, {'name': {'$in': ['1', 'deer']}}, {'height': '3'}]})
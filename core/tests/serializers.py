@@ -1,10 +1,17 @@
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
-from django.test import TestCase
-from requests import ConnectionError
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
 from rest_framework.exceptions import ValidationError
 
-from core.serializers import DatatableSerializer, DatatableExportSerializer
+from core.models import Datatable, DatatableAction, JobStatus
+from core.serializers import DatatableSerializer, DatatableExportSerializer, DatatableRowsReadOnlySerializer, \
+    DatatableRowsBatchSerializer
+from core.tests.factories.models import DatatableFactory, UserFactory
+from core.tests.mocks import FakeDataverse
 
 
 class DatatableSerializerTestCase(TestCase):
@@ -19,57 +26,163 @@ class DatatableSerializerTestCase(TestCase):
         with self.assertRaises(ValidationError):
             self.serializer.validate_file(file)
 
+    @override_settings(DATATABLE_UPLOAD_ENCODING='cp1250')
+    def test_validate_file_encoding(self):
+        content = 'gatunek;liczebność\nżubr;1\n'
+        file = SimpleUploadedFile('deer.csv', content.encode('cp1250'), content_type='text/csv')
+        self.assertIs(self.serializer.validate_file(file), file)
+        self.assertEqual(file.file.read(), content.encode('cp1250'))
 
-class DatatableExportSerializerTestCase(TestCase):
-    def setUp(self):
-        super().setUp()
-        self.serializer = DatatableExportSerializer()
-        self.serializer.client = MagicMock()
-        self.serializer.instance = MagicMock()
-
-    def test_validate_dataset_pid(self):
-        self.serializer.client.status = 'OK'
-        self.serializer.client.get_dataset.return_value = {'Title': 'Dataset'}
-        pid = self.serializer.validate_dataset_pid('dataset_pid')
-        self.assertEqual(pid, 'dataset_pid')
-
-    def test_validate_dataset_pid_wrong_pid(self):
-        self.serializer.client.status = 'ERROR'
-        with self.assertRaises(ValidationError):
-            self.serializer.validate_dataset_pid('wrong_pid')
+        with override_settings(DATATABLE_UPLOAD_ENCODING='utf-8'), self.assertRaises(ValidationError):
+            self.serializer.validate_file(file)
 
-    def test_validate_dataset_pid_dataverse_connection_error(self):
-        self.serializer.client.status = 'OK'
-        self.serializer.client.get_dataset.side_effect = ConnectionError()
 
-        with self.assertRaises(ValidationError):
-            self.serializer.validate_dataset_pid('dataset_pid')
-
-    def test_validate_dataset_pid_missing_dataset(self):
-        self.serializer.client.status = 'OK'
-        self.serializer.client.get_dataset.return_value = {}
-        with self.assertRaises(ValidationError):
-            self.serializer.validate_dataset_pid('dataset_pid')
+class DatatableExportSerializerTestCase(TestCase):
 
     def test_export(self):
-        self.serializer.instance.title = 'Title'
-        self.serializer.instance.columns = {'col_1': '', 'col_2': ''}
-        self.serializer._validated_data = {'dataset_pid': 'pid'}
+        datatable = DatatableFactory(title='Deer observations')
+        serializer = DatatableExportSerializer(datatable, data={'dataset_pid': 'pid', 'compress': True})
+        self.assertTrue(serializer.is_valid(), msg=serializer.errors)
 
-        mocked_response = MagicMock()
-        mocked_response.status_code = 200
-        mocked_response.content = b'{"status":"OK", "message":"Test message"}'
+        job = serializer.export({'species': 'deer'}, [('height', -1)], ['species'])
 
-        self.serializer.client.post_request.return_value = mocked_response
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.PENDING.value)
+        self.assertEqual((job.datatable, job.dataset_pid, job.compress), (datatable, 'pid', True))
+        self.assertEqual((job.query, job.ordering, job.columns), ({'species': 'deer'}, [['height', -1]], ['species']))
+        self.assertTrue(job.file_name.startswith('deer-observations-') and job.file_name.endswith('.csv.gz'))
 
-        result = self.serializer.export([{'col_1': '1', 'col_2': '2'}])
-        self.assertEqual(result['status'], 200)
-
-        mocked_response.status_code = 400
-        mocked_response.content = b'{"status":"ERROR", "message":"Test message"}'
-        mocked_response.encoding = 'utf-8'
-        self.serializer.client.post_request.return_value = mocked_response
-        result = self.serializer.export([{'col_1': '1', 'col_2': '2'}])
-
-        self.assertEqual(result['status'], 400)
-        self.assertEqual(result['content'], {'dataset_pid': ['Test message']})
+    def test_validate_dataset_pid(self):
+        serializer = DatatableExportSerializer(DatatableFactory(), data={})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('dataset_pid', serializer.errors)
+
+        with FakeDataverse(datasets=['pid'], forbidden=['secret_pid']) as dataverse, \
+                override_settings(DATAVERSE_URL=dataverse.url):
+            self.assertTrue(DatatableExportSerializer(DatatableFactory(), data={'dataset_pid': 'pid'}).is_valid())
+            # rejected request isn't reported as missing dataset, export job retries or reports the error
+            self.assertTrue(DatatableExportSerializer(DatatableFactory(), data={'dataset_pid': 'secret_pid'}).is_valid())
+            serializer = DatatableExportSerializer(DatatableFactory(), data={'dataset_pid': 'missing_pid'})
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(serializer.errors['dataset_pid'], ['Dataset doesn\'t exist in Dataverse.'])
+
+        # export is queued when Dataverse can't be reached, its job retries
+        with override_settings(DATAVERSE_URL=dataverse.url, DATAVERSE_TIMEOUT=1):
+            self.assertTrue(DatatableExportSerializer(DatatableFactory(), data={'dataset_pid': 'other'}).is_valid())
+
+
+class DatatableRowsReadOnlySerializerTestCase(TestCase):
+
+    def test_serialize_rows(self):
+        """
+        Tests if values become strings, missing values become empty strings and falsy values are kept
+        """
+        row_id = ObjectId()
+        rows = [{'_id': row_id, 'str': 'deer', 'int': 0, 'float': 0.0, 'bool': False, 'none': None, 'empty': ''}]
+        expected = {'_id': str(row_id), 'str': 'deer', 'int': '0', 'float': '0.0', 'bool': 'False', 'none': '',
+                    'empty': ''}
+
+        self.assertEqual(DatatableRowsReadOnlySerializer(rows, many=True).data, [expected])
+        self.assertEqual(DatatableRowsReadOnlySerializer(rows[0]).data, expected)
+
+
+class DatatableRowsBatchSerializerTestCase(TestCase):
+
+    def test_write_failed(self):
+        """
+        Tests if operations after failed write are skipped and only written ones are saved to history
+        """
+        datatable = DatatableFactory(columns=['species'])
+        datatable.client = MagicMock()
+        datatable.client.get_rows.return_value = []
+        datatable.client.bulk_write.side_effect = BulkWriteError({'writeErrors': [{'index': 1, 'errmsg': 'E11000'}]})
+
+        request = MagicMock()
+        request.user = UserFactory()
+        operations = [{'op': 'create', 'row': {'species': 'deer'}}] * 3
+        serializer = DatatableRowsBatchSerializer(datatable, data={'operations': operations}, context={'request': request})
+        self.assertTrue(serializer.is_valid(), msg=serializer.errors)
+        results = serializer.write()
+
+        self.assertEqual([result['status'] for result in results], ['created', 'failed', 'skipped'])
+        self.assertEqual(results[1]['error'], 'E11000')
+        self.assertEqual(DatatableAction.objects.filter(datatable=datatable).count(), 1)
+
+    def write(self, datatable, operations) -> list:
+        request = MagicMock()
+        request.user = UserFactory()
+        serializer = DatatableRowsBatchSerializer(datatable, data={'operations': operations}, context={'request': request})
+        self.assertTrue(serializer.is_valid(), msg=serializer.errors)
+        return [result['status'] for result in serializer.write()]
+
+    def test_write_conflict(self):
+        """
+        Tests if values changed or rows deleted after they were fetched aren't overwritten, while changes of other
+        columns don't conflict
+        """
+        datatable = DatatableFactory(columns=['species', 'count'])
+        row_ids = [str(datatable.client.add_row({'species': species}).inserted_id) for species in ('deer', 'boar', 'wolf')]
+        get_rows = datatable.client.get_rows
+
+        def get_rows_changed_concurrently(*args, **kwargs):
+            rows = list(get_rows(*args, **kwargs))
+            datatable.client.patch_row(row_ids[0], {'count': '1'})
+            datatable.client.delete_row(row_ids[1])
+            datatable.client.patch_row(row_ids[2], {'count': '1'})
+            return rows
+
+        datatable.client.get_rows = get_rows_changed_concurrently
+        statuses = self.write(datatable, [{'op': 'patch', '_id': row_ids[1], 'row': {'species': 'pig'}},
+                                          {'op': 'create', 'row': {'species': 'bear'}},
+                                          {'op': 'patch', '_id': row_ids[0], 'row': {'count': '2'}},
+                                          {'op': 'create', 'row': {'species': 'lynx'}},
+                                          {'op': 'patch', '_id': row_ids[0], 'row': {'species': 'elk'}},
+                                          {'op': 'patch', '_id': row_ids[2], 'row': {'species': 'fox'}},
+                                          {'op': 'delete', '_id': row_ids[2]}])
+        datatable.client.get_rows = get_rows
+
+        self.assertEqual(statuses, ['conflict', 'created', 'conflict', 'created', 'conflict', 'updated', 'deleted'])
+        rows = list(datatable.client.get_rows({}, {'_id': False}))
+        self.assertEqual(rows, [{'species': 'deer', 'count': '1'}, {'species': 'bear'}, {'species': 'lynx'}])
+        actions = DatatableAction.objects.filter(datatable=datatable).order_by('id')
+        self.assertEqual([action.action for action in actions], ['CREATE', 'CREATE', 'UPDATE', 'DELETE'])
+        self.assertEqual(actions[3].get_rows()[0], {'_id': row_ids[2], 'species': 'fox', 'count': '1'})
+
+    def test_write_unset_column(self):
+        datatable = DatatableFactory(columns=['species', 'count'])
+        row_id = str(datatable.client.add_row({'species': 'deer', 'count': '1'}).inserted_id)
+
+        statuses = self.write(datatable, [{'op': 'patch', '_id': row_id, 'row': {'count': None}},
+                                          {'op': 'create', 'row': {'species': 'bear', 'count': None}}])
+
+        self.assertEqual(statuses, ['updated', 'created'])
+        self.assertEqual(list(datatable.client.get_rows({}, {'_id': False})), [{'species': 'deer'}, {'species': 'bear'}])
+        action = DatatableAction.objects.filter(datatable=datatable, action='UPDATE').get()
+        self.assertEqual(action.get_rows(), ({'_id': row_id, 'count': '1'}, {'_id': row_id}))
+
+    def test_write_history_failed(self):
+        """
+        Tests if written rows are reverted when history can't be saved
+        """
+        datatable = DatatableFactory(columns=['species'])
+        row_id = str(datatable.client.add_row({'species': 'deer'}).inserted_id)
+
+        with patch.object(Datatable, 'register_actions', side_effect=DatabaseError()):
+            with self.assertRaises(DatabaseError):
+                self.write(datatable, [{'op': 'create', 'row': {'species': 'bear'}},
+                                       {'op': 'patch', '_id': row_id, 'row': {'species': 'boar'}}])
+
+        self.assertEqual(list(datatable.client.get_rows({}, {'_id': False})), [{'species': 'deer'}])
+
+    def test_write_history_and_revert_failed(self):
+        """
+        Tests if failed revert of rows written without history is logged and original error is raised
+        """
+        datatable = DatatableFactory(columns=['species'])
+        datatable.client.bulk_write = MagicMock(side_effect=[None, BulkWriteError({'writeErrors': []})])
+
+        with patch.object(Datatable, 'register_actions', side_effect=DatabaseError()), \
+                self.assertLogs('core.serializers.datatable_rows', 'ERROR'):
+            with self.assertRaises(DatabaseError):
+                self.write(datatable, [{'op': 'create', 'row': {'species': 'bear'}}])
+        self.assertEqual(datatable.client.bulk_write.call_count, 2)
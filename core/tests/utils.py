@@ -1,7 +1,22 @@
+from base64 import urlsafe_b64encode
+from unittest.mock import MagicMock, patch
+from urllib.parse import urlparse, parse_qs
+
+import pymongo
+from bson import ObjectId, Regex, json_util
 from django.conf import settings
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from pymongo.errors import PyMongoError
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 
-from core.tests.factories.models import UserFactory
+from core.counts import RowCounter
+from core.indexing import IndexManager, get_index_keys
+from core.mongo import MongoClientRegistry, get_update
+from core.paginators import MongoCursorKeysetPagination, MongoCursorLimitOffsetPagination, BSON_TYPE_BRACKETS
+from core.tests.factories.models import UserFactory, DatatableFactory
 
 
 class UtilsTestCase(TestCase):
@@ -12,3 +27,222 @@ class UtilsTestCase(TestCase):
         user.groups.clear()
         user.save()
         self.assertFalse(user.groups.filter(name=settings.READONLY_GROUP_NAME))
+
+    def test_get_update(self):
+        self.assertEqual(get_update({'a': '1'}, ['b']), {'$set': {'a': '1'}, '$unset': {'b': ''}})
+        self.assertEqual(get_update({}, ['b']), {'$unset': {'b': ''}})
+        self.assertEqual(get_update({}), {})
+
+
+class MongoClientRegistryTestCase(TestCase):
+    def setUp(self):
+        self.client_class = MagicMock()
+        self.registry = MongoClientRegistry(client_class=self.client_class)
+
+    def test_get_client_is_shared(self):
+        client = self.registry.get_client()
+
+        self.assertIs(client, self.registry.get_client())
+        self.client_class.assert_called_once()
+        self.assertFalse(self.client_class.call_args[1]['connect'])
+
+    @override_settings(MONGO_MAX_POOL_SIZE=5, MONGO_COMPRESSORS='zlib')
+    def test_get_client_options(self):
+        self.registry.get_client()
+
+        options = self.client_class.call_args[1]
+        self.assertEqual(options['maxPoolSize'], 5)
+        self.assertEqual(options['compressors'], 'zlib')
+
+    def test_get_client_after_fork(self):
+        self.registry.get_client()
+        with patch('core.registry.os.getpid', return_value=-1):
+            self.registry.get_client()
+
+        self.assertEqual(self.client_class.call_count, 2)
+
+    def test_warm_up(self):
+        self.assertTrue(self.registry.warm_up())
+        self.client_class.return_value.admin.command.assert_called_once_with('ping')
+
+        self.client_class.return_value.admin.command.side_effect = PyMongoError()
+        self.assertFalse(self.registry.warm_up())
+
+
+class MongoCursorLimitOffsetPaginationTestCase(TestCase):
+    def test_get_window(self):
+        for params, window in (({}, (0, None)), ({'offset': 2, 'limit': 5}, (2, 5)), ({'offset': 'x', 'limit': 0}, (0, 100))):
+            request = Request(APIRequestFactory().get('/datatable/1/', params))
+            self.assertEqual(MongoCursorLimitOffsetPagination.get_window(request), window)
+
+
+class MongoCursorKeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        self.datatable = DatatableFactory(columns=['value', 'name'])
+        self.datatable.client.collection.insert_many([
+            {'value': 2, 'name': 'b'},
+            {'value': 'text', 'name': 'c'},
+            {'value': None, 'name': 'd'},
+            {'name': 'e'},
+            {'value': 1.5, 'name': 'f'},
+            {'value': 2, 'name': 'a'},
+            {'value': True, 'name': 'g'},
+            {'value': 'abc', 'name': 'h'},
+        ])
+
+    def tearDown(self):
+        self.datatable.client.collection.drop()
+
+    def paginate(self, ordering, params):
+        request = Request(APIRequestFactory().get('/datatable/1/', params))
+        paginator = MongoCursorKeysetPagination()
+        page = paginator.paginate_rows(self.datatable.client, {}, ordering, request)
+        return paginator, [row['name'] for row in page]
+
+    def walk(self, ordering, limit):
+        """
+        Follows next links to the last page and previous links back to the first page
+        """
+        paginator, names = self.paginate(ordering, {'pagination': 'cursor', 'limit': limit})
+        forward = [names]
+        while paginator.get_next_link():
+            paginator, names = self.paginate(ordering, parse_qs(urlparse(paginator.get_next_link()).query))
+            forward.append(names)
+
+        backward = [names]
+        while paginator.get_previous_link():
+            paginator, names = self.paginate(ordering, parse_qs(urlparse(paginator.get_previous_link()).query))
+            backward.append(names)
+        return forward, backward[::-1]
+
+    def test_pages_follow_sort_order(self):
+        """
+        Tests if pages of mixed type column are in the same order as sorted cursor, in both directions
+        """
+        for direction in (pymongo.ASCENDING, pymongo.DESCENDING):
+            ordering = [('value', direction)]
+            expected = [row['name'] for row in self.datatable.client.get_rows().sort(ordering + [('_id', 1)])]
+
+            forward, backward = self.walk(ordering, limit=3)
+
+            self.assertEqual([name for page in forward for name in page], expected)
+            self.assertTrue(all(len(page) == 3 for page in forward[:-1]))
+            self.assertEqual([name for page in backward for name in page], expected)
+
+    def test_multi_column_ordering(self):
+        forward, _ = self.walk([('value', pymongo.DESCENDING), ('name', pymongo.ASCENDING)], limit=2)
+
+        self.assertEqual([name for page in forward for name in page], ['g', 'c', 'h', 'a', 'b', 'f', 'd', 'e'])
+
+    def test_get_seek_query(self):
+        row_id = ObjectId()
+        query = MongoCursorKeysetPagination.get_seek_query([('value', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)],
+                                                           [1, row_id])
+
+        self.assertEqual(query, {'$or': [{'value': {'$gt': 1}},
+                                         {'value': {'$type': [bson_type for types in BSON_TYPE_BRACKETS[2:]
+                                                              for bson_type in types]}},
+                                         {'value': {'$eq': 1}, '_id': {'$gt': row_id}}]})
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(NotFound):
+            self.paginate([('value', pymongo.ASCENDING)], {'cursor': 'invalid'})
+
+    def test_forged_cursor(self):
+        ordering = [('value', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]
+        for value in ({'$ne': None}, {'$where': 'sleep(1000)'}, Regex('(a+)+$'), [1]):
+            cursor = {'p': [value, ObjectId()], 'r': False, 'i': True, 'o': [list(field) for field in ordering]}
+            encoded = urlsafe_b64encode(json_util.dumps(cursor).encode('utf-8')).decode('ascii')
+            with self.assertRaises(NotFound):
+                self.paginate(ordering, {'cursor': encoded})
+
+    def test_cursor_of_other_ordering(self):
+        paginator, _ = self.paginate([('value', pymongo.ASCENDING)], {'limit': 1})
+        params = parse_qs(urlparse(paginator.get_next_link()).query)
+
+        with self.assertRaises(NotFound):
+            self.paginate([('name', pymongo.ASCENDING)], params)
+
+
+class RowCounterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.datatable = DatatableFactory(columns=['name'])
+        self.datatable.client.collection.insert_many([{'name': 'deer'}, {'name': 'deer'}, {'name': 'bear'}])
+
+    def tearDown(self):
+        self.datatable.client.collection.drop()
+
+    def test_count_unfiltered(self):
+        with patch.object(type(self.datatable.client.collection), 'estimated_document_count', return_value=42):
+            self.assertEqual(RowCounter(self.datatable, mode=RowCounter.CAPPED, cap=2).count(), (42, True))
+
+    def test_count_filtered_is_cached(self):
+        with patch.object(self.datatable.client, 'count_rows', wraps=self.datatable.client.count_rows) as count_rows:
+            self.assertEqual(RowCounter(self.datatable, {'name': 'deer'}).count().value, 2)
+            self.assertEqual(RowCounter(self.datatable, {'name': 'deer'}).count().value, 2)
+            count_rows.assert_called_once()
+
+            self.datatable.bump_revision()
+            RowCounter(self.datatable, {'name': 'deer'}).count()
+            self.assertEqual(count_rows.call_count, 2)
+
+    def test_count_capped(self):
+        row_count = RowCounter(self.datatable, {'name': {'$ne': None}}, mode=RowCounter.CAPPED, cap=2).count()
+        self.assertEqual((row_count.value, row_count.exact, str(row_count)), (2, False, '2+'))
+
+        row_count = RowCounter(self.datatable, {'name': 'deer'}, mode=RowCounter.CAPPED, cap=2).count()
+        self.assertEqual((row_count.value, row_count.exact, str(row_count)), (2, True, '2'))
+
+        row_count = RowCounter(self.datatable, {'name': {'$ne': None}}, mode=RowCounter.CAPPED, cap=2).count(3)
+        self.assertTrue(row_count.exact)
+
+
+class IndexManagerTestCase(TestCase):
+    def setUp(self):
+        self.datatable = DatatableFactory(columns=['name', 'age', 'height'])
+        self.datatable.client.collection.insert_one({'name': 'deer', 'age': 1, 'height': 2})
+        self.index_manager = IndexManager(self.datatable)
+
+    def tearDown(self):
+        self.datatable.client.collection.drop()
+        self.index_manager.usage_collection.drop()
+
+    def test_get_index_keys(self):
+        """
+        Tests if index keys put equality fields first, sorted fields next and range fields last
+        """
+        self.assertEqual(get_index_keys({}, [('_id', pymongo.ASCENDING)]), [])
+        self.assertEqual(get_index_keys({'height': {'$gt': 1}, 'name': 'deer'}, [('age', pymongo.DESCENDING)]),
+                         [[('name', 1), ('age', -1), ('height', 1)]])
+        self.assertEqual(get_index_keys({'$or': [{'name': 'deer'}, {'$and': [{'age': 1}, {'name': 'bear'}]}]}, []),
+                         [[('name', 1)], [('age', 1), ('name', 1)]])
+
+    def test_sync(self):
+        """
+        Tests if most used keys are indexed within budget and unused automatic indexes are dropped
+        """
+        for _ in range(4):
+            self.index_manager.record_usage({'name': 'deer'}, [('age', pymongo.ASCENDING)])
+        for _ in range(2):
+            self.index_manager.record_usage({'height': 1}, [])
+        self.index_manager.record_usage({'age': 1}, [])
+
+        created, dropped = self.index_manager.sync(budget=1, min_hits=2)
+        self.assertEqual((created, dropped), ([IndexManager.get_index_name([('name', 1), ('age', 1)])], []))
+        self.assertEqual(self.datatable.client.collection.index_information()[created[0]]['key'],
+                         [('name', 1), ('age', 1)])
+
+        # usage decayed below min_hits
+        self.assertEqual(self.index_manager.sync(budget=1, min_hits=4), ([], created))
+        self.assertEqual(self.index_manager.get_usage()[0]['hits'], 1)
+
+    def test_sync_skips_indexed_keys(self):
+        """
+        Tests if keys served by manually created index aren't indexed again
+        """
+        self.datatable.client.collection.create_index([('name', pymongo.DESCENDING), ('age', pymongo.DESCENDING)])
+        self.index_manager.record_usage({'name': 'deer'}, [])
+        self.index_manager.record_usage({'unknown': 'deer'}, [])
+
+        self.assertEqual(self.index_manager.sync(min_hits=1), ([], []))
@@ -1,16 +1,28 @@
+import csv
+import gzip
+import json
 import os
+import tempfile
+import zlib
+from datetime import timedelta
 from io import BytesIO
 from unittest.mock import Mock, patch, MagicMock
 
+from bson import ObjectId
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
+from pymongo.errors import BulkWriteError
 from requests import Response
 from rest_framework.test import APITestCase
 
 import core
-from core.models import Datatable, DatatableAction
+from core.jobs import JobWorker
+from core.streaming import DOWNLOAD_FORMATS
+from core.models import Datatable, DatatableAction, ExportJob, JobStatus
 from core.tests.factories.models import DatatableFactory, DatatableActionFactory, UserFactory
 
 User = get_user_model()
@@ -50,6 +62,20 @@ class DatatableViewSetTestCase(APITestCase):
         self.assertEqual(1, response.data['count'])
         self.assertEqual(response.status_code, 200, msg=response.data)
 
+    @override_settings(DATATABLE_COUNT_CAP=1)
+    def test_retrieve_capped_count(self):
+        url = reverse('datatable-detail', kwargs={'pk': self.datatable.pk})
+        response = self.client.get(url, data={'int_col': 1, 'count': 'capped'})
+        self.assertEqual(1, response.data['count'])
+
+        response = self.client.get(url, data={'str_col': 'str', 'count': 'capped'})
+        self.assertEqual(0, response.data['count'])
+
+        response = self.client.get(url, data={'logical_query': 'or(int_col=1, int_col=2)', 'count': 'capped',
+                                              'limit': 1})
+        self.assertEqual('1+', response.data['count'])
+        self.assertTrue(response.data['next'])
+
     def test_retrieve_logical_query(self):
         url = reverse('datatable-detail', kwargs={'pk': self.datatable.pk})
         response = self.client.get(url, data={'logical_query': 'and(str_col=str_1, int_col=1)'})
@@ -62,6 +88,94 @@ class DatatableViewSetTestCase(APITestCase):
         self.assertEqual(2, response.data['count'])
         self.assertEqual(response.status_code, 200, msg=response.data)
 
+    def test_retrieve_comparison_query(self):
+        url = reverse('datatable-detail', kwargs={'pk': self.datatable.pk})
+        response = self.client.get(url, data={'logical_query': 'or(int_col>1, str_col in (str_1, str_3))'})
+        self.assertEqual(2, response.data['count'])
+
+        response = self.client.get(url, data={'logical_query': 'and(int_col>1'})
+        self.assertEqual(response.status_code, 400, msg=response.data)
+        self.assertIn('logical_query', response.data)
+
+    def test_retrieve_fields(self):
+        url = reverse('datatable-detail', kwargs={'pk': self.datatable.pk})
+        response = self.client.get(url, data={'fields': 'int_col,wrong_param,int_col'})
+        self.assertEqual([set(row) for row in response.data['results']], [{'_id', 'int_col'}] * 2)
+
+        response = self.client.get(url, data={'fields': 'wrong_param'})
+        self.assertEqual(set(response.data['results'][0]), {'_id', 'str_col', 'int_col'})
+
+    def test_retrieve_fields_cursor_pagination(self):
+        """
+        Tests if sorted columns that weren't requested are used for cursors, but not returned
+        """
+        url = reverse('datatable-detail', kwargs={'pk': self.datatable.pk})
+        response = self.client.get(url, data={'fields': 'str_col', 'ordering': '-int_col', 'pagination': 'cursor',
+                                              'limit': 1})
+        self.assertEqual(response.data['results'][0]['str_col'], 'str_2')
+        self.assertEqual(set(response.data['results'][0]), {'_id', 'str_col'})
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['str_col'] for row in response.data['results']], ['str_1'])
+
+    def test_retrieve_ndjson(self):
+        url = reverse('datatable-detail', kwargs={'pk': self.datatable.pk})
+        response = self.client.get(url, data={'ordering': '-int_col', 'offset': 1}, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(row['str_col'], row['int_col']) for row in rows], [('str_1', '1')])
+
+        response = self.client.get(url, data={'logical_query': 'and(int_col>1'}, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'logical_query', response.content)
+
+    @override_settings(DATATABLE_STREAM_BATCH_SIZE=1)
+    def test_retrieve_stream(self):
+        url = reverse('datatable-detail', kwargs={'pk': self.datatable.pk})
+        response = self.client.get(url, data={'stream': 1, 'fields': 'str_col'})
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['columns'], ['str_col', 'int_col'])
+        self.assertEqual([row['str_col'] for row in data['results']], ['str_1', 'str_2'])
+        self.assertEqual(set(data['results'][0]), {'_id', 'str_col'})
+
+        response = self.client.get(url, data={'stream': 1, 'limit': 1})
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))['results']), 1)
+
+    @override_settings(DATATABLE_STREAM_BATCH_SIZE=1)
+    def test_download(self):
+        url = reverse('datatable-download', kwargs={'pk': self.datatable.pk})
+        response = self.client.get(url, data={'ordering': '-int_col'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('.csv"', response['Content-Disposition'])
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+        self.assertEqual(rows[0], ['_id', 'str_col', 'int_col'])
+        self.assertEqual([row[1:] for row in rows[1:]], [['str_2', '2'], ['str_1', '1']])
+
+        response = self.client.get(url, data={'file_format': 'csv.gz', 'fields': 'int_col', 'int_col': 1})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        content = gzip.decompress(b''.join(response.streaming_content)).decode('utf-8')
+        self.assertEqual([row[1:] for row in csv.reader(content.splitlines())], [['int_col'], ['1']])
+
+        response = self.client.get(url, data={'file_format': 'xlsx'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file_format', response.data)
+
+    def test_download_parquet(self):
+        if 'parquet' not in DOWNLOAD_FORMATS:
+            self.skipTest('pyarrow isn\'t installed')
+        import pyarrow.parquet as pq
+
+        url = reverse('datatable-download', kwargs={'pk': self.datatable.pk})
+        response = self.client.get(url, data={'file_format': 'parquet', 'ordering': 'int_col'})
+        self.assertEqual(response.status_code, 200)
+        table = pq.read_table(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.column_names, ['_id', 'str_col', 'int_col'])
+        self.assertEqual(table.column('int_col').to_pylist(), [1, 2])
+
     def test_retrieve_ordering(self):
         url = reverse('datatable-detail', kwargs={'pk': self.datatable.pk})
         response = self.client.get(url, data={'ordering': '-int_col,wrong_param'})
@@ -74,12 +188,42 @@ class DatatableViewSetTestCase(APITestCase):
         self.assertEqual('1', response.data['results'][0]['int_col'])
         self.assertEqual(response.status_code, 200, msg=response.data)
 
+    def test_indexes(self):
+        url = reverse('datatable-indexes', kwargs={'pk': self.datatable.pk})
+        self.client.get(reverse('datatable-detail', kwargs={'pk': self.datatable.pk}), data={'str_col': 'str_1'})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403, msg=response.data)
+
+        self.client.force_authenticate(UserFactory(is_superuser=True))
+        with patch.object(type(self.datatable.client.collection), 'aggregate',
+                          return_value=[{'name': '_id_', 'accesses': {'ops': 3, 'since': None}}]):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, msg=response.data)
+        self.assertEqual([(index['name'], index['ops']) for index in response.data['indexes']], [('_id_', 3)])
+        self.assertEqual([(usage['keys'], usage['hits']) for usage in response.data['usage']],
+                         [([('str_col', 1)], 1)])
+
     def test_retrieve_pagination(self):
         url = reverse('datatable-detail', kwargs={'pk': self.datatable.pk})
         response = self.client.get(url, data={'limit': 1})
         self.assertEqual(1, len(response.data['results']))
         self.assertEqual(response.status_code, 200, msg=response.data)
 
+    def test_retrieve_cursor_pagination(self):
+        url = reverse('datatable-detail', kwargs={'pk': self.datatable.pk})
+        response = self.client.get(url, data={'pagination': 'cursor', 'limit': 1, 'ordering': '-int_col'})
+        self.assertEqual(response.status_code, 200, msg=response.data)
+        self.assertEqual('2', response.data['results'][0]['int_col'])
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, 200, msg=response.data)
+        self.assertEqual('1', response.data['results'][0]['int_col'])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(response.data['columns'], self.datatable.columns)
+
     def test_retrieve_pagination_wrong_offset(self):
         url = reverse('datatable-detail', kwargs={'pk': self.datatable.pk})
         response = self.client.get(url, data={'offset': 3})
@@ -94,7 +238,22 @@ class DatatableViewSetTestCase(APITestCase):
 
         new_count = len(list(self.datatable.client.get_rows()))
         self.assertEqual(count + 1, new_count)
+        self.assertEqual(response.status_code, 201, msg=response.data)
+        self.datatable.refresh_from_db()
+        self.assertEqual(response.data['revision'], self.datatable.revision)
+        self.assertEqual(response.data['row']['str_col'], 'str3')
+        self.assertTrue(self.datatable.client.has_row(response.data['row']['_id']))
+
+        response = self.client.post(f'{url}?response=id', data={'str_col': 'str4'})
+        self.assertEqual(set(response.data['row']), {'_id'})
+
+        response = self.client.post(f'{url}?response=page&limit=1', data={'str_col': 'str5'})
         self.assertEqual(response.status_code, 200, msg=response.data)
+        self.assertEqual((response.data['count'], len(response.data['results'])), (new_count + 2, 1))
+
+        response = self.client.post(f'{url}?response=table', data={'str_col': 'str6'})
+        self.assertEqual(response.status_code, 400, msg=response.data)
+        self.assertEqual(len(list(self.datatable.client.get_rows())), new_count + 2)
 
     def test_disallow_adding_empty_row(self):
         url = reverse('datatable-add-row', kwargs={'pk': self.datatable.pk})
@@ -117,34 +276,138 @@ class DatatableViewSetTestCase(APITestCase):
         self.assertEqual(count - 1, new_count)
         self.assertEqual(response.status_code, 204, msg=response.data)
 
+    def test_batch_rows(self):
+        rows = list(self.datatable.client.get_rows().sort('int_col'))
+        revision = self.datatable.revision
+        url = reverse('datatable-rows-batch', kwargs={'pk': self.datatable.pk})
+        response = self.client.post(url, data={'operations': [
+            {'op': 'create', 'row': {'str_col': 'str_3', 'int_col': 3, 'unknown': 'ignored'}},
+            {'op': 'patch', '_id': str(rows[0]['_id']), 'row': {'int_col': '10'}},
+            {'op': 'delete', '_id': str(rows[0]['_id'])},
+            {'op': 'patch', '_id': str(rows[0]['_id']), 'row': {'int_col': '11'}},
+            {'op': 'delete', '_id': str(rows[1]['_id'])},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200, msg=response.data)
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['created', 'updated', 'deleted', 'not_found', 'deleted'])
+        self.assertEqual(response.data['revision'], revision + 1)
+
+        new_rows = list(self.datatable.client.get_rows({}, {'_id': False}))
+        self.assertEqual(new_rows, [{'str_col': 'str_3', 'int_col': '3'}])
+
+        actions = DatatableAction.objects.filter(datatable=self.datatable).order_by('pk')
+        self.assertEqual([action.action for action in actions], ['CREATE', 'UPDATE', 'DELETE', 'DELETE'])
+        self.assertEqual(actions[2].old_row['int_col'], '10')
+
+        response = self.client.post(url, data={'operations': [
+            {'op': 'patch', '_id': 'wrong', 'row': {'int_col': '1'}},
+            {'op': 'create', 'row': {'unknown': '1'}},
+            {'op': 'upsert'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400, msg=response.data)
+        self.assertEqual(set(response.data['operations']), {0, 1, 2})
+
+        with override_settings(DATATABLE_BATCH_MAX_OPERATIONS=1):
+            response = self.client.post(url, data={'operations': [{'op': 'delete', '_id': self.binary_id}] * 2},
+                                        format='json')
+        self.assertEqual(response.status_code, 400, msg=response.data)
+
     def test_patch_row(self):
         rows = list(self.datatable.client.get_rows())
         row = rows[0]
 
         url = reverse('datatable-row', kwargs={'pk': self.datatable.pk,
                                                'row_id': row['_id']})
-        self.client.patch(url, data={'int_col': 15})
+        response = self.client.patch(url, data={'int_col': 15})
 
         new_row = self.datatable.client.get_rows({'_id': row['_id']})[0]
 
         self.assertEqual(new_row['int_col'], '15')
+        self.assertEqual(response.data['row'], {'_id': str(row['_id']), 'str_col': row['str_col'], 'int_col': '15'})
 
-    @patch('core.views.DatatableViewSet.get_serializer')
-    def test_export_endpoint(self, mock_get_serializer):
-        mock_serializer = MagicMock()
-        mock_serializer.is_valid.return_value = True
-
-        mock_response = {
-            'status': 200,
-            'content': BytesIO(b'Test')
-        }
+        action = DatatableAction.objects.filter(datatable=self.datatable).first()
+        self.assertEqual(action.old_row, {'_id': str(row['_id']), 'int_col': row['int_col']})
+        self.assertEqual(action.new_row, {'_id': str(row['_id']), 'int_col': '15'})
 
-        mock_serializer.export.return_value = mock_response
-        mock_get_serializer.return_value = mock_serializer
+        url = reverse('datatable-row', kwargs={'pk': self.datatable.pk, 'row_id': 'invalid'})
+        response = self.client.patch(url, data={'int_col': 15})
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(DATATABLE_HISTORY_COMPRESSION=True)
+    def test_patch_row_compressed_history(self):
+        row = self.datatable.client.get_rows({'str_col': 'str_1'})[0]
+        url = reverse('datatable-row', kwargs={'pk': self.datatable.pk, 'row_id': row['_id']})
+        self.client.patch(url, data={'str_col': 'edited'})
+
+        action = DatatableAction.objects.filter(datatable=self.datatable).first()
+        self.assertIsNone(action.old_row)
+
+        with patch('core.models.datatable_action.zlib.decompress', wraps=zlib.decompress) as decompress:
+            response = self.client.get(reverse('datatableaction-list'), data={'datatable': self.datatable.pk})
+        self.assertEqual(response.data['results'][0]['old_row'], {'_id': str(row['_id']), 'str_col': 'str_1'})
+        self.assertEqual(decompress.call_count, 1)
+        self.assertNotIn('compressed_rows', response.data['results'][0])
+
+        self.client.post(reverse('datatableaction-revert', kwargs={'pk': action.pk}))
+        self.assertEqual(self.datatable.client.get_rows({'_id': row['_id']})[0], row)
+
+    def test_revert_patch_of_missing_column(self):
+        row_id = str(self.datatable.client.add_row({'str_col': 'str_3'}).inserted_id)
+        url = reverse('datatable-row', kwargs={'pk': self.datatable.pk, 'row_id': row_id})
+        self.client.patch(url, data={'int_col': 3})
+
+        action = DatatableAction.objects.filter(datatable=self.datatable).first()
+        self.assertEqual(action.old_row, {'_id': row_id})
+        response = self.client.post(reverse('datatableaction-revert', kwargs={'pk': action.pk}))
+        self.assertEqual(response.status_code, 200, msg=response.data)
+        self.assertEqual(self.datatable.client.get_rows({'_id': ObjectId(row_id)}, {'_id': False})[0],
+                         {'str_col': 'str_3'})
+
+    def test_patch_row_unset_column(self):
+        """
+        Tests if column set to null is removed from row and restored when action is reverted
+        """
+        row_id = str(self.datatable.client.add_row({'str_col': 'str_3', 'int_col': '3'}).inserted_id)
+        url = reverse('datatable-row', kwargs={'pk': self.datatable.pk, 'row_id': row_id})
+        response = self.client.patch(url, data={'str_col': 'str_4', 'int_col': None}, format='json')
+        self.assertEqual(response.status_code, 200, msg=response.data)
+        self.assertEqual(response.data['row'], {'_id': row_id, 'str_col': 'str_4'})
+        self.assertEqual(self.datatable.client.get_rows({'_id': ObjectId(row_id)}, {'_id': False})[0],
+                         {'str_col': 'str_4'})
+
+        action = DatatableAction.objects.filter(datatable=self.datatable).first()
+        self.assertEqual((action.old_row, action.new_row), ({'_id': row_id, 'str_col': 'str_3', 'int_col': '3'},
+                                                            {'_id': row_id, 'str_col': 'str_4'}))
+        response = self.client.post(reverse('datatableaction-revert', kwargs={'pk': action.pk}))
+        self.assertEqual(response.status_code, 200, msg=response.data)
+        self.assertEqual(self.datatable.client.get_rows({'_id': ObjectId(row_id)}, {'_id': False})[0],
+                         {'str_col': 'str_3', 'int_col': '3'})
 
+    def test_export_endpoint(self):
         url = reverse('datatable-export', kwargs={'pk': self.datatable.pk})
-        response = self.client.post(url, data={'dataset_pid': 1})
+        response = self.client.post(f'{url}?fields=int_col&int_col=1&ordering=-str_col', data={'dataset_pid': 'pid'})
+        self.assertEqual(response.status_code, 202, msg=response.data)
+        self.assertEqual(response.data['status'], JobStatus.PENDING.value)
+
+        job = ExportJob.objects.get(pk=response.data['id'])
+        self.assertEqual((job.query, job.ordering, job.columns), ({'int_col': 1}, [['str_col', -1]], ['int_col']))
+
+        response = self.client.get(response['Location'])
         self.assertEqual(response.status_code, 200, msg=response.data)
+        self.assertEqual((response.data['dataset_pid'], response.data['bytes_sent']), ('pid', 0))
+
+        response = self.client.post(url, data={})
+        self.assertEqual(response.status_code, 400, msg=response.data)
+
+    def test_export_metrics(self):
+        url = reverse('exportjob-metrics')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(UserFactory(is_superuser=True))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {'pid', 'clients', 'status', 'dataset'})
 
     def test_action_no_row(self):
         url = reverse('datatable-row', kwargs={'pk': self.datatable.pk,
@@ -161,12 +424,44 @@ class DatatableViewSetTestCase(APITestCase):
         url = reverse('datatable-list')
 
         self_path = os.path.dirname(core.__file__)
-        with open(os.path.join(self_path, 'tests/data_samples/csv.csv'), 'rb') as csv_file:
-            response = self.client.post(url, data={'title': 'TestDatatable',
-                                                   'collection_name': 'TestDatatable',
-                                                   'file': csv_file}, format='multipart')
+        with tempfile.TemporaryDirectory() as media_path, self.settings(INGESTION_MEDIA_PATH=media_path):
+            with open(os.path.join(self_path, 'tests/data_samples/csv.csv'), 'rb') as csv_file:
+                response = self.client.post(url, data={'title': 'TestDatatable',
+                                                       'collection_name': 'TestDatatable',
+                                                       'file': csv_file}, format='multipart')
 
-            self.assertEqual(response.status_code, 201, msg=response.data)
+            self.assertEqual(response.status_code, 202, msg=response.data)
+            self.assertEqual(response.data['status'], JobStatus.PENDING.value)
+            self.assertTrue(response['Location'].endswith(reverse('ingestionjob-detail',
+                                                                  kwargs={'pk': response.data['id']})))
+
+            JobWorker(processes=0).run(once=True)
+
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.status_code, 200, msg=response.data)
+        self.assertEqual(response.data['status'], JobStatus.DONE.value)
+        self.assertEqual(response.data['rows_processed'], 2)
+        self.assertEqual(Datatable.objects.get(collection_name='TestDatatable').columns,
+                         self.datatable.columns)
+
+    def test_upload_corrupted_file(self):
+        url = reverse('datatable-list')
+
+        self_path = os.path.dirname(core.__file__)
+        with tempfile.TemporaryDirectory() as media_path, self.settings(INGESTION_MEDIA_PATH=media_path):
+            with open(os.path.join(self_path, 'tests/data_samples/corrupted.csv'), 'rb') as csv_file:
+                response = self.client.post(url, data={'title': 'CorruptedFile',
+                                                       'collection_name': 'CorruptedFile',
+                                                       'file': csv_file}, format='multipart')
+            self.assertEqual(response.status_code, 202, msg=response.data)
+
+            JobWorker(processes=0).run(once=True)
+
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.data['status'], JobStatus.FAILED.value)
+        self.assertIn('corrupted', response.data['error'])
+        self.assertIsNone(response.data['datatable'])
+        self.assertFalse(Datatable.objects.filter(collection_name='CorruptedFile').exists())
 
     def test_upload_unsupported_file(self):
         url = reverse('datatable-list')
@@ -211,4 +506,64 @@ class DatatableActionViewSetTestCase(APITestCase):
         self.client.force_authenticate(self.user)
         url = reverse('datatableaction-revert', kwargs={'pk': self.datatable_reverted_action.pk})
         response = self.client.post(url)
-        self.assertEqual(response.status_code, 400, msg=response.data)
\ No newline at end of file
+        self.assertEqual(response.status_code, 400, msg=response.data)
+
+    def test_revert_many(self):
+        self.client.force_authenticate(self.user)
+        datatable = DatatableFactory()
+        row_ids = ['0123456789ab0123456789a0', '0123456789ab0123456789a1', '0123456789ab0123456789a2']
+        datatable.client.add_row({'column_0': 'v3'}, row_id=row_ids[0])
+        datatable.client.add_row({'column_0': 'new'}, row_id=row_ids[1])
+
+        now = timezone.now()
+        actions = [
+            ('UPDATE', {'_id': row_ids[0], 'column_0': 'v1'}, {'_id': row_ids[0], 'column_0': 'v2'}, 3),
+            ('UPDATE', {'_id': row_ids[0], 'column_0': 'v2'}, {'_id': row_ids[0], 'column_0': 'v3'}, 2),
+            ('DELETE', {'_id': row_ids[2], 'column_0': 'deleted'}, None, 2),
+            ('CREATE', None, {'_id': row_ids[1], 'column_0': 'new'}, 1),
+        ]
+        for action, old_row, new_row, minutes_ago in actions:
+            instance = DatatableActionFactory(datatable=datatable, action=action, old_row=old_row, new_row=new_row,
+                                              user=self.user)
+            DatatableAction.objects.filter(pk=instance.pk).update(created_at=now - timedelta(minutes=minutes_ago))
+
+        url = reverse('datatableaction-revert-many')
+        response = self.client.post(url, data={'datatable': datatable.pk, 'at': now - timedelta(minutes=2.5),
+                                               'user': self.user.pk})
+        self.assertEqual(response.status_code, 400, msg=response.data)
+
+        response = self.client.post(url, data={'datatable': datatable.pk, 'at': now - timedelta(minutes=2.5)})
+        self.assertEqual(response.status_code, 200, msg=response.data)
+        self.assertEqual(response.data['reverted'], 3)
+        rows = {str(row['_id']): row['column_0'] for row in datatable.client.get_rows()}
+        self.assertEqual(rows, {row_ids[0]: 'v2', row_ids[2]: 'deleted'})
+
+        response = self.client.post(url, data={'datatable': datatable.pk, 'user': self.user.pk})
+        self.assertEqual(response.data['reverted'], 1)
+        rows = {str(row['_id']): row['column_0'] for row in datatable.client.get_rows()}
+        self.assertEqual(rows, {row_ids[0]: 'v1', row_ids[2]: 'deleted'})
+        self.assertFalse(DatatableAction.objects.filter(datatable=datatable, reverted=False).exists())
+
+    def test_revert_many_failed(self):
+        """
+        Tests if actions reverted by writes before failed one are marked as reverted and their number is reported
+        """
+        self.client.force_authenticate(self.user)
+        datatable = DatatableFactory()
+        now = timezone.now()
+        for minutes_ago in (3, 2, 1):
+            instance = DatatableActionFactory(datatable=datatable, action='CREATE', new_row={'_id': str(ObjectId())},
+                                              user=self.user)
+            DatatableAction.objects.filter(pk=instance.pk).update(created_at=now - timedelta(minutes=minutes_ago))
+        # update with nothing to revert has no write request
+        row_id = str(ObjectId())
+        newest = DatatableActionFactory(datatable=datatable, action='UPDATE', old_row={'_id': row_id},
+                                        new_row={'_id': row_id}, user=self.user)
+        error = BulkWriteError({'writeErrors': [{'index': 0, 'errmsg': 'E11000'}]})
+
+        with patch.object(core.models.datatable.DatatableMongoClient, 'bulk_write', side_effect=error):
+            response = self.client.post(reverse('datatableaction-revert-many'), data={'datatable': datatable.pk})
+
+        self.assertEqual(response.status_code, 409, msg=response.data)
+        self.assertEqual(response.data['reverted'], 1)
+        self.assertEqual(list(DatatableAction.objects.filter(datatable=datatable, reverted=True)), [newest])
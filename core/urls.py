@@ -6,6 +6,8 @@ from core import views
 
 router = routers.DefaultRouter()
 router.register('history', views.DatatableActionViewSet)
+router.register('jobs', views.IngestionJobViewSet)
+router.register('export-jobs', views.ExportJobViewSet)
 router.register('', views.DatatableViewSet)
 
 urlpatterns = [
@@ -1,2 +1,3 @@
 from .datatable import *
 from .datatable_action import *
+from .job import *
@@ -1,14 +1,22 @@
 from dry_rest_permissions.generics import DRYPermissions
 from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
+from slugify import slugify
 
-from core.filters import RowOrdering, RowFiltering
+from core.counts import RowCounter
+from core.filters import RowOrdering, RowFiltering, RowProjection
+from core.indexing import IndexManager
 from core.mixins import MultiSerializerMixin
 from core.models import Datatable
-from core.paginators import MongoCursorLimitOffsetPagination
+from core.paginators import MongoCursorLimitOffsetPagination, MongoCursorKeysetPagination
+from core.streaming import DOWNLOAD_FORMATS, NDJSONRenderer, stream_file, stream_rows
 from core.serializers import DatatableSerializer, DatatableReadOnlySerializer, DatatableRowsReadOnlySerializer, \
-    DatatableRowsSerializer, DatatableExportSerializer
+    DatatableRowsSerializer, DatatableRowsBatchSerializer, DatatableExportSerializer, IngestionJobReadOnlySerializer, \
+    ExportJobReadOnlySerializer
 
 
 class DatatableViewSet(MultiSerializerMixin,
@@ -22,45 +30,109 @@ class DatatableViewSet(MultiSerializerMixin,
         'add_row': DatatableRowsSerializer,
         'patch_row': DatatableRowsSerializer,
         'delete_row': DatatableRowsSerializer,
+        'batch_rows': DatatableRowsBatchSerializer,
         'export': DatatableExportSerializer,
     }
     queryset = Datatable.objects.all()
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
+    count_mode_param = 'count'
+    stream_param = 'stream'
+    file_format_param = 'file_format'
+    write_response_param = 'response'
+    write_response_modes = ('row', 'id', 'page')
+
+    def create(self, request, *args, **kwargs):
+        """
+        Creates datatable and queues upload of its file. Progress of upload is reported by returned job.
+
+        .. http:post:: /datatable/
+
+            :param title: Datatable title
+            :param file: `csv` or `excel` tabular file
+            :param optional collection_name: unique name of table to be created in DB to store Datatable rows,
+                    if not supplied collection_name will be slugified title
+            :reqheader Authorization: optional Bearer (JWT) token to authenticate
+            :reqheader Content-Type: multipart/form-data
+            :resheader Location: URL of upload job, see :http:get:`/datatable/jobs/(int:job_id)/`
+            :statuscode 202: datatable created, file upload queued
+            :statuscode 400: collection_name isn't unique or file is of unsupported type
+            :statuscode 401: user unauthorized
+            :statuscode 403: user lacks permissions for this action
+
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        job = serializer.ingestion_job
+        location = reverse('ingestionjob-detail', kwargs={'pk': job.pk}, request=request)
+        return Response(IngestionJobReadOnlySerializer(job).data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': location})
 
     def retrieve(self, request, pk=None, **kwargs):
         """
-        Retrieves rows of selected datatable, and list of columns for this datatable
+        Retrieves rows of selected datatable, and list of columns and their schema for this datatable. Filtered
+        values are cast to types of columns.
 
         .. http:get:: /datatable/(int:datatable_id)/
 
             :query $column_name: value of specified column
                     eg.: ``?species=deer``
-            :query logical_query: nested query build with ``and, or`` operators
-                    eg.: ``?logical_query=or(species=deer, and(species=bear, color=black))``
+            :query logical_query: nested query build with ``and, or`` operators and ``=, !=, >, >=, <, <=``,
+                    ``^=`` (prefix) and ``in`` comparisons, values with special characters can be quoted
+                    eg.: ``?logical_query=or(species=deer, and(species in (bear, boar), height>=1.5))``
             :query ordering: coma separated **$column_name** values, prefixed with '-' to sort descending
                     eg.: ``?ordering=species,-height``
+            :query fields: coma separated **$column_name** values of columns to be returned, rows have also ``_id``.
+                    All columns are returned by default eg.: ``?fields=species,height``
             :query offset: offset number. default is 0
             :query limit: limit number. default is 100
+            :query count: ``exact`` to count all matching rows or ``capped`` to stop counting at 10000 rows
+                    (``count`` is then eg.: ``"10000+"``). Default is set by ``DATATABLE_COUNT_MODE`` setting
+            :query pagination: ``cursor`` to page with ``next`` and ``previous`` links instead of offset, which
+                    costs the same for every page. Response has no ``count``
+            :query cursor: opaque position of a page, taken from ``next`` or ``previous`` link
+            :query stream: ``1`` to stream rows as they are fetched, as ``{"columns": [...], "results": [...]}``.
+                    Streamed response has no ``count`` nor links, ``limit`` is optional and without it all rows are
+                    returned
             :reqheader Authorization: optional Bearer (JWT) token to authenticate
+            :reqheader Accept: ``application/x-ndjson`` to stream rows as newline delimited JSON, one row per line
+                    (like ``stream=1``)
             :statuscode 200: no error
+            :statuscode 400: logical query is invalid
             :statuscode 401: user unauthorized
             :statuscode 403: user lacks permissions for this action
             :statuscode 404: there's no specified datatable
+            :statuscode 404: cursor is invalid
 
         """
-        pagination_class = MongoCursorLimitOffsetPagination()
         instance = self.get_object()
-
-        row_filter = RowFiltering(instance.columns)
-        mongo_cursor = row_filter.filter_cursor(request, instance.client)
-
-        ordering_filter = RowOrdering(instance.columns)
-        mongo_cursor = ordering_filter.order_cursor(request, mongo_cursor)
-
-        page = pagination_class.paginate_queryset(mongo_cursor, request)
+        query = RowFiltering(instance.columns, instance.schema).get_query(request)
+        ordering = RowOrdering(instance.columns).get_ordering(request)
+        projection = RowProjection(instance.columns).get_projection(request)
+        IndexManager(instance).record_usage(query, ordering)
+
+        ndjson = request.accepted_renderer.format == NDJSONRenderer.format
+        if ndjson or request.query_params.get(self.stream_param) in ('1', 'true'):
+            offset, limit = MongoCursorLimitOffsetPagination.get_window(request)
+            mongo_cursor = instance.client.get_rows(query, projection).sort(ordering).skip(offset)
+            if limit is not None:
+                mongo_cursor = mongo_cursor.limit(limit)
+            return stream_rows(mongo_cursor, instance.columns, ndjson=ndjson)
+
+        if MongoCursorKeysetPagination.is_requested(request):
+            pagination_class = MongoCursorKeysetPagination()
+            page = pagination_class.paginate_rows(instance.client, query, ordering, request, projection)
+        else:
+            pagination_class = MongoCursorLimitOffsetPagination(
+                RowCounter(instance, query, mode=request.query_params.get(self.count_mode_param)))
+            mongo_cursor = instance.client.get_rows(query, projection).sort(ordering)
+            page = pagination_class.paginate_queryset(mongo_cursor, request)
 
         serializer = self.get_serializer(page, many=True)
         response = pagination_class.get_paginated_response(serializer.data)
         response.data['columns'] = instance.columns
+        response.data['schema'] = instance.schema
 
         return response
 
@@ -72,9 +144,13 @@ class DatatableViewSet(MultiSerializerMixin,
         .. http:post:: /datatable/(int:datatable_id)/row/
 
             :param $column_name: value of specified column
+            :query response: ``row`` (default) returns added row, ``id`` only its ``_id``, both with revision of
+                    datatable, ``page`` returns first page of datatable rows like :http:get:`/datatable/(int:datatable_id)/`
+            :>json row: added row
+            :>json revision: revision of datatable after write
             :reqheader Authorization: optional Bearer (JWT) token to authenticate
             :statuscode 201: row added
-            :statuscode 400: new row has to have at least one of existing columns
+            :statuscode 400: new row has to have at least one of existing columns or response is unsupported
             :statuscode 401: user unauthorized
             :statuscode 403: user lacks permissions for this action
             :statuscode 404: there's no specified datatable
@@ -82,17 +158,12 @@ class DatatableViewSet(MultiSerializerMixin,
         """
 
         instance = self.get_object()
+        response_mode = self.get_write_response_mode(request)
         serializer = self.get_serializer(instance, data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.add_row()
-
-        mongo_cursor = instance.client.get_rows()
+        row = serializer.add_row()
 
-        pagination_class = MongoCursorLimitOffsetPagination()
-        page = pagination_class.paginate_queryset(mongo_cursor, request)
-
-        serializer = DatatableRowsReadOnlySerializer(page, many=True)
-        return pagination_class.get_paginated_response(serializer.data)
+        return self.get_write_response(request, instance, row, response_mode, status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['PATCH'], url_path='row/(?P<row_id>[^/.]+)', url_name='row')
     def patch_row(self, request, pk=None, row_id=None, **kwargs):
@@ -101,10 +172,14 @@ class DatatableViewSet(MultiSerializerMixin,
 
         .. http:post:: /datatable/(int:datatable_id)/row/(row_id)/
 
-            :param $column_name: value of specified column
+            :param $column_name: value of specified column, ``null`` removes column from row
+            :query response: ``row`` (default) returns updated row, ``id`` only its ``_id``, both with revision of
+                    datatable, ``page`` returns first page of datatable rows like :http:get:`/datatable/(int:datatable_id)/`
+            :>json row: updated row
+            :>json revision: revision of datatable after write
             :reqheader Authorization: optional Bearer (JWT) token to authenticate
-            :statuscode 201: row updated
-            :statuscode 400: updated row has to have at least one of existing columns
+            :statuscode 200: row updated
+            :statuscode 400: updated row has to have at least one of existing columns or response is unsupported
             :statuscode 401: user unauthorized
             :statuscode 403: user lacks permissions for this action
             :statuscode 404: there's no specified row
@@ -112,14 +187,14 @@ class DatatableViewSet(MultiSerializerMixin,
 
         """
         instance = self.get_object()
-        if not instance.client.has_row(row_id):
-            return Response(data={'row_id': 'Not Found'}, status=status.HTTP_404_NOT_FOUND)
-
+        response_mode = self.get_write_response_mode(request)
         serializer = self.get_serializer(instance, data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.patch_row(row_id)
+        row = serializer.patch_row(row_id)
+        if row is None:
+            return Response(data={'row_id': 'Not Found'}, status=status.HTTP_404_NOT_FOUND)
 
-        return Response(status=status.HTTP_200_OK)
+        return self.get_write_response(request, instance, row, response_mode, status.HTTP_200_OK)
 
     @patch_row.mapping.delete
     def delete_row(self, request, pk=None, row_id=None, **kwargs):
@@ -138,52 +213,183 @@ class DatatableViewSet(MultiSerializerMixin,
 
         """
         instance = self.get_object()
-        if not instance.client.has_row(row_id):
-            return Response(data={'row_id': 'Not Found'}, status=status.HTTP_404_NOT_FOUND)
-
         serializer = self.get_serializer(instance)
-        serializer.delete_row(row_id)
+        if serializer.delete_row(row_id) is None:
+            return Response(data={'row_id': 'Not Found'}, status=status.HTTP_404_NOT_FOUND)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=True, methods=['POST'], url_path='rows/batch', url_name='rows-batch')
+    def batch_rows(self, request, pk=None, **kwargs):
+        """
+        Creates, patches and deletes many rows of selected datatable at once. Operations are written in order and
+        saved to history with a single query. Operations on missing rows are skipped. If patched values of a row were
+        changed or it was deleted by someone else since it was read (conflict), following operations on that row
+        aren't written. If an operation fails, following ones aren't written.
+
+        .. http:post:: /datatable/(int:datatable_id)/rows/batch/
+
+            :<json operations: list of operations, ``{"op": "create", "row": {"$column_name": "value"}}``,
+                    ``{"op": "patch", "_id": "row_id", "row": {"$column_name": "value"}}`` (``null`` value removes column) or
+                    ``{"op": "delete", "_id": "row_id"}``
+            :>json results: result of every operation, with its ``op``, ``_id`` and ``status``: ``created``,
+                    ``updated``, ``deleted``, ``not_found``, ``conflict``, ``failed`` (with ``error``) or ``skipped``
+            :>json revision: revision of datatable after write
+            :reqheader Authorization: optional Bearer (JWT) token to authenticate
+            :reqheader Content-Type: application/json
+            :statuscode 200: operations processed
+            :statuscode 400: operation is invalid or there are too many operations
+            :statuscode 401: user unauthorized
+            :statuscode 403: user lacks permissions for this action
+            :statuscode 404: there's no specified datatable
+
+        """
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.write()
+        return Response({'results': results, 'revision': instance.revision})
+
+    def get_write_response_mode(self, request) -> str:
+        """
+        Gets requested form of row write response
+
+        :param request: request of row write
+        :return: one of ``write_response_modes``, ``row`` by default
+        :raises ValidationError: when requested form is unsupported
+        """
+        response_mode = request.query_params.get(self.write_response_param, 'row')
+        if response_mode not in self.write_response_modes:
+            raise ValidationError({self.write_response_param: f'Unsupported response. Supported responses are: '
+                                                              f'{", ".join(self.write_response_modes)}'})
+        return response_mode
+
+    def get_write_response(self, request, instance: Datatable, row: dict, response_mode: str,
+                           status_code: int) -> Response:
+        """
+        Builds response of row write. Only ``page`` mode queries datatable again, counting and fetching its first page.
+
+        :param request: request of row write
+        :param instance: datatable row was written to
+        :param row: written row
+        :param response_mode: one of ``write_response_modes``
+        :param status_code: status of ``row`` and ``id`` responses
+        :return: response with written row or its id and revision of datatable, or first page of rows
+        """
+        if response_mode == 'page':
+            pagination_class = MongoCursorLimitOffsetPagination(RowCounter(instance))
+            page = pagination_class.paginate_queryset(instance.client.get_rows(), request)
+            serializer = DatatableRowsReadOnlySerializer(page, many=True)
+            return pagination_class.get_paginated_response(serializer.data)
+
+        data = DatatableRowsReadOnlySerializer(row).data if response_mode == 'row' else {'_id': str(row['_id'])}
+        return Response({'row': data, 'revision': instance.revision}, status=status_code)
+
     @action(detail=True, methods=['POST'])
     def export(self, request, pk=None, **kwargs):
         """
-        Exports filtered (or not) Datatable to Dataverse as tabular datafile
+        Queues export of filtered (or not) Datatable to Dataverse as tabular datafile. Progress of export is
+        reported by returned job, rows are streamed to Dataverse by background worker without storing file on disk.
 
         .. http:post:: /datatable/(int:datatable_id)/export/
 
             :query $column_name: value of specified column
                     eg.: ``?species=deer``
-            :query logical_query: nested query build with ``and, or`` operators
-                    eg.: ``?logical_query=or(species=deer, and(species=bear, color=black))``
+            :query logical_query: nested query build with ``and, or`` operators and ``=, !=, >, >=, <, <=``,
+                    ``^=`` (prefix) and ``in`` comparisons, values with special characters can be quoted
+                    eg.: ``?logical_query=or(species=deer, and(species in (bear, boar), height>=1.5))``
+            :query ordering: coma separated **$column_name** values, prefixed with '-' to sort descending
+                    eg.: ``?ordering=species,-height``
+            :query fields: coma separated **$column_name** values of columns to be returned, rows have also ``_id``.
+                    All columns are returned by default eg.: ``?fields=species,height``
+            :param dataset_pid: pid of Dataverse dataset
+            :param optional compress: ``true`` to upload gzip compressed file (``.csv.gz``), default is ``false``
+            :reqheader Authorization: optional Bearer (JWT) token to authenticate
+            :resheader Location: URL of export job, see :http:get:`/datatable/export-jobs/(int:job_id)/`
+            :statuscode 202: export queued
+            :statuscode 400: dataset pid is missing or logical query is invalid
+            :statuscode 401: user unauthorized
+            :statuscode 403: user lacks permissions for this action
+            :statuscode 404: there's no specified datatable
+
+        """
+        instance = self.get_object()
+        query = RowFiltering(instance.columns, instance.schema).get_query(request)
+        ordering = RowOrdering(instance.columns).get_ordering(request)
+        fields = RowProjection(instance.columns).get_fields(request)
+
+        serializer = self.get_serializer(instance, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = serializer.export(query, ordering, fields)
+        IndexManager(instance).record_usage(query, ordering)
+
+        location = reverse('exportjob-detail', kwargs={'pk': job.pk}, request=request)
+        return Response(ExportJobReadOnlySerializer(job).data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': location})
+
+    @action(detail=True, methods=['GET'])
+    def download(self, request, pk=None, **kwargs):
+        """
+        Downloads filtered (or not) rows of selected datatable as a file. File is streamed as rows are fetched, so
+        memory use doesn't depend on number of rows.
+
+        .. http:get:: /datatable/(int:datatable_id)/download/
+
+            :query $column_name: value of specified column
+                    eg.: ``?species=deer``
+            :query logical_query: nested query build with ``and, or`` operators and ``=, !=, >, >=, <, <=``,
+                    ``^=`` (prefix) and ``in`` comparisons, values with special characters can be quoted
+                    eg.: ``?logical_query=or(species=deer, and(species in (bear, boar), height>=1.5))``
             :query ordering: coma separated **$column_name** values, prefixed with '-' to sort descending
                     eg.: ``?ordering=species,-height``
-            :param dataset_id: pid of Dataverse dataset
-            :reqheader Accept: the response content type depends on
-                              :mailheader:`Accept` header
-            :reqheader Authorization: optional OAuth token to authenticate
-            :resheader Content-Type: this depends on :mailheader:`Accept`
-                                    header of request
+            :query fields: coma separated **$column_name** values of columns to be downloaded, rows have also
+                    ``_id``. All columns are downloaded by default eg.: ``?fields=species,height``
+            :query file_format: ``csv`` (default), ``csv.gz`` (gzip compressed CSV) or ``parquet`` (requires
+                    ``pyarrow``). Parquet file keeps integer, float and boolean columns of datatable schema
+            :reqheader Authorization: optional Bearer (JWT) token to authenticate
+            :resheader Content-Disposition: attachment with name of file, eg.: ``attachment; filename="deer.csv"``
             :statuscode 200: no error
-            :statuscode 400: there's no connection to Dataverse
-            :statuscode 400: there's no Dataset in Dataverse
+            :statuscode 400: logical query or file format is invalid
             :statuscode 401: user unauthorized
             :statuscode 403: user lacks permissions for this action
-            :statuscode 404: there's no user
+            :statuscode 404: there's no specified datatable
 
         """
         instance = self.get_object()
+        file_format = request.query_params.get(self.file_format_param, 'csv')
+        if file_format not in DOWNLOAD_FORMATS:
+            raise ValidationError({self.file_format_param: f'Unsupported file format. Supported formats are: '
+                                                           f'{", ".join(DOWNLOAD_FORMATS)}'})
+
+        query = RowFiltering(instance.columns, instance.schema).get_query(request)
+        ordering = RowOrdering(instance.columns).get_ordering(request)
+        row_projection = RowProjection(instance.columns)
+        fields = row_projection.get_fields(request)
+        projection = row_projection.get_projection(request)
+        IndexManager(instance).record_usage(query, ordering)
+
+        mongo_cursor = instance.client.get_rows(query, projection).sort(ordering)
+        return stream_file(mongo_cursor, ['_id', *(fields or instance.columns)], instance.schema, file_format,
+                           slugify(instance.title) or instance.collection_name)
+
+    @action(detail=True, methods=['GET'])
+    def indexes(self, request, pk=None, **kwargs):
+        """
+        Lists indexes of selected datatable with their usage, and recorded usage of filtered and sorted columns that
+        automatic indexes are built from. Available to superusers only.
 
-        row_filter = RowFiltering(instance.columns)
-        mongo_cursor = row_filter.filter_cursor(request, instance.client)
+        .. http:get:: /datatable/(int:datatable_id)/indexes/
 
-        ordering_filter = RowOrdering(instance.columns)
-        mongo_cursor = ordering_filter.order_cursor(request, mongo_cursor)
+            :reqheader Authorization: optional Bearer (JWT) token to authenticate
+            :statuscode 200: no error
+            :statuscode 401: user unauthorized
+            :statuscode 403: user lacks permissions for this action
+            :statuscode 404: there's no specified datatable
 
-        serializer = self.get_serializer(instance, data=request.data)
-        serializer.is_valid(raise_exception=True)
-        export_response = serializer.export(mongo_cursor)
-        return Response(export_response['content'],
-                        status=status.HTTP_200_OK if export_response['status'] == 200
-                        else status.HTTP_400_BAD_REQUEST)
+        """
+        instance = self.get_object()
+        index_manager = IndexManager(instance)
+        return Response({
+            'indexes': index_manager.get_index_stats(),
+            'usage': index_manager.get_usage(),
+        })
@@ -1,19 +1,25 @@
 from django_filters.rest_framework import DjangoFilterBackend
 from dry_rest_permissions.generics import DRYPermissions
+from pymongo.errors import BulkWriteError
 from rest_framework import status, mixins
 from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
+from core.mixins import MultiSerializerMixin
 from core.models import DatatableAction
-from core.serializers import DatatableActionReadOnlySerializer
+from core.serializers import DatatableActionReadOnlySerializer, DatatableActionRevertSerializer
 
 
-class DatatableActionViewSet(mixins.ListModelMixin,
+class DatatableActionViewSet(MultiSerializerMixin,
+                             mixins.ListModelMixin,
                              GenericViewSet):
     queryset = DatatableAction.objects.all()
-    serializer_class = DatatableActionReadOnlySerializer
+    serializers = {
+        'default': DatatableActionReadOnlySerializer,
+        'revert_many': DatatableActionRevertSerializer,
+    }
     permission_classes = (DRYPermissions,)
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filter_fields = ['datatable', 'action', 'user', 'reverted']
@@ -41,3 +47,41 @@ class DatatableActionViewSet(mixins.ListModelMixin,
         instance.revert_action()
 
         return Response(status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['POST'], url_path='revert', url_name='revert-many')
+    def revert_many(self, request, **kwargs):
+        """
+        Reverts many Datatable actions from history at once: actions of datatable matching filters, or all actions
+        committed after given time. Rows are written with single bulk write, newest action first. If a write fails,
+        actions reverted by writes before it are still marked as reverted.
+
+        .. http:post:: /datatable/history/revert/
+
+            :<json datatable: id of datatable
+            :<json user: optional id of user actions were committed by
+            :<json since: optional time actions were committed since, eg.: ``2020-06-01T12:00:00Z``
+            :<json until: optional time actions were committed until
+            :<json at: optional time datatable should be restored to, all later actions are reverted, can't be
+                    combined with ``user``, ``since`` and ``until``
+            :>json reverted: number of reverted actions
+            :>json revision: revision of datatable after revert
+            :reqheader Authorization: optional Bearer (JWT) token to authenticate
+            :statuscode 200: no error
+            :statuscode 400: filters are invalid
+            :statuscode 401: user unauthorized
+            :statuscode 403: user lacks permissions for this action
+            :statuscode 409: one of writes failed, ``reverted`` actions before it were reverted
+
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        datatable = serializer.validated_data['datatable']
+        try:
+            reverted = serializer.revert()
+        except BulkWriteError as error:
+            write_error = error.details['writeErrors'][0]
+            return Response({'non_field_errors': f'Action can\'t be reverted: {write_error["errmsg"]}',
+                             'reverted': write_error['index'], 'revision': datatable.revision},
+                            status=status.HTTP_409_CONFLICT)
+
+        return Response({'reverted': reverted, 'revision': datatable.revision}, status=status.HTTP_200_OK)
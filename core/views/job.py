@@ -0,0 +1,65 @@
+from django_filters.rest_framework import DjangoFilterBackend
+from dry_rest_permissions.generics import DRYPermissions
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from core.dataverse import dataverse_clients
+from core.models import IngestionJob, ExportJob
+from core.serializers import IngestionJobReadOnlySerializer, ExportJobReadOnlySerializer
+
+
+class IngestionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Progress of datatable uploads
+
+    .. http:get:: /datatable/jobs/(int:job_id)/
+
+        :reqheader Authorization: optional Bearer (JWT) token to authenticate
+        :statuscode 200: no error
+        :statuscode 401: user unauthorized
+        :statuscode 403: user lacks permissions for this action
+        :statuscode 404: there's no specified job
+
+    """
+    queryset = IngestionJob.objects.all()
+    serializer_class = IngestionJobReadOnlySerializer
+    permission_classes = (DRYPermissions,)
+    filter_backends = [DjangoFilterBackend]
+    filter_fields = ['datatable', 'status']
+
+
+class ExportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Progress of datatable exports to Dataverse
+
+    .. http:get:: /datatable/export-jobs/(int:job_id)/
+
+        :reqheader Authorization: optional Bearer (JWT) token to authenticate
+        :statuscode 200: no error
+        :statuscode 401: user unauthorized
+        :statuscode 403: user lacks permissions for this action
+        :statuscode 404: there's no specified job
+
+    """
+    queryset = ExportJob.objects.all()
+    serializer_class = ExportJobReadOnlySerializer
+    permission_classes = (DRYPermissions,)
+    filter_backends = [DjangoFilterBackend]
+    filter_fields = ['datatable', 'status']
+
+    @action(detail=False, methods=['GET'])
+    def metrics(self, request, **kwargs):
+        """
+        Reports hit rates of caches of Dataverse status and datasets, of the process serving request. Available to
+        superusers only.
+
+        .. http:get:: /datatable/export-jobs/metrics/
+
+            :reqheader Authorization: optional Bearer (JWT) token to authenticate
+            :statuscode 200: no error
+            :statuscode 401: user unauthorized
+            :statuscode 403: user lacks permissions for this action
+
+        """
+        return Response(dataverse_clients.get_metrics())
@@ -3,6 +3,16 @@
 /app/docker/wait_for.sh ce_db:5432 -t 2 -- echo "Database (ce_db) is up!"
 /app/docker/wait_for.sh ce_mongo:27017 -t 2 -- echo "Database (ce_mongo) is up!"
 
+# Other services (eg. background worker) run their command once web container (ce_backend) has migrated database,
+# so migrations never run concurrently
+if [ "$#" -gt 0 ]; then
+    until plan=$(python /app/manage.py showmigrations --plan) && ! grep -q '\[ \]' <<< "$plan"; do
+        echo "Waiting for migrations..."
+        sleep 2
+    done
+    exec "$@"
+fi
+
 python /app/manage.py migrate
 python /app/manage.py collectstatic --noinput
 python /app/manage.py loaddata initial_groups.json